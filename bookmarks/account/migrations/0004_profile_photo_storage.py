@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:22
+
+from django.db import migrations, models
+import images.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_profile_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='photo',
+            field=models.ImageField(blank=True, db_index=True, storage=images.storage.ContentAddressedStorage(), upload_to='users/%Y/%m/%d/'),
+        ),
+    ]
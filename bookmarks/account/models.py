@@ -2,6 +2,8 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from images.storage import content_storage
+
 
 class Contact(models.Model):
     user_from = models.ForeignKey('auth.User',
@@ -39,7 +41,10 @@ class Profile(models.Model):
     # CASCADE: Delete profile, if user was deleted
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     date_of_birth = models.DateField(blank=True, null=True)
-    photo = models.ImageField(upload_to='users/%Y/%m/%d/', blank=True)
+    # stored under the SHA-256 of the content, like Image.image, see images/storage.py
+    photo = models.ImageField(upload_to='users/%Y/%m/%d/', storage=content_storage, blank=True, db_index=True)
+    # the names of the pre-generated thumbnails by alias, and their 'source' file, see images/thumbnails.py
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f'Profile for user {self.user.username}'
@@ -80,4 +80,6 @@ def user_list(request):
 @login_required
 def user_detail(request, username):
     user = get_object_or_404(User, username=username, is_active=True)
-    return render(request, 'account/user/detail.html', {'section': 'people', 'user': user})
+    # images that are still being downloaded have no file to show yet
+    images = user.images_created.ready()
+    return render(request, 'account/user/detail.html', {'section': 'people', 'user': user, 'images': images})
@@ -144,3 +144,27 @@ ABSOLUTE_URL_OVERRIDES = {
     # instead of writting our own get_absolute_url() method, we can create it here
     'auth.user': lambda u: reverse_lazy('user_detail', args=[u.username])
 }
+
+# Images
+# The thumbnails the templates show, generated in the background by THUMBNAIL_WORKERS processes whenever an image or a
+# profile photo is saved (see images/thumbnails.py). After adding an alias, run `python manage.py generate_thumbnails`.
+THUMBNAIL_ALIASES = {
+    'images.Image.image': {
+        'list': {'size': (300, 300), 'crop': 'smart'},
+        'detail': {'size': (300, 0)},
+    },
+    'account.Profile.photo': {
+        'avatar': {'size': (180, 180)},
+    },
+}
+THUMBNAIL_WORKERS = 2
+# Bookmarked images are downloaded in the background by this many threads per process (see images/ingest.py).
+IMAGES_FETCH_WORKERS = 4
+# A download fails if the image is larger (bytes), a read takes longer (seconds), or the whole download does.
+IMAGES_FETCH_MAX_SIZE = 10 * 1024 * 1024
+IMAGES_FETCH_TIMEOUT = 10
+IMAGES_FETCH_DEADLINE = 60
+# The number of users who like an image shown on its detail page, the total is counted in Image.total_likes.
+IMAGES_LIKERS_PREVIEW = 12
+# The most images whose likes image_likes returns or image_likes_update changes in one request.
+IMAGES_LIKES_BATCH_SIZE = 100
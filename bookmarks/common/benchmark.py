@@ -0,0 +1,187 @@
+"""
+Helpers for the benchmark commands. They seed their data inside a transaction that is rolled back at the end,
+so they can run against any database without leaving anything behind.
+
+EndpointBenchmark is the base of the benchmark_endpoints commands: it requests the endpoints of the project
+in-process with the test client and reports latency percentiles, throughput and queries per request. The results
+can be written as JSON and later passed as --baseline, which makes the command fail on regressions.
+
+mysite and bookmarks are separate projects without a shared package, so both have an identical copy of this
+module; mysite's blog.tests.SharedCodeTests fails if they differ, so a change goes into both copies.
+"""
+import json
+import math
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+# compared with the baseline, the latencies in milliseconds and the queries per request
+METRICS = ('p50', 'p95', 'p99', 'queries')
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def measure(func, repeat):
+    """
+    Returns the median duration of func() in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+def percentile(values, p):
+    """
+    The nearest-rank percentile of the sorted values.
+    """
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class Endpoint:
+    def __init__(self, name, request):
+        # request(client, i) makes the i-th request of the endpoint and returns the response
+        self.name = name
+        self.request = request
+
+    def run(self, client, requests, warmup):
+        for i in range(warmup):
+            self.call(client, i)
+        durations = []
+        queries = 0
+        start = time.perf_counter()
+        for i in range(warmup, warmup + requests):
+            with CaptureQueriesContext(connection) as captured:
+                began = time.perf_counter()
+                self.call(client, i)
+                durations.append((time.perf_counter() - began) * 1000)
+            queries += len(captured)
+        elapsed = time.perf_counter() - start
+        durations.sort()
+        return {
+            'requests': requests,
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'p99': percentile(durations, 99),
+            'mean': sum(durations) / requests,
+            'throughput': requests / elapsed,
+            'queries': queries / requests,
+        }
+
+    def call(self, client, i):
+        response = self.request(client, i)
+        if response.status_code >= 400:
+            raise CommandError(f'{self.name}: status {response.status_code}')
+        # the time of a streaming response includes producing its content
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions of the results against the baseline results, as (endpoint, metric, baseline, current)
+    tuples: latencies more than `tolerance` (a fraction) slower, or half a query per request more. Queries are an
+    average, e.g. the first requests of an endpoint may have to create rows the later ones only update.
+    """
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric in METRICS:
+            limit = before[metric] + 0.5 if metric == 'queries' else before[metric] * (1 + tolerance)
+            if current[metric] > limit:
+                regressions.append((name, metric, before[metric], current[metric]))
+    return regressions
+
+
+class EndpointBenchmark(BaseCommand):
+    """
+    Subclasses seed the data in seed() and return the Endpoints in endpoints(). Everything runs in a transaction
+    that is rolled back, with a cache and a media directory of its own.
+    """
+    help = 'Requests the endpoints of the project in-process and reports latency percentiles (ms), throughput ' \
+           '(requests/s) and queries per request. The seeded data is rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint first.')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', metavar='NAME',
+                            help='Only benchmark this endpoint, can be repeated.')
+        parser.add_argument('--json', metavar='PATH', help='Write the results as JSON, e.g. to use as baseline.')
+        parser.add_argument('--baseline', metavar='PATH', help='Fail if the results are worse than these.')
+        parser.add_argument('--tolerance', type=float, default=20,
+                            help='Percent the latencies may exceed the baseline (default 20).')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def seed(self, options):
+        raise NotImplementedError
+
+    def endpoints(self, options):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)['endpoints']
+
+        cache = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}}
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(CACHES=cache, MEDIA_ROOT=media, ALLOWED_HOSTS=['testserver']), rolled_back():
+            self.stderr.write('Seeding...')
+            self.seed(options)
+            endpoints = self.endpoints(options)
+            if options['endpoints']:
+                unknown = set(options['endpoints']) - {endpoint.name for endpoint in endpoints}
+                if unknown:
+                    raise CommandError(f'Unknown endpoint(s): {", ".join(sorted(unknown))}')
+                endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['endpoints']]
+            results = {}
+            self.stdout.write(f'{"endpoint":<20} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} '
+                              f'{"queries":>8}')
+            for endpoint in endpoints:
+                results[endpoint.name] = endpoint.run(self.client(), options['requests'], options['warmup'])
+                self.report(endpoint.name, results[endpoint.name])
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as file:
+                json.dump({'database': connection.vendor, 'endpoints': results}, file, indent=2)
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'] / 100)
+            for name, metric, before, current in regressions:
+                self.stdout.write(self.style.ERROR(f'{name}: {metric} {before:.2f} -> {current:.2f}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
+
+    def client(self):
+        """
+        The client of an endpoint, override to log in.
+        """
+        return Client()
+
+    def report(self, name, result):
+        self.stdout.write(f'{name:<20} {result["p50"]:>8.2f} {result["p95"]:>8.2f} {result["p99"]:>8.2f} '
+                          f'{result["throughput"]:>8.1f} {result["queries"]:>8.1f}')
@@ -0,0 +1,124 @@
+"""
+Keyset (cursor) pagination.
+
+django.core.paginator.Paginator needs a COUNT(*) for every page and fetches page N with OFFSET, which means the
+database has to walk over all rows before the page. CursorPaginator instead remembers the ordering values of the
+last row of a page and continues with `WHERE (publish, id) < (last_publish, last_id)`, which is an index seek no
+matter how deep the reader is. The price: there is no "page X of Y", only previous and next.
+
+mysite and bookmarks are separate projects without a shared package, so both have a copy of this module. The
+keyset pagination part (InvalidCursor, CursorPage, CursorPaginator) has to be the same in both; mysite's
+blog.tests.SharedCodeTests fails if it isn't, so a fix goes into both copies.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginates a queryset by the given ordering, e.g. ('-publish', '-id'). The last field has to be unique, so that
+    every row has a distinct position.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+    def page(self, cursor=None):
+        """
+        Returns the page after (or, for a cursor from previous_cursor, before) the given cursor.
+        Without a cursor the first page is returned. Raises InvalidCursor if the cursor can't be decoded.
+        """
+        if not cursor:
+            return self._page(self.queryset.order_by(*self.ordering), reverse=False, first=True)
+
+        values, reverse = self.decode_cursor(cursor)
+        ordering = [self._flip(name) for name in self.ordering] if reverse else self.ordering
+        queryset = self.queryset.filter(self._after(values, ordering)).order_by(*ordering)
+        return self._page(queryset, reverse=reverse, first=False)
+
+    def _page(self, queryset, reverse, first):
+        # fetch one object more than needed to find out if there is another page, instead of counting
+        objects = list(queryset[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if reverse:
+            objects.reverse()
+
+        next_cursor = previous_cursor = None
+        if objects:
+            if has_more or reverse:
+                next_cursor = self.encode_cursor(objects[-1], reverse=False)
+            if (has_more and reverse) or (not reverse and not first):
+                previous_cursor = self.encode_cursor(objects[0], reverse=True)
+        return CursorPage(objects, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    def _after(self, values, ordering):
+        """
+        Builds the keyset condition (a < x) OR (a = x AND b < y) OR ... for the given ordering.
+        """
+        condition = Q()
+        for i, name in enumerate(ordering):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            filters = {field.name: value for field, value in zip(self.fields[:i], values[:i])}
+            filters[f'{self.fields[i].name}__{lookup}'] = values[i]
+            condition |= Q(**filters)
+        return condition
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    def encode_cursor(self, obj, reverse):
+        values = [field.value_to_string(obj) for field in self.fields]
+        data = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(data)
+            if len(data['v']) != len(self.fields):
+                raise ValueError('Cursor does not match the ordering.')
+            values = [field.to_python(value) for field, value in zip(self.fields, data['v'])]
+            return values, bool(data['r'])
+        except (ValueError, TypeError, KeyError, ValidationError) as e:
+            raise InvalidCursor(str(e)) from e
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ImagesConfig(AppConfig):
     name = 'images'
+
+    def ready(self):
+        # connect the signal receivers
+        from . import signals  # noqa: F401
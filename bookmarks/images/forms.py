@@ -1,8 +1,4 @@
-from urllib import request
-
 from django import forms
-from django.core.files.base import ContentFile
-from django.utils.text import slugify
 
 from .models import Image
 
@@ -28,21 +24,10 @@ class ImageCreateForm(forms.ModelForm):
 
     def save(self, force_insert=False, force_update=False, commit=True):
         """
-        You could, for example, use the view that handles the form to download the image file.
-        Instead, let's take a more general approach by overriding the save() method of your model form to
-        perform this task every time the form is saved.
+        The image is downloaded in the background (see ingest.py), saving the form only stores the pending Image.
+        The caller enqueues the download after saving, with ingest.enqueue(image).
         """
         image = super().save(commit=False)  # save returns image object if commit=False
-        image_url = self.cleaned_data['url']
-        name = slugify(image.title)
-        extension = image_url.rsplit('.', 1)[1].lower()
-        image_name = f'{name}.{extension}'
-
-        # download image from url
-        response = request.urlopen(image_url)
-        # ContentFile: In this way, you save the file to the media directory of your project
-        # You pass the save=False parameter to avoid saving the object to the database yet
-        image.image.save(image_name, ContentFile(response.read()), save=False)
-
+        image.status = Image.PENDING
         if commit: image.save()  # only save if commit=True to respect the ModelForm.save() interface
         return image
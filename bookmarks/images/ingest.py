@@ -0,0 +1,175 @@
+"""
+Background download of bookmarked images.
+
+image_create stores the Image as pending and enqueues it here. A bounded pool of IMAGES_FETCH_WORKERS threads
+downloads the url in chunks to a temporary file, so neither the request nor the memory of the process depends on
+the remote server, and moves it to the storage. The download is cut off when the remote server is slower than
+IMAGES_FETCH_TIMEOUT seconds per read or IMAGES_FETCH_DEADLINE seconds in total, or when the image is larger than
+IMAGES_FETCH_MAX_SIZE bytes. The first bytes have to be a JPEG or PNG, whatever the Content-Type says.
+
+The image is marked ready afterwards, or failed with the reason in fetch_error. Images that are still pending
+after a restart are fetched by `python manage.py fetch_images`.
+"""
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.utils.text import slugify
+
+from . import thumbnails
+from .models import Image
+
+CHUNK_SIZE = 64 * 1024
+# the formats clean_url() accepts, by their first bytes
+SIGNATURES = {
+    b'\xff\xd8\xff': 'jpg',
+    b'\x89PNG\r\n\x1a\n': 'png',
+}
+
+_executor = None
+_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_setting('IMAGES_FETCH_WORKERS', 4),
+                                           thread_name_prefix='image-fetch')
+        return _executor
+
+
+def shutdown():
+    """
+    Waits for the queued downloads to finish.
+    """
+    global _executor
+    with _lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def enqueue(image):
+    """
+    Downloads the image in the background once the current transaction is committed.
+    """
+    transaction.on_commit(lambda: executor().submit(fetch, image.pk))
+
+
+def fetch(image_id):
+    """
+    Downloads a pending image and marks it ready or failed. Runs in a worker thread.
+    """
+    try:
+        image = Image.objects.filter(pk=image_id, status=Image.PENDING).first()
+        if image is None:
+            return
+        try:
+            with tempfile.TemporaryFile() as file:
+                extension = download(image.url, file)
+                image.image.save(f'{slugify(image.title) or "image"}.{extension}', File(file), save=False)
+        except (FetchError, OSError, ValueError) as error:
+            Image.objects.filter(pk=image_id, status=Image.PENDING) \
+                .update(status=Image.FAILED, fetch_error=str(error)[:200])
+            return
+        if not Image.objects.filter(pk=image_id, status=Image.PENDING) \
+                .update(status=Image.READY, image=image.image.name):
+            # deleted or fetched by someone else meanwhile
+            image.image.delete(save=False)
+            return
+        # update() doesn't send post_save
+        thumbnails.enqueue(image)
+    finally:
+        # every worker thread has its own database connection
+        connection.close()
+
+
+def download(url, file):
+    """
+    Streams the image at url into file and returns its extension. Raises FetchError if it is too slow, too large or
+    not an image; urllib raises OSError (URLError, HTTPError, timeouts) and ValueError (unknown url types).
+    """
+    max_size = _setting('IMAGES_FETCH_MAX_SIZE', 10 * 1024 * 1024)
+    timeout = _setting('IMAGES_FETCH_TIMEOUT', 10)
+    deadline = time.monotonic() + _setting('IMAGES_FETCH_DEADLINE', 60)
+    response = request.urlopen(request.Request(url, headers={'User-Agent': 'bookmarks'}),
+                               timeout=min(timeout, _setting('IMAGES_FETCH_DEADLINE', 60)))
+    with response:
+        content_type = response.headers.get_content_type()
+        # servers without a Content-Type are left to the sniffing below
+        if response.headers.get('Content-Type') and not content_type.startswith('image/') \
+                and content_type != 'application/octet-stream':
+            raise FetchError(f'Not an image: {content_type}')
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_size:
+            raise FetchError(f'The image is larger than {max_size} bytes.')
+
+        head = b''
+        extension = None
+        size = 0
+        while True:
+            chunk = _read(response, timeout, deadline)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise FetchError(f'The image is larger than {max_size} bytes.')
+            if extension is None:
+                # a server may send the first bytes one at a time, the signatures are at most 8 bytes long
+                head += chunk
+                extension = _sniff(head)
+                if extension == '':
+                    raise FetchError('Not a JPEG or PNG image.')
+            file.write(chunk)
+    if not extension:
+        raise FetchError('The image is empty.' if not size else 'Not a JPEG or PNG image.')
+    file.seek(0)
+    return extension
+
+
+def _sniff(head):
+    """
+    The extension of the image that starts with head, '' if it isn't an image, None if head is too short to tell.
+    """
+    for signature, extension in SIGNATURES.items():
+        if head[:len(signature)] == signature[:len(head)]:
+            return extension if len(head) >= len(signature) else None
+    return ''
+
+
+def _read(response, timeout, deadline):
+    """
+    Reads what the server sent so far, at most CHUNK_SIZE bytes. Waits at most until the deadline: read() would
+    block until a whole chunk arrived, which a server sending a few bytes at a time can stretch far beyond it.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise FetchError('The download took too long.')
+    # the socket of the connection, below http.client's buffer
+    sock = getattr(getattr(response.fp, 'raw', None), '_sock', None)
+    if sock is not None:
+        sock.settimeout(min(timeout, remaining))
+    try:
+        chunk = response.read1(CHUNK_SIZE)
+    except socket.timeout:
+        if time.monotonic() >= deadline:
+            raise FetchError('The download took too long.')
+        raise
+    if time.monotonic() > deadline:
+        raise FetchError('The download took too long.')
+    return chunk
@@ -0,0 +1,46 @@
+"""
+Like state of many images at once, for grids of images with a like button on each.
+
+states() returns whether the user likes each of the images and their total_likes in one query. apply() applies a
+batch of likes and unlikes in one transaction with a constant number of queries, however many images it changes:
+the rows of the images are locked first (in id order, so concurrent batches can't deadlock), which makes the likes
+of the user on them stable until the commit, then the new likes are inserted with one bulk_create(), the removed
+ones deleted with one DELETE and total_likes is moved by the difference. image_like applies a batch of one.
+"""
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from .models import Image
+
+Like = Image.users_like.through
+
+
+def states(user, ids):
+    """
+    Returns {image id: {'liked': bool, 'total_likes': int}} for the existing images of ids.
+    """
+    liked = Like.objects.filter(image_id=OuterRef('pk'), user_id=user.id)
+    images = Image.objects.filter(id__in=ids).annotate(liked=Exists(liked)).values_list('id', 'total_likes', 'liked')
+    return {image_id: {'liked': liked, 'total_likes': total_likes} for image_id, total_likes, liked in images}
+
+
+def apply(user, actions):
+    """
+    Applies {image id: True to like, False to unlike} for the user and returns the new states of the images, see
+    states(). Ids of images that don't exist are left out.
+    """
+    with transaction.atomic():
+        ids = list(Image.objects.select_for_update().filter(id__in=actions).order_by('id')
+                   .values_list('id', flat=True))
+        liked = set(Like.objects.filter(user_id=user.id, image_id__in=ids).values_list('image_id', flat=True))
+        like = [image_id for image_id in ids if actions[image_id] and image_id not in liked]
+        unlike = [image_id for image_id in ids if not actions[image_id] and image_id in liked]
+        if like:
+            # nothing conflicts while the images are locked, ignore_conflicts keeps a stray duplicate harmless
+            Like.objects.bulk_create([Like(image_id=image_id, user_id=user.id) for image_id in like],
+                                     ignore_conflicts=True)
+            Image.objects.filter(id__in=like).update(total_likes=F('total_likes') + 1)
+        if unlike:
+            Like.objects.filter(user_id=user.id, image_id__in=unlike).delete()
+            Image.objects.filter(id__in=unlike).update(total_likes=F('total_likes') - 1)
+    return states(user, ids)
@@ -0,0 +1,110 @@
+import io
+import json
+import random
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import Client
+from django.urls import reverse
+from PIL import Image as PILImage
+
+from account.models import Profile
+from common.benchmark import Endpoint, EndpointBenchmark
+from common.pagination import CursorPaginator
+from images.models import Image
+
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+
+class Command(EndpointBenchmark):
+    help = EndpointBenchmark.help + ' Endpoints: image_list, image_list_likes (most liked first), ' \
+                                    'image_list_ajax (the next pages of the infinite scroll), image_detail, ' \
+                                    'image_like, image_likes (the like states of a page), image_likes_update ' \
+                                    '(a batch of clicks on a page), user_list and user_detail, requested by a ' \
+                                    'logged in user.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--images', type=int, default=1000)
+        parser.add_argument('--likes', type=int, default=10, help='Likes per image.')
+        parser.add_argument('--files', type=int, default=8, help='Distinct image files the images share.')
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        # the files go to the temporary MEDIA_ROOT of the benchmark, like the thumbnails of the templates
+        files = [self.image_file(f'images/benchmark/{i}.jpg', rng) for i in range(options['files'])]
+        photos = [self.image_file(f'users/benchmark/{i}.jpg', rng) for i in range(options['files'])]
+
+        self.user = User.objects.create(username='benchmark', first_name='Benchmark')
+        User.objects.bulk_create(User(username=f'benchmark-{i}', first_name=f'User {i}')
+                                 for i in range(options['users']))
+        users = list(User.objects.filter(username__startswith='benchmark').values_list('id', flat=True))
+        Profile.objects.bulk_create(Profile(user_id=user_id, photo=photos[i % len(photos)])
+                                    for i, user_id in enumerate(users))
+
+        # bulk_create skips Image.save(), which sets the slug
+        Image.objects.bulk_create(
+            (Image(user_id=rng.choice(users), title=f'Image {i}', slug=f'image-{i}',
+                   url='https://example.com/image.jpg', image=files[i % len(files)])
+             for i in range(options['images'])),
+            batch_size=1000)
+        images = Image.objects.filter(slug__startswith='image-').values_list('id', flat=True)
+        Like = Image.users_like.through
+        Like.objects.bulk_create(
+            (Like(image_id=image_id, user_id=user_id)
+             for image_id in images for user_id in rng.sample(users, min(options['likes'], len(users)))),
+            batch_size=1000, ignore_conflicts=True)
+        Image.objects.filter(slug__startswith='image-').recount_likes()
+
+    @staticmethod
+    def image_file(name, rng):
+        content = io.BytesIO()
+        PILImage.new('RGB', (800, 600), tuple(rng.randrange(256) for _ in range(3))).save(content, 'JPEG')
+        return default_storage.save(name, ContentFile(content.getvalue()))
+
+    def client(self):
+        client = Client()
+        client.force_login(self.user)
+        return client
+
+    def endpoints(self, options):
+        images = list(Image.objects.filter(slug__startswith='image-').order_by('-id')[:100])
+        users = list(User.objects.filter(username__startswith='benchmark-').values_list('username', flat=True)[:100])
+        # the cursors of the pages the infinite scroll loads after the first one
+        paginator = CursorPaginator(Image.objects.all(), 8, ordering=('-created', '-id'))
+        cursors = []
+        page = paginator.page()
+        while page.has_next() and len(cursors) < 20:
+            cursors.append(page.next_cursor)
+            page = paginator.page(page.next_cursor)
+
+        def like(client, i):
+            # likes an image and unlikes it with the next request
+            image = images[i // 2 % len(images)]
+            return client.post(reverse('images:like'), {'id': image.id, 'action': 'unlike' if i % 2 else 'like'},
+                               **AJAX)
+
+        def like_batch(client, i):
+            # likes the images of a page and unlikes them with the next request
+            page = images[i // 2 * 8 % len(images):][:8]
+            operations = [{'id': image.id, 'action': 'unlike' if i % 2 else 'like'} for image in page]
+            return client.post(reverse('images:likes_update'), json.dumps({'operations': operations}),
+                               content_type='application/json', **AJAX)
+
+        return [
+            Endpoint('image_list', lambda client, i: client.get(reverse('images:list'))),
+            Endpoint('image_list_likes', lambda client, i: client.get(reverse('images:list'), {'order': 'likes'})),
+            Endpoint('image_list_ajax', lambda client, i: client.get(
+                reverse('images:list'), {'cursor': cursors[i % len(cursors)]} if cursors else {}, **AJAX)),
+            Endpoint('image_detail', lambda client, i: client.get(images[i % len(images)].get_absolute_url())),
+            Endpoint('image_like', like),
+            Endpoint('image_likes', lambda client, i: client.get(
+                reverse('images:likes'), {'ids': ','.join(str(image.id) for image in images[i * 8 % len(images):][:8])},
+                **AJAX)),
+            Endpoint('image_likes_update', like_batch),
+            Endpoint('user_list', lambda client, i: client.get(reverse('user_list'))),
+            Endpoint('user_detail',
+                     lambda client, i: client.get(reverse('user_detail', args=[users[i % len(users)]]))),
+        ]
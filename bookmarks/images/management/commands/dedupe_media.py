@@ -0,0 +1,87 @@
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from images import storage, thumbnails
+from images.models import StoredFile
+
+
+class Command(BaseCommand):
+    help = 'Moves the images and profile photos stored before the content-addressed storage into it, so that ' \
+           'identical files are stored once, recounts the references of the stored files and deletes the files ' \
+           'nothing references. Rows are processed in batches of ids and files are hashed in chunks, memory ' \
+           'doesn\'t grow with the media. Run it while no one uploads, a file that is being saved has no row yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        for model in thumbnails.models():
+            field = thumbnails.FIELDS[model._meta.label]
+            last_id = 0
+            while True:
+                rows = list(model.objects.filter(id__gt=last_id).exclude(**{field: ''}).order_by('id')
+                            .values_list('id', field)[:options['batch_size']])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                for pk, name in rows:
+                    if storage.is_content_name(name):
+                        continue
+                    try:
+                        moved += self.move(model, field, pk, name)
+                    except FileNotFoundError:
+                        missing += 1
+                        self.stderr.write(f'{model._meta.label} {pk}: {name} does not exist.')
+
+        recounted, deleted = self.recount(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} file(s), {missing} missing. Recounted {recounted} stored file(s), deleted {deleted} '
+            f'unreferenced file(s). Run generate_thumbnails for the moved files.'))
+
+    @staticmethod
+    def move(model, field, pk, name):
+        file_storage = model._meta.get_field(field).storage
+        with file_storage.open(name) as file:
+            # takes the reference of the row
+            new_name = file_storage.save(name, file)
+        # the thumbnails are those of the old name
+        if not model.objects.filter(pk=pk, **{field: name}).update(**{field: new_name, 'thumbnails': {}}):
+            # the row got another file meanwhile
+            file_storage.delete(new_name)
+            return 0
+        if not any(other.objects.filter(**{thumbnails.FIELDS[other._meta.label]: name}).exists()
+                   for other in thumbnails.models()):
+            # the old file isn't counted, FileSystemStorage deletes it right away
+            FileSystemStorage.delete(file_storage, name)
+            thumbnails.delete(name)
+        return 1
+
+    @staticmethod
+    def recount(batch_size):
+        recounted = deleted = 0
+        last_id = 0
+        while True:
+            stored = list(StoredFile.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not stored:
+                return recounted, deleted
+            last_id = stored[-1].id
+            names = [stored_file.name for stored_file in stored]
+            references = Counter()
+            for model in thumbnails.models():
+                field = thumbnails.FIELDS[model._meta.label]
+                references.update(dict(model.objects.filter(**{f'{field}__in': names}).order_by()
+                                       .values(field).annotate(count=Count('id')).values_list(field, 'count')))
+            for stored_file in stored:
+                count = references[stored_file.name]
+                if count == stored_file.references:
+                    continue
+                recounted += 1
+                # the last reference is released like any other, which deletes the file
+                StoredFile.objects.filter(pk=stored_file.pk).update(references=max(count, 1))
+                if not count:
+                    storage.content_storage.delete(stored_file.name)
+                    deleted += 1
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from images import ingest
+from images.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Downloads the images that are still pending, e.g. because the process that queued them was restarted. ' \
+           'Run it while no server is downloading, otherwise an image may be downloaded twice.'
+
+    def handle(self, *args, **options):
+        pending = list(Image.objects.filter(status=Image.PENDING).values_list('id', flat=True))
+        pool = ingest.executor()
+        for image_id in pending:
+            pool.submit(ingest.fetch, image_id)
+        ingest.shutdown()
+        ready = Image.objects.filter(id__in=pending, status=Image.READY).count()
+        self.stdout.write(self.style.SUCCESS(f'Downloaded {ready} of {len(pending)} pending image(s).'))
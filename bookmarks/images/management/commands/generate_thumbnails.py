@@ -0,0 +1,49 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from images import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Generates the thumbnails of all images and profile photos whose thumbnails are missing or were made ' \
+           'from another file, in parallel worker processes (THUMBNAIL_WORKERS).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help='Regenerate existing thumbnails too, e.g. after '
+                                                                'changing an alias.')
+
+    def handle(self, *args, **options):
+        self.generated = self.failed = 0
+        # at most two batches are in flight: the next one is queued before the previous one is waited for, so the
+        # pool doesn't run dry at the batch boundaries
+        pending = {}
+        for model in thumbnails.models():
+            field = thumbnails.FIELDS[model._meta.label]
+            last_id = 0
+            while True:
+                # walk the rows in id ranges
+                rows = list(model.objects.filter(id__gt=last_id).exclude(**{field: ''}).order_by('id')
+                            .values_list('id', field, 'thumbnails')[:options['batch_size']])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                # rows with the same file share its thumbnails, they are generated once
+                names = {name for pk, name, existing in rows if options['all'] or existing.get('source') != name}
+                submitted = {thumbnails.submit(model, name): name for name in names}
+                self.wait(pending)
+                pending = submitted
+        self.wait(pending)
+        # the names are stored by the pool after the futures are done
+        thumbnails.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated the thumbnails of {self.generated} file(s), {self.failed} failed.'))
+
+    def wait(self, futures):
+        for future in as_completed(futures):
+            if future.exception():
+                self.failed += 1
+                self.stderr.write(f'{futures[future]}: {future.exception()}')
+            else:
+                self.generated += 1
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-created', '-id'], name='images_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0002_image_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='fetch_error',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='images/%Y/%m/%d/'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:22
+
+from django.db import migrations, models
+import images.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0004_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, storage=images.storage.ContentAddressedStorage(), upload_to='images/%Y/%m/%d/'),
+        ),
+    ]
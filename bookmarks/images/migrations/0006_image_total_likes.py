@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:24
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_likes(apps, schema_editor):
+    Image = apps.get_model('images', 'Image')
+    likes = Image.users_like.through.objects.filter(image_id=OuterRef('pk')).order_by().values('image_id') \
+        .annotate(total=Count('pk')).values('total')
+    Image.objects.update(total_likes=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0005_storedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='total_likes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-total_likes', '-id'], name='images_total_likes_id_idx'),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,25 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.text import slugify
 
 from django.conf import settings
 
+from .storage import content_storage
+
+
+class ImageQuerySet(models.QuerySet):
+    def ready(self):
+        return self.filter(status=Image.READY)
+
+    def recount_likes(self):
+        """
+        Sets total_likes from the likes, for likes that were added without image_like, e.g. with bulk_create().
+        """
+        likes = Image.users_like.through.objects.filter(image_id=models.OuterRef('pk')).order_by() \
+            .values('image_id').annotate(total=models.Count('pk')).values('total')
+        return self.update(total_likes=Coalesce(models.Subquery(likes), 0))
+
 
 class Image(models.Model):
     """
@@ -12,21 +28,52 @@ class Image(models.Model):
     unique=True imply the creation of an index. You can also use Meta.index_together or Meta.indexes
     to create indexes for multiple fields.
     """
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+
     # CASCADE: delete images if a user is deleted!
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='images_created', on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, blank=True)  # for SEO friendly URLS
     url = models.URLField()
-    image = models.ImageField(upload_to='images/%Y/%m/%d/')
+    # empty until the image is downloaded from the url, see ingest.py
+    # stored under the SHA-256 of the content, identical images share one file, see storage.py
+    image = models.ImageField(upload_to='images/%Y/%m/%d/', storage=content_storage, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY)
+    fetch_error = models.CharField(max_length=200, blank=True)
+    # the names of the pre-generated thumbnails by alias, and their 'source' file, see thumbnails.py
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(blank=True)
     created = models.DateField(auto_now_add=True, db_index=True)  # create a DB index for this field to search fast!!
 
     # many to many relationship: one user can like several images and one images can be liked by several users
     users_like = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='images_liked', blank=True)
+    # the number of users_like, updated together with it in image_like instead of counted on every page
+    total_likes = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ImageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # matches the ordering of the keyset pagination in image_list
+            models.Index(fields=['-created', '-id'], name='images_created_id_idx'),
+            # matches the "most liked" ordering of image_list
+            models.Index(fields=['-total_likes', '-id'], name='images_total_likes_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def is_ready(self):
+        return self.status == self.READY
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
@@ -38,3 +85,15 @@ class Image(models.Model):
         compare with our URL definition to GET a specific post
         """
         return reverse('images:detail', args=[self.id, self.slug])
+
+
+class StoredFile(models.Model):
+    """
+    A file of the content-addressed storage and the number of Image and Profile rows referencing it, see storage.py.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    size = models.PositiveIntegerField(default=0)
+    references = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
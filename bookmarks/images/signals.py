@@ -0,0 +1,39 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from account.models import Profile
+from . import thumbnails
+from .models import Image
+
+
+def _file(instance):
+    return getattr(instance, thumbnails.FIELDS[instance._meta.label])
+
+
+@receiver(post_init, sender=Image)
+@receiver(post_init, sender=Profile)
+def remember_file(sender, instance, **kwargs):
+    # the file the row was loaded with, which is released when the row gets another one. Read from __dict__, a
+    # deferred field would be loaded otherwise
+    value = instance.__dict__.get(thumbnails.FIELDS[sender._meta.label])
+    instance._stored_file = getattr(value, 'name', value) or ''
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=Profile)
+def generate_thumbnails(sender, instance, **kwargs):
+    file = _file(instance)
+    previous, instance._stored_file = instance._stored_file, file.name or ''
+    if previous and previous != file.name:
+        # the new file took its reference when it was stored, see storage.py
+        file.storage.delete(previous)
+    # a new or changed file, the thumbnails are generated in the background
+    thumbnails.enqueue(instance)
+
+
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=Profile)
+def release_file(sender, instance, **kwargs):
+    file = _file(instance)
+    if file.name:
+        file.storage.delete(file.name)
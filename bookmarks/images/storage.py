@@ -0,0 +1,133 @@
+"""
+Content-addressed storage for Image.image and Profile.photo.
+
+Users bookmark the same popular images again and again. Instead of writing a new copy under the upload_to directory
+each time, a file is stored under the SHA-256 of its bytes, content/<ab>/<cd>/<sha256>.<ext>, so identical files
+share one stored file and, since thumbnails are named after their source (see thumbnails.py), one set of thumbnails.
+
+Every stored file has a StoredFile row counting the rows that reference it:
+
+- save() takes a reference for the name it returns, before writing the file if it doesn't exist yet
+- delete() releases a reference; the file and its thumbnails are only deleted when the last one is released, after
+  the releasing transaction committed and if no reference was taken meanwhile
+
+The rows release their file when they are deleted or get another file (see signals.py). A save whose row is never
+saved keeps its reference, which leaves a file behind rather than deleting one that's in use;
+`python manage.py dedupe_media` recounts the references and moves files stored before this storage existed.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+PREFIX = 'content'
+# extensions that name the same format
+EXTENSIONS = {
+    '.jpeg': '.jpg',
+}
+
+
+def content_name(content, name):
+    """
+    The name of the file content under its SHA-256, with the extension of name. Reads the content in chunks.
+    """
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    digest = sha256.hexdigest()
+    extension = os.path.splitext(name)[1].lower()
+    return posixpath.join(PREFIX, digest[:2], digest[2:4], digest + EXTENSIONS.get(extension, extension))
+
+
+def is_content_name(name):
+    return name.startswith(PREFIX + '/')
+
+
+def acquire(name, size=0):
+    StoredFile = apps.get_model('images', 'StoredFile')
+    if not StoredFile.objects.filter(name=name).update(references=F('references') + 1):
+        # the first reference, or a concurrent first reference won the insert
+        StoredFile.objects.bulk_create([StoredFile(name=name, size=size, references=0)], ignore_conflicts=True)
+        StoredFile.objects.filter(name=name).update(references=F('references') + 1)
+
+
+def release(name, storage):
+    StoredFile = apps.get_model('images', 'StoredFile')
+    with transaction.atomic():
+        stored = StoredFile.objects.select_for_update().filter(name=name).first()
+        if stored is None:
+            # not stored by this storage, e.g. before dedupe_media moved it
+            return
+        if stored.references > 1:
+            StoredFile.objects.filter(pk=stored.pk).update(references=F('references') - 1)
+            return
+        stored.delete()
+        transaction.on_commit(lambda: _delete_unreferenced(name, storage))
+
+
+def _delete_unreferenced(name, storage):
+    from . import thumbnails
+
+    StoredFile = apps.get_model('images', 'StoredFile')
+    # a save of the same content may have taken a new reference since
+    if not StoredFile.objects.filter(name=name).exists():
+        FileSystemStorage.delete(storage, name)
+        thumbnails.delete(name)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores files under the SHA-256 of their content and counts their references, see the module docstring.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = content_name(content, name)
+        # the reference is taken first, so that the file can't be deleted between exists() and returning the name
+        acquire(name, content.size)
+        if not self.exists(name):
+            self._save(name, content)
+        return name
+
+    def _save(self, name, content):
+        """
+        Writes to a temporary file next to the final one and renames it, a concurrent save of the same content
+        replaces the file with identical bytes instead of getting another name.
+        """
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+    def delete(self, name):
+        """
+        Releases a reference to the file, it is deleted with the last one.
+        """
+        if name:
+            release(name, self)
+
+
+content_storage = ContentAddressedStorage()
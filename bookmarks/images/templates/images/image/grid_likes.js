@@ -0,0 +1,68 @@
+  /* Like buttons of an image grid: the states of all buttons of a page are loaded with one request, and clicks are
+     collected for a moment and sent as one batch */
+  var pending_likes = {};  // image id -> 'like' or 'unlike', the last click wins
+  var flush_timer = null;
+
+  function showLikes(images) {
+    $.each(images, function(id, state) {
+      // a click that is not sent yet is newer than the state of the server
+      if (id in pending_likes) {
+        return;
+      }
+      var button = $('a.grid-like[data-id="' + id + '"]');
+      button.data('action', state.liked ? 'unlike' : 'like').text(state.liked ? 'Unlike' : 'Like');
+      button.siblings('.count').find('.total').text(state.total_likes);
+    });
+  }
+
+  function loadLikes(container) {
+    var ids = container.find('a.grid-like').filter(function() {
+      return !$(this).data('action');
+    }).map(function() {
+      return $(this).data('id');
+    }).get();
+    if (ids.length == 0) {
+      return;
+    }
+    $.get('{% url "images:likes" %}', {ids: ids.join(',')}, function(data) {
+      if (data['status'] == 'ok') {
+        showLikes(data['images']);
+      }
+    });
+  }
+
+  function flushLikes() {
+    flush_timer = null;
+    var operations = $.map(pending_likes, function(action, id) {
+      return {id: id, action: action};
+    });
+    pending_likes = {};
+    $.ajax({
+      url: '{% url "images:likes_update" %}',
+      type: 'POST',
+      contentType: 'application/json',
+      data: JSON.stringify({operations: operations}),
+      success: function(data) {
+        if (data['status'] == 'ok') {
+          showLikes(data['images']);
+        }
+      }
+    });
+  }
+
+  $(document).on('click', 'a.grid-like', function(e) {
+    e.preventDefault();
+    var button = $(this);
+    var action = button.data('action');
+    if (!action) {
+      return;
+    }
+    // shown right away, the server's totals arrive with the answer of the batch
+    var total = button.siblings('.count').find('.total');
+    total.text(parseInt(total.text()) + (action == 'like' ? 1 : -1));
+    button.data('action', action == 'like' ? 'unlike' : 'like').text(action == 'like' ? 'Unlike' : 'Like');
+    pending_likes[button.data('id')] = action;
+    if (flush_timer === null) {
+      flush_timer = setTimeout(flushLikes, 300);
+    }
+  });
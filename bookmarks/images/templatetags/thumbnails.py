@@ -0,0 +1,18 @@
+from django import template
+from easy_thumbnails.storage import thumbnail_default_storage
+
+register = template.Library()
+
+
+@register.filter
+def pregenerated_url(file, alias):
+    """
+    The URL of the pre-generated thumbnail of an image field, e.g. {{ image.image|pregenerated_url:'list' }}, or the
+    URL of the original while the thumbnail is being generated. Never generates a thumbnail, see images/thumbnails.py.
+    """
+    if not file:
+        return ''
+    thumbnails = file.instance.thumbnails
+    if thumbnails.get('source') == file.name and alias in thumbnails:
+        return thumbnail_default_storage.url(thumbnails[alias])
+    return file.url
@@ -1,3 +1,526 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image as PILImage
+
+from account.models import Profile
+from images import ingest, thumbnails
+from images.models import Image, StoredFile
+
+
+def jpeg(size=(40, 30)):
+    content = io.BytesIO()
+    PILImage.new('RGB', size, (200, 30, 30)).save(content, 'JPEG')
+    return content.getvalue()
+
+
+class ImageServer(BaseHTTPRequestHandler):
+    """
+    Stand-in for the sites images are bookmarked from.
+    """
+    routes = {
+        '/photo.jpg': ('image/jpeg', jpeg()),
+        # HTML, although the Content-Type claims otherwise
+        '/fake.jpg': ('image/jpeg', b'<html>not an image</html>'),
+        '/page.jpg': ('text/html', b'<html></html>'),
+        # no Content-Length, the body only ends when the connection is closed
+        '/huge.jpg': ('image/jpeg', b'\xff\xd8\xff' + b'\0' * 300 * 1024),
+    }
+
+    def do_GET(self):
+        if self.path == '/trickle.jpg':
+            self.trickle()
+            return
+        if self.path == '/slow.jpg':
+            time.sleep(1)
+        content_type, body = self.routes.get(self.path, ('text/html', None))
+        if body is None and self.path != '/slow.jpg':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if self.path != '/huge.jpg':
+            self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        try:
+            self.wfile.write(body or b'')
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading, e.g. because the image is too large
+            pass
+
+    def trickle(self):
+        # a JPEG one byte every 0.05 seconds: every read gets something before IMAGES_FETCH_TIMEOUT, but the whole
+        # image takes 50 seconds
+        body = jpeg() + b'\0' * 1000
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            for i in range(len(body)):
+                self.wfile.write(body[i:i + 1])
+                self.wfile.flush()
+                time.sleep(0.05)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class ServerMixin:
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageServer)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.media = tempfile.mkdtemp()
+        cls.settings = override_settings(MEDIA_ROOT=cls.media, IMAGES_FETCH_MAX_SIZE=100 * 1024,
+                                         IMAGES_FETCH_TIMEOUT=0.3)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        shutil.rmtree(cls.media)
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_address[1]}{path}'
+
+
+class ImageFetchTests(ServerMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user')
+
+    def pending(self, path):
+        return Image.objects.create(user=self.user, title='A photo', url=self.url(path), status=Image.PENDING)
+
+    def fetched(self, path):
+        image = self.pending(path)
+        with self.keep_connection():
+            ingest.fetch(image.pk)
+        image.refresh_from_db()
+        return image
+
+    @staticmethod
+    def keep_connection():
+        # a worker closes its database connection when it's done, the test transaction needs it
+        return mock.patch('images.ingest.connection')
+
+    def test_downloads_image(self):
+        image = self.fetched('/photo.jpg')
+        self.assertEqual(image.status, Image.READY)
+        self.assertRegex(image.image.name, r'^content/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        with image.image.open('rb') as file:
+            self.assertEqual(file.read(), jpeg())
+
+    def test_failures(self):
+        for path, error in (('/fake.jpg', 'Not a JPEG or PNG image.'),
+                            ('/page.jpg', 'Not an image: text/html'),
+                            ('/huge.jpg', 'The image is larger than 102400 bytes.'),
+                            ('/slow.jpg', 'timed out'),
+                            ('/missing.jpg', 'HTTP Error 404')):
+            with self.subTest(path):
+                image = self.fetched(path)
+                self.assertEqual(image.status, Image.FAILED)
+                self.assertIn(error, image.fetch_error)
+                self.assertFalse(image.image)
+
+    @override_settings(IMAGES_FETCH_DEADLINE=1)
+    def test_deadline_of_a_trickling_server(self):
+        start = time.monotonic()
+        image = self.fetched('/trickle.jpg')
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(image.status, Image.FAILED)
+        self.assertEqual(image.fetch_error, 'The download took too long.')
+
+    def test_ready_images_only_are_listed(self):
+        ready = self.fetched('/photo.jpg')
+        self.pending('/photo.jpg')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('images:list'))
+        self.assertEqual(list(response.context['images']), [ready])
+        response = self.client.get(reverse('user_detail', args=[self.user.username]))
+        self.assertEqual(list(response.context['images']), [ready])
+
+    def test_create_enqueues_the_download(self):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('images:create'),
+                                        {'title': 'A photo', 'url': self.url('/photo.jpg')})
+        image = Image.objects.get()
+        self.assertEqual(image.status, Image.PENDING)
+        self.assertRedirects(response, image.get_absolute_url())
+        # the detail page doesn't wait for the download
+        self.assertContains(self.client.get(image.get_absolute_url()), 'is being downloaded')
+
+        # the callback submits the download to the pool, the test runs it in its own thread instead
+        with mock.patch('images.ingest.executor') as executor:
+            callbacks[0]()
+        executor().submit.assert_called_once_with(ingest.fetch, image.pk)
+        with self.keep_connection():
+            ingest.fetch(image.pk)
+        self.assertContains(self.client.get(image.get_absolute_url()), 'class="image-detail"')
+
+
+class ImageFetchWorkerTests(ServerMixin, TransactionTestCase):
+
+    # the in-memory SQLite test database locks tables between threads
+    @override_settings(IMAGES_FETCH_WORKERS=1)
+    @mock.patch('images.thumbnails.enqueue')
+    def test_workers_download_pending_images(self, enqueue_thumbnails):
+        user = User.objects.create_user('user')
+        for path in ('/photo.jpg', '/photo.jpg', '/photo.jpg', '/fake.jpg'):
+            Image.objects.create(user=user, title='A photo', url=self.url(path), status=Image.PENDING)
+        out = StringIO()
+        call_command('fetch_images', stdout=out)
+        self.assertIn('Downloaded 3 of 4 pending image(s).', out.getvalue())
+        self.assertEqual(Image.objects.filter(status=Image.FAILED).count(), 1)
+        enqueue_thumbnails.assert_called()
+
+
+class MediaMixin:
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def image(self, user, title='A photo'):
+        name = default_storage.save('images/photo.jpg', ContentFile(jpeg((800, 600))))
+        return Image.objects.create(user=user, title=title, url='https://example.com/photo.jpg', image=name)
+
+
+class ThumbnailTests(MediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user')
+
+    def test_new_files_are_enqueued(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            image = self.image(self.user)
+        self.assertEqual(len(callbacks), 1)
+        with mock.patch('images.thumbnails.submit') as submit:
+            callbacks[0]()
+        submit.assert_called_once_with(Image, image.image.name)
+
+        image.thumbnails = thumbnails.generate(image.image.name, 'images.Image.image')
+        # saving without a new file doesn't generate them again
+        with self.captureOnCommitCallbacks() as callbacks:
+            image.save()
+        self.assertEqual(callbacks, [])
+
+    def test_generate_every_alias(self):
+        image = self.image(self.user)
+        generated = thumbnails.generate(image.image.name, 'images.Image.image')
+        self.assertEqual(set(generated), {'source', 'list', 'detail'})
+        self.assertEqual(generated['source'], image.image.name)
+        for alias, size in (('list', (300, 300)), ('detail', (300, 225))):
+            with default_storage.open(generated[alias]) as file:
+                self.assertEqual(PILImage.open(file).size, size)
+
+    def test_templates_never_generate(self):
+        image = self.image(self.user)
+        self.client.force_login(self.user)
+        with mock.patch('easy_thumbnails.files.Thumbnailer.generate_thumbnail') as generate:
+            response = self.client.get(reverse('images:list'))
+        generate.assert_not_called()
+        # the original until the thumbnails are generated
+        self.assertContains(response, f'<img src="{image.image.url}">')
+
+        future = mock.Mock()
+        future.result.return_value = thumbnails.generate(image.image.name, 'images.Image.image')
+        thumbnails.store(Image, image.image.name, future, close=False)
+        response = self.client.get(reverse('images:list'))
+        self.assertContains(response, f'<img src="/media/{future.result.return_value["list"]}">')
+        response = self.client.get(image.get_absolute_url())
+        self.assertContains(response, f'src="/media/{future.result.return_value["detail"]}"')
+
+    def test_generate_thumbnails_queues_the_next_batch_before_waiting(self):
+        with mock.patch('images.thumbnails.enqueue'):
+            for title in ('one', 'two', 'three'):
+                self.image(self.user, title)
+        events = []
+
+        def submit(model, name):
+            events.append('submit')
+            future = Future()
+            future.set_result({})
+            return future
+
+        def as_completed(futures):
+            events.append(f'wait for {len(futures)}')
+            return iter(futures)
+
+        with mock.patch('images.thumbnails.submit', submit), mock.patch('images.thumbnails.shutdown'), \
+                mock.patch('images.management.commands.generate_thumbnails.as_completed', as_completed):
+            call_command('generate_thumbnails', '--batch-size=1', stdout=StringIO())
+        self.assertEqual(events, ['submit', 'wait for 0', 'submit', 'wait for 1', 'submit', 'wait for 1',
+                                  'wait for 1'])
+
+    def test_thumbnails_of_a_replaced_file_are_not_stored(self):
+        image = self.image(self.user)
+        future = mock.Mock()
+        future.result.return_value = {'source': 'images/old.jpg', 'list': 'images/old.jpg.300x300.jpg'}
+        thumbnails.store(Image, 'images/old.jpg', future, close=False)
+        image.refresh_from_db()
+        self.assertEqual(image.thumbnails, {})
+
+
+class ThumbnailWorkerTests(MediaMixin, TransactionTestCase):
+
+    @override_settings(THUMBNAIL_WORKERS=1)
+    def test_generate_missing_thumbnails(self):
+        user = User.objects.create_user('user')
+        with mock.patch('images.thumbnails.enqueue'):
+            image = self.image(user)
+            photo = default_storage.save('users/photo.jpg', ContentFile(jpeg((400, 400))))
+            profile = Profile.objects.create(user=user, photo=photo)
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('Generated the thumbnails of 2 file(s), 0 failed.', out.getvalue())
+        image.refresh_from_db()
+        profile.refresh_from_db()
+        self.assertEqual(set(image.thumbnails), {'source', 'list', 'detail'})
+        self.assertEqual(set(profile.thumbnails), {'source', 'avatar'})
+
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('Generated the thumbnails of 0 file(s)', out.getvalue())
+
+
+class ContentStorageTests(MediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user')
+        cls.photo = jpeg((40, 30))
+
+    def setUp(self):
+        super().setUp()
+        # the thumbnails aren't generated
+        patcher = mock.patch('images.thumbnails.submit')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create(self, data=None, filename='photo.jpg'):
+        image = Image(user=self.user, title='A photo', url='https://example.com/photo.jpg')
+        image.image.save(filename, ContentFile(data or self.photo))
+        return image
+
+    def test_identical_files_are_stored_once(self):
+        first = self.create()
+        second = self.create(filename='copy.JPEG')
+        other = self.create(jpeg((30, 40)))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('content/'))
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(StoredFile.objects.get(name=first.image.name).references, 2)
+        with first.image.open() as file:
+            self.assertEqual(file.read(), self.photo)
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        first, second = self.create(), self.create()
+        name = first.image.name
+        default_storage.save(f'{name}.300x300_q85_crop-smart.jpg', ContentFile(b'thumbnail'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(f'{name}.300x300_q85_crop-smart.jpg'))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_replaced_file_is_released(self):
+        profile = Profile.objects.create(user=self.user)
+        profile.photo.save('photo.jpg', ContentFile(self.photo))
+        old = profile.photo.name
+        profile = Profile.objects.get(pk=profile.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.photo.save('other.jpg', ContentFile(jpeg((30, 40))))
+        self.assertFalse(default_storage.exists(old))
+        self.assertTrue(default_storage.exists(profile.photo.name))
+
+    def test_identical_files_share_thumbnails(self):
+        first = self.create()
+        future = mock.Mock()
+        future.result.return_value = {'source': first.image.name, 'list': f'{first.image.name}.list.jpg'}
+        thumbnails.store(Image, first.image.name, future, close=False)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            second = self.create()
+        self.assertEqual(callbacks, [])
+        second.refresh_from_db()
+        self.assertEqual(second.thumbnails, future.result.return_value)
+
+    def test_dedupe_media(self):
+        legacy = [default_storage.save('images/2020/01/01/photo.jpg', ContentFile(self.photo)) for _ in range(2)]
+        images = [Image.objects.create(user=self.user, title='A photo', url='https://example.com/photo.jpg',
+                                       image=name) for name in legacy]
+        # a reference that was never released
+        leaked = self.create(jpeg((30, 40)))
+        Image.objects.filter(pk=leaked.pk).update(image='')
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', batch_size=1, stdout=out)
+        self.assertIn('Moved 2 file(s), 0 missing. Recounted 1 stored file(s), deleted 1', out.getvalue())
+        names = {image.image.name for image in Image.objects.filter(pk__in=[image.pk for image in images])}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(name.startswith('content/'))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+        for name in legacy:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(leaked.image.name))
+
+
+class LikeTests(MediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user', first_name='Liker')
+        Profile.objects.create(user=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def like(self, image, action='like'):
+        response = self.client.post(reverse('images:like'), {'id': image.id, 'action': action},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        image.refresh_from_db()
+        return response.json()
+
+    def test_like_and_unlike(self):
+        image = self.image(self.user)
+        self.assertEqual(self.like(image), {'status': 'ok', 'total_likes': 1})
+        # liking twice counts once
+        self.assertEqual(self.like(image), {'status': 'ok', 'total_likes': 1})
+        self.assertEqual(list(image.users_like.all()), [self.user])
+        self.assertEqual(self.like(image, 'unlike'), {'status': 'ok', 'total_likes': 0})
+        self.assertEqual(self.like(image, 'unlike'), {'status': 'ok', 'total_likes': 0})
+        self.assertFalse(image.users_like.exists())
+        self.assertEqual(self.client.post(reverse('images:like'), {'id': 'x', 'action': 'like'},
+                                          HTTP_X_REQUESTED_WITH='XMLHttpRequest').json(), {'status': 'error'})
+
+    @override_settings(IMAGES_LIKERS_PREVIEW=3)
+    def test_detail_doesnt_load_every_liker(self):
+        image = self.image(self.user)
+        others = [User.objects.create_user(f'other-{i}', first_name=f'Other {i}') for i in range(10)]
+        Profile.objects.bulk_create(Profile(user=other) for other in others)
+        image.users_like.add(*others[:2])
+        image.refresh_from_db()
+        with self.assertNumQueries(5) as queries:
+            response = self.client.get(image.get_absolute_url())
+        self.assertContains(response, 'data-action="like"')
+
+        image.users_like.add(*others[2:], self.user)
+        Image.objects.filter(pk=image.pk).recount_likes()
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(image.get_absolute_url())
+        self.assertContains(response, '<span class="total">11</span>')
+        self.assertContains(response, 'data-action="unlike"')
+        self.assertEqual(len(response.context['likers']), 3)
+
+    def test_most_liked_ordering(self):
+        images = [self.image(self.user, title=f'Image {i}') for i in range(10)]
+        for likes, image in zip((3, 0, 5, 1, 5, 0, 2, 7, 0, 1), images):
+            Image.objects.filter(pk=image.pk).update(total_likes=likes)
+        expected = list(Image.objects.order_by('-total_likes', '-id').values_list('id', flat=True))
+
+        response = self.client.get(reverse('images:list'), {'order': 'likes'})
+        page = response.context['images']
+        self.assertEqual([image.id for image in page], expected[:8])
+        response = self.client.get(reverse('images:list'), {'order': 'likes', 'cursor': page.next_cursor},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual([image.id for image in response.context['images']], expected[8:])
+
+        response = self.client.get(reverse('images:list'), {'order': 'unknown'})
+        self.assertEqual(response.context['order'], 'newest')
+
+    def update(self, *operations, **data):
+        data.setdefault('operations', [{'id': image_id, 'action': action} for image_id, action in operations])
+        return self.client.post(reverse('images:likes_update'), json.dumps(data), content_type='application/json',
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+    def test_batch_states(self):
+        images = [self.image(self.user) for _ in range(3)]
+        images[1].users_like.add(self.user)
+        Image.objects.recount_likes()
+        ids = ','.join(str(image.id) for image in images)
+        # the session, the user and the states of all images
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('images:likes'), {'ids': f'{ids},0'},
+                                       HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'status': 'ok', 'images': {
+            str(images[0].id): {'liked': False, 'total_likes': 0},
+            str(images[1].id): {'liked': True, 'total_likes': 1},
+            str(images[2].id): {'liked': False, 'total_likes': 0},
+        }})
+        response = self.client.get(reverse('images:likes'), {'ids': 'x'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'status': 'error'})
+
+    def test_batch_update(self):
+        images = [self.image(self.user) for _ in range(3)]
+        images[2].users_like.add(self.user)
+        Image.objects.recount_likes()
+        response = self.update((images[0].id, 'like'), (images[1].id, 'like'), (images[1].id, 'unlike'),
+                               (images[2].id, 'unlike'), (0, 'like'))
+        self.assertEqual(response, {'status': 'ok', 'images': {
+            str(images[0].id): {'liked': True, 'total_likes': 1},
+            str(images[1].id): {'liked': False, 'total_likes': 0},
+            str(images[2].id): {'liked': False, 'total_likes': 0},
+        }})
+        self.assertEqual(list(self.user.images_liked.all()), [images[0]])
+        # applying it again changes nothing
+        self.assertEqual(self.update((images[0].id, 'like'), (images[2].id, 'unlike'))['images'], {
+            str(images[0].id): {'liked': True, 'total_likes': 1},
+            str(images[2].id): {'liked': False, 'total_likes': 0},
+        })
+
+        self.assertEqual(self.update((images[0].id, 'love')), {'status': 'error'})
+        self.assertEqual(self.update(operations='like'), {'status': 'error'})
+        with override_settings(IMAGES_LIKES_BATCH_SIZE=2):
+            self.assertEqual(self.update(*[(image.id, 'like') for image in images]), {'status': 'error'})
+
+    def test_batch_update_queries_dont_grow(self):
+        images = [self.image(self.user) for _ in range(12)]
+        images[1].users_like.add(self.user)
+        Image.objects.recount_likes()
+        with self.assertNumQueries(11) as queries:
+            self.update((images[0].id, 'like'), (images[1].id, 'unlike'))
+        images[1].users_like.add(self.user)
+        Image.objects.recount_likes()
+        with self.assertNumQueries(len(queries)):
+            self.update(*[(image.id, 'like') for image in images[2:]], (images[1].id, 'unlike'))
+        self.assertEqual(Image.objects.filter(total_likes=1).count(), 11)
+        self.assertFalse(images[1].users_like.exists())
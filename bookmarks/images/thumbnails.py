@@ -0,0 +1,158 @@
+"""
+Thumbnails generated ahead of time.
+
+easy_thumbnails' {% thumbnail %} tag generates a missing thumbnail while the page renders: it decodes the original
+and, for crop="smart", searches the crop with the most entropy, inside the request. Instead, every thumbnail alias
+of THUMBNAIL_ALIASES is generated when an Image or Profile gets a new file, by a pool of THUMBNAIL_WORKERS
+processes (Pillow holds the GIL for much of the work, threads wouldn't run in parallel). The names of the generated
+thumbnails are stored on the row, in `thumbnails`, together with the source file they were made from. Templates
+look them up with the pregenerated_url filter, which never generates anything; until the thumbnails exist, the
+original is shown. Rows with the same file (see storage.py) share its thumbnails, they are generated once.
+
+`python manage.py generate_thumbnails` generates the missing thumbnails of existing rows.
+"""
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+
+# the image field of each model with pre-generated thumbnails, the aliases are those of 'app.Model.field'
+FIELDS = {
+    'images.Image': 'image',
+    'account.Profile': 'photo',
+}
+
+_executor = None
+_lock = threading.Lock()
+
+
+def target(model):
+    label = model._meta.label
+    return f'{label}.{FIELDS[label]}'
+
+
+def is_current(instance):
+    """
+    Whether the stored thumbnails are those of the instance's current file.
+    """
+    name = getattr(instance, FIELDS[instance._meta.label]).name
+    return not name or instance.thumbnails.get('source') == name
+
+
+def _init_worker(media_root):
+    import django
+    django.setup()
+    # the worker processes are started with the settings module, MEDIA_ROOT may have been overridden since
+    settings.MEDIA_ROOT = media_root
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawned instead of forked, forking a server process with running threads isn't safe
+            _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(settings.MEDIA_ROOT,))
+        return _executor
+
+
+def shutdown():
+    """
+    Waits for the queued thumbnails to be generated and stored.
+    """
+    global _executor
+    with _lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def enqueue(instance):
+    """
+    Generates the thumbnails of the instance's file in the background once the current transaction is committed.
+    """
+    if not is_current(instance):
+        model = type(instance)
+        field = FIELDS[instance._meta.label]
+        name = getattr(instance, field).name
+        # the thumbnails of a file another row already has
+        shared = model.objects.filter(**{field: name, 'thumbnails__source': name}) \
+            .values_list('thumbnails', flat=True).first()
+        if shared:
+            instance.thumbnails = shared
+            model.objects.filter(pk=instance.pk, **{field: name}).update(thumbnails=shared)
+            return
+        transaction.on_commit(lambda: submit(model, name))
+
+
+def submit(model, name):
+    submitter = threading.get_ident()
+    future = executor().submit(generate, name, target(model))
+    future.add_done_callback(lambda done: store(model, name, done, close=threading.get_ident() != submitter))
+    return future
+
+
+def generate(name, alias_target):
+    """
+    Generates every alias of the target for the source file `name` and returns the names of the thumbnails by alias.
+    Runs in a worker process, which doesn't touch the database.
+    """
+    from django.core.files.storage import default_storage
+    from easy_thumbnails.alias import aliases
+    from easy_thumbnails.files import get_thumbnailer
+
+    thumbnails = {'source': name}
+    with default_storage.open(name) as source:
+        thumbnailer = get_thumbnailer(source, relative_name=name)
+        for alias, options in aliases.all(alias_target, include_global=False).items():
+            thumbnail = thumbnailer.generate_thumbnail(options)
+            storage = thumbnailer.thumbnail_storage
+            # regenerated thumbnails replace the old ones instead of getting a new name
+            if storage.exists(thumbnail.name):
+                storage.delete(thumbnail.name)
+            thumbnails[alias] = storage.save(thumbnail.name, thumbnail)
+    return thumbnails
+
+
+def store(model, name, future, close=True):
+    """
+    Stores the names of the generated thumbnails on every row with the file `name`, not on rows that got another file
+    meanwhile. Runs in a thread of the pool, which closes its database connection afterwards, or in the submitting
+    thread if the future was done already.
+    """
+    try:
+        thumbnails = future.result()
+    except Exception:
+        # a broken image keeps showing its original, generate_thumbnails reports the error
+        return
+    try:
+        model.objects.filter(**{FIELDS[model._meta.label]: name}).update(thumbnails=thumbnails)
+    finally:
+        if close:
+            connection.close()
+
+
+def delete(name):
+    """
+    Deletes the thumbnails of the source file `name`, which easy_thumbnails names `<name>.<options>.<ext>`.
+    """
+    from easy_thumbnails.files import get_thumbnailer
+
+    storage = get_thumbnailer(name, relative_name=name).thumbnail_storage
+    directory, prefix = posixpath.split(name)
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for file in files:
+        if file.startswith(prefix + '.'):
+            storage.delete(posixpath.join(directory, file))
+
+
+def models():
+    return [apps.get_model(label) for label in FIELDS]
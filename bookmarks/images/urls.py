@@ -7,5 +7,7 @@ urlpatterns = [
     path('create/', views.image_create, name='create'),
     path('detail/<int:id>/<slug:slug>/', views.image_detail, name='detail'),
     path('like/', views.image_like, name='like'),
+    path('likes/', views.image_likes, name='likes'),
+    path('likes/update/', views.image_likes_update, name='likes_update'),
     path('', views.image_list, name='list'),
 ]
\ No newline at end of file
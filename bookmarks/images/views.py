@@ -1,27 +1,37 @@
+import json
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.http import JsonResponse, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_POST
 
 from common.decorators import ajax_required
+from common.pagination import CursorPaginator, InvalidCursor
+from images import ingest, likes
 from images.forms import ImageCreateForm
 from images.models import Image
 
+# the orderings of image_list, by the value of the order parameter
+ORDERINGS = {
+    'newest': ('-created', '-id'),
+    'likes': ('-total_likes', '-id'),
+}
+
 
 @login_required
 def image_create(request):
     if request.method == 'POST':
         form = ImageCreateForm(data=request.POST)
         if form.is_valid():
-            cd = form.cleaned_data
-            # WE USE OUR OWN FUNCTION HERE, that downloads the actual image
             new_item = form.save(commit=False)
             new_item.user = request.user
             new_item.save()
+            # the image is downloaded by a background worker, not while the user waits
+            ingest.enqueue(new_item)
 
-            messages.success(request, 'Image added successfully')
+            messages.success(request, 'Image added successfully, it will show up once it is downloaded')
 
             return redirect(new_item.get_absolute_url())
     else:
@@ -32,8 +42,11 @@ def image_create(request):
 @login_required
 def image_detail(request, id, slug):
     image = get_object_or_404(Image, id=id, slug=slug)
-    print(request)
-    return render(request, 'images/image/detail.html', {'section': 'images', 'image': image})
+    # the like of the user is looked up in the (image, user) index instead of loading all likers
+    liked = image.users_like.filter(pk=request.user.pk).exists()
+    likers = image.users_like.select_related('profile')[:getattr(settings, 'IMAGES_LIKERS_PREVIEW', 12)]
+    return render(request, 'images/image/detail.html',
+                  {'section': 'images', 'image': image, 'liked': liked, 'likers': likers})
 
 
 @ajax_required
@@ -44,42 +57,85 @@ def image_like(request):
     action = request.POST.get("action")  # action should be a string of "like" or "unlike"
     if image_id and action:
         try:
-            image = Image.objects.get(id=image_id)
-            if action == 'like':
-                print("add users like")
-                image.users_like.add(request.user)  # .add() working for many-to-many relationship
-            else:
-                image.users_like.remove(request.user)  # .remove() working for many-to-many relationship
-            return JsonResponse({'status': 'ok'})
-        except Exception as e:
-            print(str(e))
+            image_id = int(image_id)
+        except ValueError:
+            return JsonResponse({'status': 'error'})
+        # the same as a batch of one for image_likes_update, see likes.py
+        state = likes.apply(request.user, {image_id: action == 'like'}).get(image_id)
+        if state is not None:
+            return JsonResponse({'status': 'ok', 'total_likes': state['total_likes']})
     # Finally, you use the JsonResponse class provided by Django, which returns an HTTP response with an
     # application/json content type, converting the given object into a JSON output.
     return JsonResponse({'status': 'error'})
 
 
+def _batch_size():
+    return getattr(settings, 'IMAGES_LIKES_BATCH_SIZE', 100)
+
+
+@ajax_required
+@login_required
+def image_likes(request):
+    """
+    Returns whether the user likes the images and their total likes, for a grid of images: ?ids=1,2,3. One query for
+    all of them instead of one per image.
+    """
+    try:
+        ids = {int(image_id) for image_id in request.GET.get('ids', '').split(',') if image_id}
+    except ValueError:
+        return JsonResponse({'status': 'error'})
+    if len(ids) > _batch_size():
+        return JsonResponse({'status': 'error'})
+    return JsonResponse({'status': 'ok', 'images': likes.states(request.user, ids)})
+
+
+@ajax_required
+@login_required
+@require_POST
+def image_likes_update(request):
+    """
+    Applies the likes and unlikes of a JSON body {"operations": [{"id": 1, "action": "like"}, ...]} in one
+    transaction, e.g. the clicks on a grid of images collected for a moment. The last operation on an image wins.
+    Returns the new states like image_likes.
+    """
+    try:
+        actions = {}
+        for operation in json.loads(request.body)['operations']:
+            if operation['action'] not in ('like', 'unlike'):
+                raise ValueError(f'Unknown action {operation["action"]!r}')
+            actions[int(operation['id'])] = operation['action'] == 'like'
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'status': 'error'})
+    if len(actions) > _batch_size():
+        return JsonResponse({'status': 'error'})
+    return JsonResponse({'status': 'ok', 'images': likes.apply(request.user, actions)})
+
+
 @login_required
 def image_list(request):
-    images = Image.objects.all()
-    paginator = Paginator(images, 8)
-    page = request.GET.get('page')
+    images = Image.objects.ready()
+    order = request.GET.get('order')
+    if order not in ORDERINGS:
+        order = 'newest'
+    # keyset pagination on (created, id) or (total_likes, id), both indexed: the infinite scroll never counts or
+    # skips rows
+    paginator = CursorPaginator(images, 8, ordering=ORDERINGS[order])
+    cursor = request.GET.get('cursor')
 
     try:
-        images = paginator.page(page)
-    except PageNotAnInteger:
-        # if page is not an int deliver the first page
-        images = paginator.page(1)
-    except EmptyPage:
-        if request.is_ajax():
-            # If the request is AJAX and the page is out of range return an empty page
-            # this is to stop pagination on client side
-            return HttpResponse('')
-        # If page is out of range deliver last page of results
-        images = paginator.page(paginator.num_pages)
+        images = paginator.page(cursor)
+    except InvalidCursor:
+        # if the cursor is broken deliver the first page
+        images = paginator.page()
+
+    if request.is_ajax() and not images:
+        # If the request is AJAX and there are no more images return an empty page
+        # this is to stop pagination on client side
+        return HttpResponse('')
 
     if request.is_ajax():
         # this template only contains the new images
         return render(request, 'images/image/list_ajax.html', {'section': 'images', 'images': images})
 
     # this is the big template deriving from base.html
-    return render(request, 'images/image/list.html', {'section': 'images', 'images': images})
+    return render(request, 'images/image/list.html', {'section': 'images', 'images': images, 'order': order})
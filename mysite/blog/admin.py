@@ -1,8 +1,62 @@
 from django.contrib import admin
-from .models import Post, Comment
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.widgets import AutocompleteSelect
+
+from common.pagination import EstimatedCountPaginator
+from .models import Post, Comment, OutgoingEmail
 #admin.site.register(Post)
 
 
+class AuthorFilter(admin.ListFilter):
+    """
+    Filters by author with an autocomplete field that searches the users (the search_fields of UserAdmin),
+    instead of listing every user in the sidebar like list_filter = ('author',) does.
+    """
+    title = 'author'
+    field_name = 'author'
+    template = 'admin/blog/autocomplete_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.parameter_name = f'{self.field_name}__id__exact'
+        if self.parameter_name in params:
+            self.used_parameters[self.parameter_name] = params.pop(self.parameter_name)
+        self.value = self.used_parameters.get(self.parameter_name)
+        if self.value:
+            try:
+                self.value = int(self.value)
+            except ValueError as error:
+                # the change list redirects with ?e=1, like for the other filters
+                raise IncorrectLookupParameters(error) from error
+        widget = self.widget(model_admin)
+        # only the selected user is loaded from the choices, by id
+        widget.choices = model._meta.get_field(self.field_name).formfield().choices
+        self.rendered_widget = widget.render(self.parameter_name, self.value)
+
+    @classmethod
+    def widget(cls, model_admin):
+        field = model_admin.model._meta.get_field(cls.field_name)
+        return AutocompleteSelect(field, model_admin.admin_site, attrs={'style': 'width: 100%'})
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'All',
+        }
+
+    def queryset(self, request, queryset):
+        if self.value:
+            return queryset.filter(**{self.parameter_name: self.value})
+        return queryset
+
+
 # Customize the admin page of our app
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -10,16 +64,24 @@ class PostAdmin(admin.ModelAdmin):
     The list_display attribute allows you to set the fields of your model that you want to display on the
     administration object list page.
     """
-    list_display = ('title', 'slug', 'author', 'publish', 'status')
+    list_display = ('title', 'slug', 'author', 'publish', 'status', 'comment_count')
 
     # add filters and search-bar to the admin dashboard
-    list_filter = ('status', 'created', 'publish', 'author')
+    list_filter = ('status', 'created', 'publish', AuthorFilter)
     search_fields = ('title', 'body')
     # prefill slug fild with title as suggestion when adding a new post
     prepopulated_fields = {'slug': ('title',)}
     raw_id_fields = ('author',)
     date_hierarchy = 'publish'
     ordering = ('status', 'publish')
+    # no exact COUNT(*) of large tables, and none of the unfiltered table next to a filtered count
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        # the scripts of the autocomplete in AuthorFilter, merged with the others in the page head
+        return super().media + AuthorFilter.widget(self).media
 
 
 @admin.register(Comment)
@@ -27,3 +89,26 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'post', 'created', 'active')
     list_filter = ('active', 'created', 'updated')
     search_fields = ('name', 'email', 'body')
+    list_select_related = ('post',)
+    actions = ('activate_comments', 'deactivate_comments')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # bulk actions go through set_active() to keep Post.comment_count in sync
+    def activate_comments(self, request, queryset):
+        updated = queryset.set_active(True)
+        self.message_user(request, f'{updated} comment(s) activated.')
+    activate_comments.short_description = 'Activate selected comments'
+
+    def deactivate_comments(self, request, queryset):
+        updated = queryset.set_active(False)
+        self.message_user(request, f'{updated} comment(s) deactivated.')
+    deactivate_comments.short_description = 'Deactivate selected comments'
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt', 'sent')
+    list_filter = ('status',)
+    search_fields = ('subject', 'to')
+    readonly_fields = ('attempts', 'last_error', 'sent')
@@ -0,0 +1,84 @@
+"""
+Cache for the sidebar fragments of the blog (see templatetags/blog_tags.py).
+
+The sidebar only changes when a post or a comment is written, so its values are cached without a short timeout and
+invalidated by signals (see signals.py). Invalidation does not delete anything: every key contains a version number
+and invalidate() increases it, so all fragments are invalidated at once and old values simply expire. The version is
+the time of the last invalidation in nanoseconds, which makes it usable as Last-Modified of pages with a sidebar (see
+last_changed()). If the version is lost from the cache, the new one is the current time, so it never goes backwards.
+
+After an invalidation a burst of requests would all miss the cache at the same time and run the same query. To avoid
+this stampede only the request that gets the lock computes the value; the others wait for it to show up in the cache.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'blog:fragments:version'
+LOCK_TIMEOUT = 10  # seconds, in case the process holding the lock dies
+WAIT_INTERVAL = 0.05  # seconds between two looks into the cache while another request computes the value
+WAIT_TIMEOUT = 2  # seconds, compute the value without the lock if it takes longer
+
+
+def _timeout():
+    return getattr(settings, 'BLOG_FRAGMENT_CACHE_TIMEOUT', 60 * 60)
+
+
+def current_version():
+    """
+    The version of the fragments. Changes whenever a post or a comment is written.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def last_changed(version=None):
+    """
+    Time of the last invalidation, i.e. the last change of anything shown in the sidebar.
+    """
+    return datetime.fromtimestamp((version or current_version()) / 1e9, tz=timezone.utc)
+
+
+def make_key(name, args, version=None):
+    args = ':'.join(str(arg) for arg in args)
+    return f'blog:fragments:{version or current_version()}:{name}:{args}'
+
+
+def invalidate():
+    # strictly increasing, even if the clock didn't move since the last invalidation
+    version = max(time.time_ns(), (cache.get(VERSION_KEY) or 0) + 1)
+    cache.set(VERSION_KEY, version, None)
+
+
+def get_or_compute(name, args, compute):
+    """
+    Returns the cached value of the fragment `name` for the given arguments, calls compute() on a cache miss.
+    """
+    key = make_key(name, args)
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, True, LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(key, value, _timeout())
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    # another request is computing the value already
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return compute()
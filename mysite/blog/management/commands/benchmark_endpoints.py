@@ -0,0 +1,89 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import Tag
+
+from blog import search, similarity
+from blog.models import Comment, Post, TagCount, TaggedPost
+from common.benchmark import Endpoint, EndpointBenchmark
+from polls.models import Choice, Question
+
+WORDS = ('django', 'python', 'database', 'index', 'query', 'cache', 'template', 'model', 'view', 'migration')
+
+
+class Command(EndpointBenchmark):
+    help = EndpointBenchmark.help + ' Endpoints: post_list, post_detail, post_search, sitemap.xml, poll_vote and ' \
+                                    'poll_results, requested by an anonymous visitor.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=5, help='Comments per post.')
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--no-page-cache', action='store_true',
+                            help='Render every page instead of serving anonymous visitors from the page cache.')
+
+    def handle(self, *args, **options):
+        if options['no_page_cache']:
+            with override_settings(BLOG_PAGE_CACHE_TIMEOUT=0):
+                return super().handle(*args, **options)
+        return super().handle(*args, **options)
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        author, _ = User.objects.get_or_create(username='benchmark')
+        now = timezone.now()
+        # bulk_create skips Post.save() and the signals, what they maintain is updated below
+        posts = []
+        for i in range(options['posts']):
+            post = Post(title=f'Post {i}', slug=f'post-{i}', author=author, status='published',
+                        body=' '.join(rng.choices(WORDS, k=100)), publish=now - timedelta(hours=i))
+            post.render()
+            posts.append(post)
+        Post.objects.bulk_create(posts, batch_size=1000)
+        ids = list(Post.objects.filter(author=author).values_list('id', flat=True))
+
+        Tag.objects.bulk_create([Tag(name=f'benchmark-{i}', slug=f'benchmark-{i}') for i in range(options['tags'])])
+        tag_ids = list(Tag.objects.filter(name__startswith='benchmark-').values_list('id', flat=True))
+        TaggedPost.objects.bulk_create(
+            (TaggedPost(content_object_id=post_id, tag_id=tag_id)
+             for post_id in ids for tag_id in rng.sample(tag_ids, min(3, len(tag_ids)))),
+            batch_size=1000)
+        Comment.objects.bulk_create(
+            (Comment(post_id=post_id, name='reader', email='reader@example.com', body='comment')
+             for post_id in ids for _ in range(options['comments'])),
+            batch_size=1000)
+        Post.objects.filter(id__in=ids).update(comment_count=Post.active_comment_count())
+        TagCount.recount(tag_ids)
+        similarity.rebuild_similar_posts()
+        search.get_backend().update(Post.objects.filter(id__in=ids))
+
+        for i in range(options['questions']):
+            question = Question.objects.create(question_text=f'Question {i}', pub_date=now)
+            Choice.objects.bulk_create([Choice(question=question, choice_text=f'Choice {c}') for c in range(4)])
+
+    def endpoints(self, options):
+        posts = [post.get_absolute_url() for post in Post.published.filter(author__username='benchmark')
+                 .order_by('-publish')[:100]]
+        choices = list(Choice.objects.filter(question__question_text__startswith='Question ')
+                       .values_list('question', 'id'))
+
+        def vote(client, i):
+            question, choice = choices[i % len(choices)]
+            return client.post(reverse('polls:vote', args=[question]), {'choice': choice})
+
+        return [
+            Endpoint('post_list', lambda client, i: client.get(reverse('blog:post_list'))),
+            Endpoint('post_detail', lambda client, i: client.get(posts[i % len(posts)])),
+            Endpoint('post_search', lambda client, i: client.get(reverse('blog:post_search'),
+                                                                 {'query': WORDS[i % len(WORDS)]})),
+            Endpoint('sitemap.xml', lambda client, i: client.get(reverse('sitemap'))),
+            Endpoint('poll_vote', vote),
+            Endpoint('poll_results',
+                     lambda client, i: client.get(reverse('polls:results', args=[choices[i % len(choices)][0]]))),
+        ]
@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.utils import timezone
+
+from common.benchmark import measure, rolled_back
+from blog.models import Post
+from common.pagination import CursorPaginator
+
+
+class Command(BaseCommand):
+    help = 'Compares the latency of page N for offset and cursor pagination of the post list. ' \
+           'The seeded posts are rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=50000)
+        parser.add_argument('--per-page', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self.seed(options['posts'])
+            self.run(options)
+
+    def seed(self, count):
+        author, _ = User.objects.get_or_create(username='benchmark')
+        now = timezone.now()
+        # bulk_create skips Post.save(), which would render markdown for every post
+        Post.objects.bulk_create(
+            (Post(title=f'Post {i}', slug=f'post-{i}', author=author, body='body', status='published',
+                  publish=now - timedelta(minutes=i)) for i in range(count)),
+            batch_size=1000)
+
+    def run(self, options):
+        per_page = options['per_page']
+        posts = Post.published.for_list()
+        offset_paginator = Paginator(posts, per_page)
+        cursor_paginator = CursorPaginator(posts, per_page, ordering=('-publish', '-id'))
+
+        self.stdout.write(f'{"page":>8} {"offset ms":>12} {"cursor ms":>12}')
+        for number in options['pages']:
+            if number > offset_paginator.num_pages:
+                break
+            # the cursor of page N is the position of the last post of page N - 1
+            cursor = None
+            if number > 1:
+                last = posts.order_by('-publish', '-id')[(number - 1) * per_page - 1]
+                cursor = cursor_paginator.encode_cursor(last, reverse=False)
+
+            offset_ms = measure(lambda: list(offset_paginator.page(number)), options['repeat'])
+            cursor_ms = measure(lambda: list(cursor_paginator.page(cursor)), options['repeat'])
+            self.stdout.write(f'{number:>8} {offset_ms:>12.3f} {cursor_ms:>12.3f}')
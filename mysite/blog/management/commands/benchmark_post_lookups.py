@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from common.benchmark import measure, rolled_back
+from blog.models import Post
+
+# the indexes of the listing and detail lookups, dropped to show the plans without them
+INDEXES = ('blog_post_status_publish_idx', 'blog_post_slug_publish_idx')
+
+
+class Command(BaseCommand):
+    help = 'Shows the query plans and latencies of the post listing and the post_detail lookup, with the date ' \
+           'parts extracted and without the (status, publish) and (slug, publish) indexes, then as a publish ' \
+           'range with the indexes. The seeded posts and the dropped indexes are rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            post = self.seed(options['posts'])
+            publish = timezone.localtime(post.publish)
+
+            def listing():
+                return Post.published.order_by('-publish', '-id').values_list('id', flat=True)[:3]
+
+            def extracted():
+                return Post.published.filter(slug=post.slug, publish__year=publish.year,
+                                             publish__month=publish.month, publish__day=publish.day)
+
+            def ranged():
+                return Post.published.published_on(publish.year, publish.month, publish.day).filter(slug=post.slug)
+
+            with connection.cursor() as cursor:
+                for index in INDEXES:
+                    cursor.execute(f'DROP INDEX {index}')
+                # the index of the slug alone, which the (slug, publish) index replaced
+                cursor.execute('CREATE INDEX benchmark_post_slug ON blog_post (slug)')
+                cursor.execute('ANALYZE')
+            self.report('without the indexes', listing, extracted, options['repeat'])
+
+            with connection.cursor() as cursor:
+                cursor.execute('DROP INDEX benchmark_post_slug')
+                cursor.execute('CREATE INDEX blog_post_status_publish_idx ON blog_post (status, publish)')
+                cursor.execute('CREATE INDEX blog_post_slug_publish_idx ON blog_post (slug, publish)')
+                cursor.execute('ANALYZE')
+            self.report('with the indexes', listing, ranged, options['repeat'])
+
+    def seed(self, count):
+        author, _ = User.objects.get_or_create(username='benchmark')
+        now = timezone.now()
+        # bulk_create skips Post.save(), which would render markdown for every post. Slugs repeat on other days,
+        # like titles do, and a tenth of the posts are drafts
+        Post.objects.bulk_create(
+            (Post(title=f'Post {i}', slug=f'post-{i % 1000}', author=author, body='body',
+                  status='draft' if i % 10 == 0 else 'published', publish=now - timedelta(hours=i))
+             for i in range(count)),
+            batch_size=1000)
+        # runs the deferred foreign key checks of PostgreSQL, which otherwise block changing the indexes
+        connection.check_constraints()
+        return Post.published.order_by('publish')[count // 2]
+
+    def report(self, title, listing, detail, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{connection.vendor}, {title}'))
+        for name, queryset in (('listing', listing), ('detail', detail)):
+            ms = measure(lambda: list(queryset()), repeat)
+            self.stdout.write(f'{name}: {ms:.3f} ms')
+            self.stdout.write(queryset().explain())
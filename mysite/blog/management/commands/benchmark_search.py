@@ -0,0 +1,67 @@
+import random
+
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVector
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from blog import search
+from common.benchmark import measure, rolled_back
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Compares the search backend of the database with searching without an index: a SearchVector built ' \
+           'per query on PostgreSQL, LIKE elsewhere. The seeded posts are rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--words', type=int, default=200, help='Words in the body of each post.')
+        parser.add_argument('--vocabulary', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [f'word{i}' for i in range(options['vocabulary'])]
+        with rolled_back():
+            self.seed(rng, vocabulary, options)
+            # a frequent, a medium and a rare word. Word frequencies follow the zipf-like distribution of the seed
+            queries = [vocabulary[0], vocabulary[100], vocabulary[-1]]
+            self.run(queries, options['repeat'])
+
+    def seed(self, rng, vocabulary, options):
+        author, _ = User.objects.get_or_create(username='benchmark')
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+        def text(words):
+            return ' '.join(rng.choices(vocabulary, weights, k=words))
+
+        self.stdout.write(f'Seeding {options["posts"]} posts...')
+        # bulk_create skips Post.save(), which would render markdown for every post
+        Post.objects.bulk_create(
+            (Post(title=text(6), slug=f'post-{i}', author=author, body=text(options['words']), status='published')
+             for i in range(options['posts'])),
+            batch_size=1000)
+        search.get_backend().update(Post.objects.all())
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def run(self, queries, repeat):
+        backend = search.get_backend()
+        self.stdout.write(f'{"query":>12} {"results":>8} {"no index ms":>12} {type(backend).__name__ + " ms":>28}')
+        for query in queries:
+            def no_index():
+                if connection.vendor == 'postgresql':
+                    # to_tsvector of every published post, unranked
+                    return list(Post.published.annotate(search=SearchVector('title', 'body'))
+                                .filter(search=query).values_list('id', flat=True)[:10])
+                return list(search.LikeSearchBackend().search(query)[:10])
+
+            def indexed():
+                return list(backend.search(query)[:10])
+
+            results = backend.search(query).count()
+            no_index_ms = measure(no_index, repeat)
+            indexed_ms = measure(indexed, repeat)
+            self.stdout.write(f'{query:>12} {results:>8} {no_index_ms:>12.3f} {indexed_ms:>28.3f}')
@@ -0,0 +1,50 @@
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Post, TaggedPost
+
+FIELDS = ('id', 'title', 'slug', 'author__username', 'body', 'publish', 'status')
+
+
+class Command(BaseCommand):
+    help = 'Writes all posts as JSON lines, one post per line, in the format import_posts reads. ' \
+           'Posts are streamed in chunks, so memory does not grow with the number of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file, "-" for stdout (default).')
+        parser.add_argument('--status', choices=[status for status, _ in Post.STATUS_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.order_by('id').values_list(*FIELDS)
+        if options['status']:
+            posts = posts.filter(status=options['status'])
+
+        if options['path'] == '-':
+            exported = self.export(posts, self.stdout, options['chunk_size'])
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as output:
+                exported = self.export(posts, output, options['chunk_size'])
+        self.stderr.write(self.style.SUCCESS(f'Exported {exported} post(s).'))
+
+    @staticmethod
+    def export(posts, output, chunk_size):
+        exported = 0
+        rows = posts.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return exported
+            # iterator() doesn't prefetch, so the tags of a chunk are loaded with one query
+            tags = defaultdict(list)
+            for post_id, name in TaggedPost.objects.filter(content_object_id__in=[row[0] for row in chunk]) \
+                    .order_by('tag__name').values_list('content_object_id', 'tag__name'):
+                tags[post_id].append(name)
+            for post_id, title, slug, author, body, publish, status in chunk:
+                record = {'title': title, 'slug': slug, 'author': author, 'body': body,
+                          'publish': publish.isoformat(), 'status': status, 'tags': tags[post_id]}
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            exported += len(chunk)
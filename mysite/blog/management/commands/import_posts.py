@@ -0,0 +1,154 @@
+import json
+import sys
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag
+
+from blog import fragments, pagecache, search, similarity
+from blog.models import Post, TagCount, TaggedPost
+
+
+class Command(BaseCommand):
+    help = 'Creates posts from JSON lines as written by export_posts, one post per line: title, slug, author ' \
+           '(username), body, publish, status and tags. Posts whose slug already exists on their publish date ' \
+           'are skipped, so an interrupted import can be run again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Input file, "-" for stdin (default).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--create-authors', action='store_true',
+                            help='Create users for unknown authors instead of failing.')
+
+    def handle(self, *args, **options):
+        self.create_authors = options['create_authors']
+        self.tag_ids = set()
+        if options['path'] == '-':
+            created, skipped = self.import_lines(sys.stdin, options['batch_size'])
+        else:
+            with open(options['path'], encoding='utf-8') as lines:
+                created, skipped = self.import_lines(lines, options['batch_size'])
+
+        # bulk_create doesn't send signals, so everything the signals maintain is updated once at the end
+        TagCount.recount(self.tag_ids)
+        fragments.invalidate()
+        pagecache.invalidate('posts', *[f'tag:{tag_id}' for tag_id in self.tag_ids])
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} post(s), skipped {skipped} existing post(s).'))
+
+    def import_lines(self, lines, batch_size):
+        created = skipped = 0
+        numbered = enumerate(lines, 1)
+        while True:
+            batch = [(number, line) for number, line in islice(numbered, batch_size) if line.strip()]
+            if not batch:
+                return created, skipped
+            records = [self.parse(number, line) for number, line in batch]
+            with transaction.atomic():
+                count = self.import_batch(records)
+            created += count
+            skipped += len(records) - count
+
+    @staticmethod
+    def parse(number, line):
+        try:
+            record = json.loads(line)
+            publish = parse_datetime(record['publish'])
+            if publish is None:
+                raise ValueError(f'invalid publish date {record["publish"]!r}')
+            if timezone.is_naive(publish):
+                publish = timezone.make_aware(publish)
+            status = record.get('status', 'draft')
+            if status not in dict(Post.STATUS_CHOICES):
+                raise ValueError(f'invalid status {status!r}')
+            tags = record.get('tags', [])
+            if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                raise ValueError(f'tags must be a list of names, not {tags!r}')
+            return {
+                'title': record['title'],
+                'slug': record['slug'],
+                'author': record['author'],
+                'body': record['body'],
+                'publish': publish,
+                'status': status,
+                'tags': tags,
+            }
+        except (ValueError, KeyError, TypeError) as error:
+            raise CommandError(f'Line {number}: {error}')
+
+    def import_batch(self, records):
+        authors = self.resolve_authors({record['author'] for record in records})
+        records = self.new_records(records)
+        posts = []
+        for record in records:
+            post = Post(title=record['title'], slug=record['slug'], author_id=authors[record['author']],
+                        body=record['body'], publish=record['publish'], status=record['status'])
+            # bulk_create skips save(), which renders the markdown
+            post.render()
+            posts.append(post)
+        Post.objects.bulk_create(posts)
+        if posts and posts[0].pk is None:
+            # the database doesn't return the ids of bulk inserts (SQLite before Django 4), (slug, publish) is unique
+            ids = dict(((slug, publish), pk) for pk, slug, publish in Post.objects.filter(
+                slug__in=[post.slug for post in posts], publish__in=[post.publish for post in posts])
+                .values_list('id', 'slug', 'publish'))
+            for post in posts:
+                post.pk = ids[post.slug, post.publish]
+
+        tags = self.resolve_tags({name for record in records for name in record['tags']})
+        TaggedPost.objects.bulk_create(
+            [TaggedPost(content_object_id=post.pk, tag_id=tags[name])
+             for post, record in zip(posts, records) for name in set(record['tags'])],
+            ignore_conflicts=True)
+        self.tag_ids.update(tags.values())
+        search.get_backend().update(Post.objects.filter(id__in=[post.pk for post in posts]))
+        # only loads the taggings of the tags of this batch, unlike rebuild_similar_posts
+        similarity.add_similar_posts([post.pk for post in posts])
+        return len(posts)
+
+    def resolve_authors(self, usernames):
+        authors = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        missing = usernames - authors.keys()
+        if missing and not self.create_authors:
+            raise CommandError(f'Unknown author(s): {", ".join(sorted(missing))}. Use --create-authors.')
+        if missing:
+            User.objects.bulk_create([User(username=username) for username in missing])
+            authors.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        return authors
+
+    @staticmethod
+    def new_records(records):
+        """
+        Leaves out the records whose slug exists on their publish date, in the database or earlier in the batch,
+        which is what unique_for_date='publish' on Post.slug allows.
+        """
+        def key(slug, publish):
+            return slug, timezone.localdate(publish)
+
+        existing = {key(slug, publish) for slug, publish in Post.objects.filter(
+            slug__in=[record['slug'] for record in records],
+            publish__date__in=[timezone.localdate(record['publish']) for record in records],
+        ).values_list('slug', 'publish')}
+        new = []
+        for record in records:
+            record_key = key(record['slug'], record['publish'])
+            if record_key not in existing:
+                existing.add(record_key)
+                new.append(record)
+        return new
+
+    @staticmethod
+    def resolve_tags(names):
+        tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        missing = names - tags.keys()
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name, slug=Tag().slugify(name)) for name in missing],
+                                    ignore_conflicts=True)
+            tags.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+            # a slug that is taken by another tag: create() makes it unique, one tag at a time
+            for name in missing - tags.keys():
+                tags[name] = Tag.objects.create(name=name).pk
+        return tags
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.similarity import rebuild_similar_posts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the similar posts of all published posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_similar_posts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the similar posts of {count} post(s).'))
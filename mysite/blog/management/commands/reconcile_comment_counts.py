@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Repairs Post.comment_count where it differs from the number of active comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        repaired = 0
+        while True:
+            # walk the posts in id ranges, so every batch is a short query and a short write
+            ids = list(Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            drifted = Post.objects.filter(id__in=ids).annotate(actual=Post.active_comment_count()) \
+                .exclude(comment_count=F('actual')).values_list('id', flat=True)
+            drifted = list(drifted)
+            if drifted:
+                # the count is recomputed inside the update, so comments written meanwhile are not lost
+                repaired += Post.objects.filter(id__in=drifted).update(comment_count=Post.active_comment_count())
+        self.stdout.write(self.style.SUCCESS(f'Repaired the comment count of {repaired} post(s).'))
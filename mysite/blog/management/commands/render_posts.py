@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Renders the markdown body of posts into the stored body_html / excerpt_html fields.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render every post, not only the ones that have not been rendered yet.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.only('id', 'body').order_by('id')
+        if not options['all']:
+            posts = posts.filter(body_html='')
+
+        batch_size = options['batch_size']
+        batch = []
+        rendered = 0
+        for post in posts.iterator(chunk_size=batch_size):
+            post.render()
+            batch.append(post)
+            if len(batch) >= batch_size:
+                rendered += self.flush(batch)
+        rendered += self.flush(batch)
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} post(s).'))
+
+    @staticmethod
+    def flush(batch):
+        # bulk_update() bypasses save(), so updated is not touched by the backfill
+        Post.objects.bulk_update(batch, ['body_html', 'excerpt_html'])
+        count = len(batch)
+        batch.clear()
+        return count
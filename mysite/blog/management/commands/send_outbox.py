@@ -0,0 +1,53 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from blog import outbox
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued e-mails of the outbox in batches, one SMTP connection per batch and worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Batches sent at the same time, i.e. the limit of open SMTP connections.')
+        parser.add_argument('--max-attempts', type=int, default=outbox.MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between two polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.run(options)
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} e-mail(s), {failed} failed attempt(s).'))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def run(self, options):
+        results = []
+        errors = []
+
+        def work():
+            try:
+                results.append(outbox.drain(options['batch_size'], options['max_attempts']))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                # every thread has its own database connection
+                connection.close()
+
+        if options['workers'] == 1:
+            results.append(outbox.drain(options['batch_size'], options['max_attempts']))
+        else:
+            threads = [threading.Thread(target=work) for _ in range(options['workers'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+        return sum(sent for sent, _ in results), sum(failed for _, failed in results)
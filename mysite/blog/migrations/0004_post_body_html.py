@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:36
+
+import markdown
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+# blog.rendering when this migration was written
+EXCERPT_WORDS = 30
+BATCH_SIZE = 500
+
+
+def render_posts(apps, schema_editor):
+    """
+    Renders the existing posts, like `python manage.py render_posts`: without BLOG_MARKDOWN_FALLBACK their pages
+    only show the stored html.
+    """
+    Post = apps.get_model('blog', 'Post')
+    batch = []
+    for post in Post.objects.only('id', 'body').order_by('id').iterator(chunk_size=BATCH_SIZE):
+        post.body_html = markdown.markdown(post.body)
+        post.excerpt_html = Truncator(post.body_html).words(EXCERPT_WORDS, html=True, truncate=' …')
+        batch.append(post)
+        if len(batch) >= BATCH_SIZE:
+            Post.objects.bulk_update(batch, ['body_html', 'excerpt_html'])
+            batch.clear()
+    Post.objects.bulk_update(batch, ['body_html', 'excerpt_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_post_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(render_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:41
+
+import heapq
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# blog.similarity.SIMILAR_POSTS when this migration was written
+SIMILAR_POSTS = 4
+BATCH_SIZE = 1000
+
+
+def build_similar_posts(apps, schema_editor):
+    """
+    Fills the table for the existing posts, the post detail pages only read it. The same computation as
+    rebuild_similar_posts, on the generic taggings of this point in the history.
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    Post = apps.get_model('blog', 'Post')
+    SimilarPost = apps.get_model('blog', 'SimilarPost')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:
+        return
+    published = dict(Post.objects.filter(status='published').values_list('id', 'publish'))
+    posts_by_tag = defaultdict(list)
+    tags_by_post = defaultdict(list)
+    for post_id, tag_id in TaggedItem.objects.filter(content_type=content_type) \
+            .values_list('object_id', 'tag_id').iterator(chunk_size=BATCH_SIZE):
+        if post_id in published:
+            posts_by_tag[tag_id].append(post_id)
+            tags_by_post[post_id].append(tag_id)
+
+    def rows():
+        for post_id in published:
+            shared = Counter()
+            for tag_id in tags_by_post[post_id]:
+                shared.update(posts_by_tag[tag_id])
+            del shared[post_id]
+            ranked = heapq.nsmallest(SIMILAR_POSTS, shared,
+                                     key=lambda other: (-shared[other], published[other], other))
+            for rank, other in enumerate(ranked):
+                yield SimilarPost(post_id=post_id, similar_id=other, shared_tags=shared[other], rank=rank)
+
+    SimilarPost.objects.bulk_create(rows(), batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('blog', '0005_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shared_tags', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_posts', to='blog.post')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+            options={
+                'ordering': ('post', 'rank'),
+                'unique_together': {('post', 'rank')},
+            },
+        ),
+        migrations.RunPython(build_similar_posts, migrations.RunPython.noop),
+    ]
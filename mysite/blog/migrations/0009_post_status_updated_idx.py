@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_post_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', 'updated'], name='blog_post_status_updated_idx'),
+        ),
+    ]
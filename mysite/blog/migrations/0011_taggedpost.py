@@ -0,0 +1,92 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:57
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+import taggit.managers
+
+BATCH_SIZE = 1000
+
+
+def _generic_taggings(apps):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:
+        return TaggedItem.objects.none()
+    return TaggedItem.objects.filter(content_type=content_type)
+
+
+def copy_taggings(apps, schema_editor):
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    TagCount = apps.get_model('blog', 'TagCount')
+    Tag = apps.get_model('taggit', 'Tag')
+    taggings = _generic_taggings(apps)
+    TaggedPost.objects.bulk_create(
+        (TaggedPost(content_object_id=object_id, tag_id=tag_id)
+         for object_id, tag_id in taggings.values_list('object_id', 'tag_id').iterator(chunk_size=BATCH_SIZE)),
+        batch_size=BATCH_SIZE)
+    # the generic taggings stay until 0014_delete_generic_post_taggings, after the copy
+
+    published = TaggedPost.objects.filter(tag=OuterRef('pk'), content_object__status='published') \
+        .order_by().values('tag').annotate(total=Count('pk')).values('total')
+    TagCount.objects.bulk_create(
+        (TagCount(tag_id=tag_id, published_posts=total)
+         for tag_id, total in Tag.objects.annotate(total=Coalesce(Subquery(published), 0))
+         .values_list('id', 'total').iterator(chunk_size=BATCH_SIZE)),
+        batch_size=BATCH_SIZE)
+
+
+def copy_taggings_back(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    content_type, _ = ContentType.objects.get_or_create(app_label='blog', model='post')
+    # the taggings that are still there (see 0014_delete_generic_post_taggings) are kept as they are
+    TaggedItem.objects.bulk_create(
+        (TaggedItem(content_type=content_type, object_id=post_id, tag_id=tag_id)
+         for post_id, tag_id in TaggedPost.objects.values_list('content_object_id', 'tag_id')
+         .iterator(chunk_size=BATCH_SIZE)),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('blog', '0010_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='post_count', serialize=False, to='taggit.tag')),
+                ('published_posts', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaggedPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_object', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tagged_items', to='blog.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blog_taggedpost_items', to='taggit.tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagcount',
+            index=models.Index(fields=['-published_posts'], name='blog_tagcount_posts_idx'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='tags',
+            field=taggit.managers.TaggableManager(help_text='A comma-separated list of tags.', through='blog.TaggedPost', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taggedpost',
+            unique_together={('tag', 'content_object')},
+        ),
+        migrations.RunPython(copy_taggings, copy_taggings_back),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# the tables of the admin changelists, counted for the EstimatedCountPaginator
+TABLES = ('blog_post', 'blog_comment')
+
+
+# The schema as of this migration. common.pagination.SQLiteRowCounter creates the same and repairs it after later
+# migrations, but a migration must not change when the application code does.
+def install_row_counters(apps, schema_editor):
+    # PostgreSQL estimates the number of rows itself
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE TABLE IF NOT EXISTS row_counts (name TEXT PRIMARY KEY, row_count INTEGER NOT NULL)')
+        for table in TABLES:
+            schema_editor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table} BEGIN "
+                f"UPDATE row_counts SET row_count = row_count + 1 WHERE name = '{table}'; END")
+            schema_editor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table} BEGIN "
+                f"UPDATE row_counts SET row_count = row_count - 1 WHERE name = '{table}'; END")
+            schema_editor.execute(
+                f'INSERT OR REPLACE INTO row_counts (name, row_count) SELECT %s, count(*) FROM {table}', [table])
+
+
+def uninstall_row_counters(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for table in TABLES:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_count_insert')
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_count_delete')
+        schema_editor.execute('DROP TABLE IF EXISTS row_counts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_post_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_row_counters, uninstall_row_counters),
+    ]
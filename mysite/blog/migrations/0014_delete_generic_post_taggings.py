@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+BATCH_SIZE = 1000
+
+
+def delete_generic_taggings(apps, schema_editor):
+    """
+    Deletes the generic taggings of posts that 0011_taggedpost copied to TaggedPost. A tagging without its copy is
+    left in place.
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:
+        return
+    copied = TaggedPost.objects.filter(content_object_id=OuterRef('object_id'), tag_id=OuterRef('tag_id'))
+    TaggedItem.objects.filter(content_type=content_type).filter(Exists(copied)).delete()
+
+
+def restore_generic_taggings(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    content_type, _ = ContentType.objects.get_or_create(app_label='blog', model='post')
+    TaggedItem.objects.bulk_create(
+        (TaggedItem(content_type=content_type, object_id=post_id, tag_id=tag_id)
+         for post_id, tag_id in TaggedPost.objects.values_list('content_object_id', 'tag_id')
+         .iterator(chunk_size=BATCH_SIZE)),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('blog', '0013_row_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_generic_taggings, restore_generic_taggings),
+    ]
@@ -1,11 +1,47 @@
+from datetime import date, datetime, time, timedelta
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.mail import EmailMessage
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 from django.urls import reverse
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItemBase
+
+from . import fragments, pagecache
+from .rendering import render_body, render_excerpt
+
+
+class PostQuerySet(models.QuerySet):
+    """
+    Loads everything the blog templates access for each post up front, so that rendering a page costs the same
+    number of queries no matter how many posts, tags or comments it shows.
+    """
+    def for_list(self):
+        # post.author and post.tags.all are shown for every post of the list page
+        return self.select_related('author').prefetch_related('tags').defer('search_vector')
+
+    def for_detail(self):
+        return self.select_related('author').defer('search_vector')
+
+    def published_on(self, year, month, day):
+        """
+        Posts published on the given day of the current time zone. Unlike publish__year/__month/__day, which
+        extract the parts of every row's date, the half-open range [day, next day) can seek an index on publish.
+        """
+        try:
+            day = date(year, month, day)
+        except ValueError:
+            return self.none()
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+        return self.filter(publish__gte=start, publish__lt=end)
 
 
-class PublishedManager(models.Manager):
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     def get_queryset(self):
         return super(PublishedManager, self).get_queryset().filter(status='published')
 
@@ -16,8 +52,10 @@ class Post(models.Model):
         ('published', 'Published'),
     )
     title = models.CharField(max_length=250)
+    # indexed together with publish, see Meta.indexes
     slug = models.SlugField(max_length=250,
-                            unique_for_date='publish')
+                            unique_for_date='publish',
+                            db_index=False)
     # author: This field defines a many-to-one relationship, meaning that each post is written by a user,
     # and a user can write any number of posts. For this field, Django will create a foreign key in the database
     # using the primary key of the related model. In this case, you are relying on the User model of the
@@ -26,15 +64,25 @@ class Post(models.Model):
                                on_delete=models.CASCADE,
                                related_name='blog_posts')
     body = models.TextField()
+    # body rendered from markdown to html. Both fields are filled on save() so templates don't have to parse markdown
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
     publish = models.DateTimeField(default=timezone.now)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=10,
                               choices=STATUS_CHOICES,
                               default='draft')
+    # number of active comments. Maintained by Comment and the signals, never written by Post.save()
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # weighted full text search vector of title and body, only filled on PostgreSQL (see search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
     objects = models.Manager()  # The default manager.
     published = PublishedManager()  # Our custom manager.
-    tags = TaggableManager()
+    tags = TaggableManager(through='TaggedPost')
+
+    # fields that are updated in the database directly and never written by save()
+    DATABASE_FIELDS = ('comment_count', 'search_vector')
 
     class Meta:
         """
@@ -43,10 +91,65 @@ class Post(models.Model):
         the negative prefix. By doing this, posts published recently will appear first.
         """
         ordering = ('-publish',)
+        indexes = [
+            # the list pages: published posts by publish date
+            models.Index(fields=['status', 'publish'], name='blog_post_status_publish_idx'),
+            # post_detail: a slug within the range of its publish day
+            models.Index(fields=['slug', 'publish'], name='blog_post_slug_publish_idx'),
+            # most commented posts
+            models.Index(fields=['status', '-comment_count'], name='blog_post_comment_count_idx'),
+            # MAX(updated) of the published posts for the sitemap
+            models.Index(fields=['status', 'updated'], name='blog_post_status_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super().from_db(db, field_names, values)
+        # remember what the similar posts depend on, to update them only when it changes (see signals.py)
+        post._stored_listing = (post.__dict__.get('status'), post.__dict__.get('publish'))
+        return post
+
+    def render(self):
+        """
+        Renders the markdown body into body_html and excerpt_html. Does not save the post.
+        """
+        self.body_html = render_body(self.body)
+        self.excerpt_html = render_excerpt(self.body_html)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'body' in update_fields:
+            self.render()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'body_html', 'excerpt_html'}
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # don't overwrite the fields maintained by the database with the values that were loaded,
+            # e.g. comments may have changed comment_count meanwhile
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.DATABASE_FIELDS]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def change_comment_count(cls, post_id, delta):
+        """
+        Atomically adds delta to the comment_count of a post. The update happens in the database with an F()
+        expression, so concurrent changes don't get lost.
+        """
+        if delta:
+            cls.objects.filter(pk=post_id).update(comment_count=Greatest(F('comment_count') + delta, 0))
+
+    @classmethod
+    def active_comment_count(cls):
+        """
+        Subquery counting the active comments of the outer post, to repair comment_count.
+        """
+        counts = Comment.objects.filter(post=OuterRef('pk'), active=True).order_by().values('post') \
+            .annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts), 0)
+
     def get_absolute_url(self):
         """
         Canonical URLs for models
@@ -55,6 +158,136 @@ class Post(models.Model):
         return reverse('blog:post_detail', args=[self.publish.year, self.publish.month, self.publish.day, self.slug])
 
 
+class TaggedPost(TaggedItemBase):
+    """
+    The tags of a post. taggit's generic TaggedItem stores (content_type, object_id, tag), which has no index to
+    find the posts of a tag; this table joins tags and posts directly.
+    """
+    content_object = models.ForeignKey(Post,
+                                       on_delete=models.CASCADE,
+                                       related_name='tagged_items')
+
+    class Meta:
+        # also the (tag, post) index of the tag pages
+        unique_together = ('tag', 'content_object')
+
+
+class TagCount(models.Model):
+    """
+    The number of published posts per tag, for the tag cloud. Recounted whenever the taggings or the status of a
+    post change (see signals.py).
+    """
+    tag = models.OneToOneField(Tag,
+                               on_delete=models.CASCADE,
+                               primary_key=True,
+                               related_name='post_count')
+    published_posts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-published_posts'], name='blog_tagcount_posts_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag}: {self.published_posts}'
+
+    @classmethod
+    def recount(cls, tag_ids):
+        """
+        Counts the published posts of the given tags again. Each count reads the (tag, post) index of TaggedPost.
+        """
+        tag_ids = set(tag_ids)
+        if not tag_ids:
+            return
+        cls.objects.bulk_create([cls(tag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True)
+        published = TaggedPost.objects.filter(tag=OuterRef('pk'), content_object__status='published') \
+            .order_by().values('tag').annotate(total=Count('pk')).values('total')
+        cls.objects.filter(tag_id__in=tag_ids).update(published_posts=Coalesce(Subquery(published), 0))
+        # the tag cloud in the sidebar
+        fragments.invalidate()
+
+
+class SimilarPost(models.Model):
+    """
+    The most similar published posts of a post, ranked by shared tags (see similarity.py).
+    """
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='similar_posts')
+    similar = models.ForeignKey(Post,
+                                on_delete=models.CASCADE,
+                                related_name='+')
+    shared_tags = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ('post', 'rank')
+        # also the index for reading the similar posts of a post in order
+        unique_together = ('post', 'rank')
+
+    def __str__(self):
+        return f'{self.similar} is similar to {self.post}'
+
+
+class OutgoingEmail(models.Model):
+    """
+    An e-mail waiting in the outbox, sent by `python manage.py send_outbox` (see outbox.py).
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.TextField(help_text='One address per line.')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # when the e-mail is due: the time it was queued, the next retry or the end of the lease of a worker sending it
+    next_attempt = models.DateTimeField(default=timezone.now)
+    claim = models.UUIDField(null=True, blank=True, editable=False)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('next_attempt',)
+        indexes = [
+            # the due e-mails of the outbox
+            models.Index(fields=['status', 'next_attempt'], name='blog_email_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to}'
+
+    @property
+    def recipients(self):
+        return self.to.split()
+
+    def message(self):
+        return EmailMessage(self.subject, self.body, self.from_email, self.recipients)
+
+
+class CommentQuerySet(models.QuerySet):
+    def set_active(self, active):
+        """
+        Activates or deactivates all comments of the queryset and updates the comment counters of their posts.
+        Returns the number of changed comments.
+        """
+        with transaction.atomic():
+            changed = self.filter(active=not active)
+            per_post = list(changed.order_by().values_list('post').annotate(total=Count('pk')))
+            # touching `updated` changes the validators of the post's page (see views.py)
+            updated = changed.update(active=active, updated=timezone.now())
+            for post_id, total in per_post:
+                Post.change_comment_count(post_id, total if active else -total)
+        # update() doesn't send signals, so the sidebar fragments and the pages have to be invalidated here
+        fragments.invalidate()
+        pagecache.invalidate(*[f'post:{post_id}' for post_id, _ in per_post])
+        return updated
+
+
 class Comment(models.Model):
     """
     The related_name attribute allows you to name the attribute that you use for the relationship
@@ -71,8 +304,37 @@ class Comment(models.Model):
     updated = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ('created',)
 
     def __str__(self):
         return f'Comment by {self.name} on {self.post}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        comment = super().from_db(db, field_names, values)
+        # remember the stored state to find out how save() changes the comment counters
+        if 'post_id' in comment.__dict__ and 'active' in comment.__dict__:
+            comment._stored_counted = (comment.post_id, comment.active)
+        return comment
+
+    def _get_stored_counted(self):
+        if self._state.adding:
+            return None, False
+        if not hasattr(self, '_stored_counted'):
+            # loaded with deferred fields
+            self._stored_counted = Comment.objects.values_list('post_id', 'active').get(pk=self.pk)
+        return self._stored_counted
+
+    def save(self, *args, **kwargs):
+        stored_post_id, stored_active = self._get_stored_counted()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if (stored_post_id, stored_active) != (self.post_id, self.active):
+                if stored_active:
+                    Post.change_comment_count(stored_post_id, -1)
+                if self.active:
+                    Post.change_comment_count(self.post_id, 1)
+        self._stored_counted = (self.post_id, self.active)
@@ -0,0 +1,97 @@
+"""
+Outbox for the e-mails of the blog.
+
+Sending an e-mail inside a request blocks the request for as long as the SMTP server takes to answer, up to the whole
+timeout if it hangs. Views only queue e-mails with enqueue(); `python manage.py send_outbox` sends them in batches,
+each batch over a single SMTP connection.
+
+A worker claims a batch with one UPDATE that sets a random claim id and moves next_attempt to the end of its lease,
+so concurrent workers never send the same e-mail, and the e-mails of a worker that died are sent again once its lease
+is over. Failed e-mails are retried with exponential backoff, after MAX_ATTEMPTS attempts they are marked as failed.
+"""
+import uuid
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+BATCH_SIZE = 50
+LEASE = timedelta(minutes=5)  # has to be longer than sending a batch takes
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(minutes=1)  # doubled after every failed attempt
+
+
+def enqueue(subject, message, from_email, recipient_list):
+    """
+    Queues an e-mail. Takes the same arguments as django.core.mail.send_mail().
+    """
+    return OutgoingEmail.objects.create(subject=subject, body=message, from_email=from_email,
+                                        to='\n'.join(recipient_list))
+
+
+def _due():
+    return OutgoingEmail.objects.filter(status='queued', next_attempt__lte=timezone.now())
+
+
+def claim_batch(batch_size=BATCH_SIZE, lease=LEASE):
+    """
+    Claims up to batch_size due e-mails for this worker, oldest first. Returns an empty list if none are due.
+    """
+    claim = uuid.uuid4()
+    while True:
+        ids = list(_due().order_by('next_attempt').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # e-mails claimed by another worker since the select are not due anymore and are left out by the update
+        if _due().filter(id__in=ids).update(claim=claim, next_attempt=timezone.now() + lease):
+            return list(OutgoingEmail.objects.filter(id__in=ids, claim=claim))
+
+
+def send_batch(emails, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+    """
+    Sends the claimed e-mails over one connection of the EMAIL_BACKEND. Returns the number of sent e-mails.
+    """
+    sent, failed = [], []
+    try:
+        with get_connection() as connection:
+            for email in emails:
+                try:
+                    if not connection.send_messages([email.message()]):
+                        raise ValueError('The e-mail backend did not send the e-mail.')
+                except Exception as error:
+                    failed.append((email, error))
+                else:
+                    sent.append(email)
+    except Exception as error:
+        # the connection could not be opened
+        failed = [(email, error) for email in emails if email not in sent]
+
+    now = timezone.now()
+    OutgoingEmail.objects.filter(id__in=[email.pk for email in sent]) \
+        .update(status='sent', sent=now, attempts=F('attempts') + 1, last_error='')
+    for email, error in failed:
+        email.attempts += 1
+        email.last_error = f'{type(error).__name__}: {error}'
+        if email.attempts >= max_attempts:
+            email.status = 'failed'
+        else:
+            email.next_attempt = now + retry_delay * 2 ** (email.attempts - 1)
+        email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt'])
+    return len(sent)
+
+
+def drain(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+    """
+    Sends batches until no e-mail is due. Returns the number of sent e-mails and of failed attempts.
+    """
+    sent = failed = 0
+    while True:
+        emails = claim_batch(batch_size)
+        if not emails:
+            return sent, failed
+        sent_now = send_batch(emails, max_attempts, retry_delay)
+        sent += sent_now
+        failed += len(emails) - sent_now
@@ -0,0 +1,99 @@
+"""
+Page cache for the blog pages anonymous visitors see.
+
+A cached page is stored under its URL including the query string (so every page of the cursor pagination is a page
+of its own) together with the versions of its dependencies: the tags the view declared with depends_on(), e.g. the
+post of a detail page. A signal invalidates a dependency by deleting its version (see signals.py), which invalidates
+every page depending on it, and a cached page is only served while all its versions are unchanged:
+
+- 'post:<id>': the detail page of a post, also invalidated by the posts it shows as similar posts
+- 'posts': the list pages
+- 'tag:<id>': the list pages of a tag
+
+The sidebar of a cached page is not a dependency, otherwise every comment would invalidate all pages; it is at most
+BLOG_PAGE_CACHE_TIMEOUT seconds old.
+
+Cached pages are the same for every visitor, only the CSRF token of a form is replaced with the visitor's own.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b'{csrf-token}'
+
+
+def _timeout():
+    return getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 10 * 60)
+
+
+def _version_key(tag):
+    return f'blog:pages:version:{tag}'
+
+
+def _page_key(request):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'blog:pages:page:{url}'
+
+
+def _versions(tags, create=False):
+    keys = {_version_key(tag): tag for tag in tags}
+    versions = cache.get_many(keys)
+    if create:
+        for key in keys.keys() - versions.keys():
+            cache.add(key, time.time_ns(), None)
+        versions = cache.get_many(keys)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def depends_on(request, *tags):
+    """
+    Declares that the page of the request depends on the given tags. Has to be called before the data the page
+    shows is read, so that an invalidation while rendering leaves the page uncached.
+    """
+    if hasattr(request, '_page_versions'):
+        request._page_versions.update(_versions(tags, create=True))
+
+
+def invalidate(*tags):
+    cache.delete_many([_version_key(tag) for tag in tags])
+
+
+def _response(request, content):
+    if CSRF_PLACEHOLDER in content:
+        # also makes the CSRF middleware set the cookie for the token
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    return HttpResponse(content)
+
+
+def cache_page(view):
+    """
+    Serves successful GET requests of anonymous visitors from the page cache. Pages whose view doesn't call
+    depends_on() are not cached.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _timeout() or request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        key = _page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            versions, content = entry
+            if _versions(versions) == versions:
+                return _response(request, content)
+
+        request._page_versions = {}
+        response = view(request, *args, **kwargs)
+        versions = request._page_versions
+        if versions and response.status_code == 200 and not response.streaming and not response.cookies:
+            content = CSRF_INPUT.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+            cache.set(key, (versions, content), _timeout())
+        return response
+    return wrapper
@@ -0,0 +1,22 @@
+"""
+Markdown rendering for blog posts.
+
+Rendering Markdown is the most expensive part of displaying a post, so the HTML is rendered once when a post is
+saved and stored next to the raw body (see Post.body_html / Post.excerpt_html).
+"""
+import markdown
+from django.utils.text import Truncator
+
+# number of words shown for a post on the list page
+EXCERPT_WORDS = 30
+
+
+def render_body(text):
+    return markdown.markdown(text)
+
+
+def render_excerpt(html, words=EXCERPT_WORDS):
+    """
+    Truncates already rendered html. Like the truncatewords_html filter, this avoids unclosed html tags.
+    """
+    return Truncator(html).words(words, html=True, truncate=' …')
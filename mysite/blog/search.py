@@ -0,0 +1,223 @@
+"""
+Full text search for blog posts.
+
+The search engine depends on the database: PostgreSQL searches a stored tsvector, SQLite an FTS5 table and every
+other database falls back to LIKE. get_backend() picks the backend for the database vendor, the BLOG_SEARCH_BACKEND
+setting (a dotted path to a backend class) overrides it.
+
+Every backend returns published posts ordered by relevance, annotated with `rank` and `headline`: a part of the body
+as plain text, with the search terms between the MARK_START and MARK_STOP characters. The body is Markdown that may
+contain HTML and the part may cut a tag in half, so the headline is never output as is; highlight() escapes it and
+turns the markers into <mark> (the `headline` template filter).
+"""
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Q, Value
+from django.db.models.functions import Substr
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+from .models import Post
+
+# control characters that don't occur in posts, they survive escape() unlike <mark>
+MARK_START = '\x02'
+MARK_STOP = '\x03'
+
+
+def highlight(headline):
+    """
+    Escapes the headline and wraps the marked search terms in <mark>. Stray markers are dropped, so the marks are
+    always balanced.
+    """
+    parts = []
+    marked = False
+    for part in re.split(f'([{MARK_START}{MARK_STOP}])', headline or ''):
+        if part == MARK_START:
+            if not marked:
+                parts.append('<mark>')
+            marked = True
+        elif part == MARK_STOP:
+            if marked:
+                parts.append('</mark>')
+            marked = False
+        else:
+            parts.append(escape(part))
+    if marked:
+        parts.append('</mark>')
+    return mark_safe(''.join(parts))
+
+
+class BaseSearchBackend:
+    def search(self, query):
+        raise NotImplementedError
+
+    def update(self, queryset):
+        """
+        Updates the index for the posts of the queryset after they were saved. Returns the number of updated posts.
+        """
+        return 0
+
+    def rebuild(self, batch_size=1000):
+        """
+        Rebuilds the index of all posts. Returns the number of indexed posts.
+        """
+        return 0
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """
+    Fallback without any index: scans title and body of every published post and doesn't rank.
+    """
+
+    def search(self, query):
+        return Post.published.defer('search_vector') \
+            .filter(Q(title__icontains=query) | Q(body__icontains=query)) \
+            .annotate(rank=Value(0), headline=Substr('body', 1, 200)) \
+            .order_by('-publish', '-id')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Instead of building SearchVector('title', 'body') for every published post on every search, the weighted vector
+    is stored in Post.search_vector when a post is saved and searched through a GIN index. Matches in the title weigh
+    more than matches in the body, results are ordered by SearchRank.
+    """
+    vector = SearchVector('title', weight='A') + SearchVector('body', weight='B')
+
+    def search(self, query):
+        search_query = SearchQuery(query)
+        return Post.published.defer('search_vector') \
+            .filter(search_vector=search_query) \
+            .annotate(rank=SearchRank(F('search_vector'), search_query),
+                      headline=SearchHeadline('body', search_query, start_sel=MARK_START, stop_sel=MARK_STOP,
+                                              max_words=35, min_words=15)) \
+            .order_by('-rank', '-publish', '-id')
+
+    def update(self, queryset):
+        return queryset.update(search_vector=self.vector)
+
+    def rebuild(self, batch_size=1000):
+        last_id = 0
+        updated = 0
+        while True:
+            # one UPDATE per id range, so the rows are not locked all at once
+            ids = list(Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return updated
+            last_id = ids[-1]
+            updated += self.update(Post.objects.filter(id__in=ids))
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Searches the FTS5 table blog_post_fts, an external content index of the title and body of blog_post. Triggers
+    keep it in sync with blog_post, so saving a post doesn't need to do anything, and bulk updates are indexed too.
+    Results are ordered by BM25, where title matches weigh more than body matches.
+    """
+    table = 'blog_post_fts'
+    title_weight = 10.0
+    body_weight = 1.0
+
+    create_sql = [
+        # porter: "guitar" finds "guitars", like the stemming of PostgreSQL
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+        f"title, body, content='blog_post', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON blog_post BEGIN "
+        f"INSERT INTO {table}(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON blog_post BEGIN "
+        f"INSERT INTO {table}({table}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF title, body ON blog_post BEGIN "
+        f"INSERT INTO {table}({table}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+        f"INSERT INTO {table}(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    ]
+    drop_sql = [
+        f'DROP TRIGGER IF EXISTS {table}_insert',
+        f'DROP TRIGGER IF EXISTS {table}_delete',
+        f'DROP TRIGGER IF EXISTS {table}_update',
+        f'DROP TABLE IF EXISTS {table}',
+    ]
+
+    @classmethod
+    def _installed(cls, cursor):
+        cursor.execute("SELECT type, count(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s) GROUP BY type",
+                       [cls.table, f'{cls.table}_insert', f'{cls.table}_delete', f'{cls.table}_update'])
+        return dict(cursor.fetchall())
+
+    @classmethod
+    def install(cls, cursor, force=False):
+        """
+        Creates the FTS table and its triggers, and indexes all posts if something was missing (or force is set).
+        Returns True if the index was rebuilt.
+        """
+        if not force and cls._installed(cursor) == {'table': 1, 'trigger': 3}:
+            return False
+        for sql in cls.create_sql:
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {cls.table}({cls.table}) VALUES ('rebuild')")
+        return True
+
+    @classmethod
+    def repair(cls, cursor):
+        """
+        SQLite drops the triggers of blog_post whenever a migration has to remake the table. Reinstalls them and
+        reindexes all posts, if the FTS table was installed before.
+        """
+        if cls._installed(cursor).get('table'):
+            return cls.install(cursor)
+        return False
+
+    @classmethod
+    def uninstall(cls, cursor):
+        for sql in cls.drop_sql:
+            cursor.execute(sql)
+
+    @staticmethod
+    def match_expression(query):
+        """
+        Turns the user's query into an FTS5 expression that finds posts containing all of its words. Quoting every
+        word keeps characters with a meaning in FTS5 (quotes, AND, NEAR, *, ...) from causing syntax errors.
+        """
+        words = re.findall(r'\w+', query)
+        return ' '.join(f'"{word}"' for word in words)
+
+    def search(self, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return Post.published.none()
+        table = self.table
+        return Post.published.defer('search_vector').extra(
+            tables=[table],
+            where=[f'{table}.rowid = blog_post.id', f'{table} MATCH %s'],
+            params=[expression],
+            select={
+                'rank': f'bm25({table}, %s, %s)',
+                'headline': f"snippet({table}, 1, char(2), char(3), '…', 35)",  # MARK_START, MARK_STOP
+            },
+            select_params=[self.title_weight, self.body_weight],
+        ).order_by('rank', '-publish', '-id')  # bm25() is lower for better matches
+
+    def rebuild(self, batch_size=1000):
+        with connection.cursor() as cursor:
+            self.install(cursor, force=True)
+        return Post.objects.count()
+
+
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend():
+    path = getattr(settings, 'BLOG_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return VENDOR_BACKENDS.get(connection.vendor, LikeSearchBackend)()
+
+
+def search_posts(query):
+    return get_backend().search(query)
@@ -0,0 +1,150 @@
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from taggit.models import Tag
+
+from common.pagination import SQLiteRowCounter
+from . import fragments, pagecache, search, similarity
+from .models import Comment, Post, SimilarPost, TagCount, TaggedPost
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_fragments(sender, **kwargs):
+    fragments.invalidate()
+    # a request running between now and the commit could cache the old state again under the new version,
+    # so invalidate once more when the transaction is committed
+    transaction.on_commit(fragments.invalidate)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    # also sent for every comment of a deleted queryset, e.g. the "delete selected" admin action
+    if instance.active:
+        Post.change_comment_count(instance.post_id, -1)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_similar_posts_on_tags(sender, instance, action, reverse, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        similarity.update_for_post(instance)
+
+
+def invalidate_pages(*tags):
+    pagecache.invalidate(*tags)
+    # same as for the fragments: a request running until the commit could cache the old page again
+    transaction.on_commit(lambda: pagecache.invalidate(*tags))
+
+
+def pages_of_posts(post_ids, tag_ids=()):
+    """
+    The pages showing the given posts: their detail pages, the list pages and the pages of their tags and of the
+    given tags. A list page shows every post with all its tags.
+    """
+    taggings = TaggedPost.objects.filter(content_object__in=post_ids)
+    tag_ids = set(tag_ids) | set(taggings.values_list('tag_id', flat=True))
+    return ['posts', *[f'post:{post_id}' for post_id in post_ids], *[f'tag:{tag_id}' for tag_id in tag_ids]]
+
+
+def pages_showing_as_similar(post_id):
+    # a detail page depends on its own post only, so that it is declared before anything is read
+    listing = SimilarPost.objects.filter(similar_id=post_id).values_list('post_id', flat=True)
+    return [f'post:{post_id}' for post_id in listing]
+
+
+@receiver(post_save, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    invalidate_pages(*pages_of_posts([instance.pk]), *pages_showing_as_similar(instance.pk))
+
+
+@receiver(pre_delete, sender=Post)
+def collect_tags_on_delete(sender, instance, **kwargs):
+    # the taggings and the similar posts are deleted before post_delete is sent
+    instance._tag_ids = list(instance.tags.values_list('id', flat=True))
+    instance._pages = pages_of_posts([instance.pk]) + pages_showing_as_similar(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def update_tags_on_delete(sender, instance, **kwargs):
+    invalidate_pages(*getattr(instance, '_pages', ()))
+    if instance.status == 'published':
+        TagCount.recount(getattr(instance, '_tag_ids', ()))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    invalidate_pages(f'post:{instance.post_id}')
+
+
+def touch_posts(posts):
+    # the tags of a post are part of its pages, so changing them has to change the validators (see views.py)
+    posts.update(updated=timezone.now())
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def touch_posts_on_tags(sender, instance, action, pk_set, **kwargs):
+    if action == 'pre_clear' and isinstance(instance, Post):
+        instance._cleared_tag_ids = list(instance.tags.values_list('id', flat=True))
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if isinstance(instance, Post):
+            post_ids, tag_ids = [instance.pk], pk_set or getattr(instance, '_cleared_tag_ids', ())
+        else:
+            post_ids, tag_ids = pk_set or (), [instance.pk]
+        touch_posts(Post.objects.filter(pk__in=post_ids))
+        invalidate_pages(*pages_of_posts(post_ids, tag_ids))
+        TagCount.recount(tag_ids)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_posts_on_tag_change(sender, instance, **kwargs):
+    # a renamed or deleted tag changes the pages of all its posts
+    posts = Post.objects.filter(tags=instance)
+    post_ids = list(posts.values_list('id', flat=True))
+    touch_posts(posts)
+    invalidate_pages(*pages_of_posts(post_ids, [instance.pk]))
+
+
+@receiver(post_save, sender=Post)
+def update_on_publish(sender, instance, created, **kwargs):
+    # only publishing, unpublishing or moving the publish date changes the ranking and the tag counts;
+    # a new post has no tags yet
+    listing = (instance.status, instance.publish)
+    stored = getattr(instance, '_stored_listing', None)
+    if not created and stored != listing:
+        similarity.update_for_post(instance)
+        if stored is None or stored[0] != instance.status:
+            TagCount.recount(instance.tags.values_list('id', flat=True))
+    instance._stored_listing = listing
+
+
+@receiver(pre_delete, sender=Post)
+def collect_similar_posts_on_delete(sender, instance, **kwargs):
+    # deleting the post deletes its entries, the lists that were full have to be refilled
+    instance._full_lists = similarity.full_lists_with(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def update_similar_posts_on_delete(sender, instance, **kwargs):
+    similarity.refill(getattr(instance, '_full_lists', ()))
+
+
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'title', 'body'} & set(update_fields):
+        search.get_backend().update(Post.objects.filter(pk=instance.pk))
+
+
+@receiver(post_migrate)
+def repair_triggers(sender, using, **kwargs):
+    # SQLite drops the triggers of a table whenever a migration has to remake it
+    connection = connections[using]
+    if sender.name == 'blog' and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            search.SQLiteSearchBackend.repair(cursor)
+            for table in (Post._meta.db_table, Comment._meta.db_table):
+                SQLiteRowCounter.repair(cursor, table)
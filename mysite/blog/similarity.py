@@ -0,0 +1,195 @@
+"""
+Similar posts are posts that share tags. Ranking them per request means joining the tags of all published posts, so
+the top SIMILAR_POSTS of every post are stored in the SimilarPost table instead and read with one query.
+
+The overlaps are computed in Python from the (post, tag) pairs: for every post the posts of each of its tags are
+counted, which is the row of the sparse product of the post-tag matrix with its transpose. The full rebuild
+(`python manage.py rebuild_similar_posts`) loads the pairs once.
+
+When the tags, the status or the publish date of a post change, only its overlaps with other posts change.
+update_for_post() counts them with one query, recomputes the list of the post and compares the post with the last
+entry of every other list it could enter or leave, without recomputing those lists. Only a full list the post drops
+out of has to be recomputed to find the post moving up, at most REFILL_LIMIT of them per change; the others keep
+their best SIMILAR_POSTS - 1 posts until the next rebuild. New posts only enter lists, add_similar_posts() adds
+a batch of them at once.
+"""
+import heapq
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from . import pagecache
+from .models import Post, SimilarPost, TaggedPost
+
+SIMILAR_POSTS = 4
+REFILL_LIMIT = 50
+
+
+def _overlaps(post_ids=None):
+    """
+    Returns the publish dates of the published posts involved and a generator of (post id, Counter {other post id:
+    shared tags}) for the given published posts, or for all published posts if post_ids is None.
+    """
+    if post_ids is None:
+        published = dict(Post.published.values_list('id', 'publish'))
+        pairs = list(TaggedPost.objects.values_list('content_object_id', 'tag_id'))
+        targets = published
+    else:
+        tag_ids = TaggedPost.objects.filter(content_object_id__in=post_ids).values('tag_id')
+        pairs = list(TaggedPost.objects.filter(tag_id__in=tag_ids).values_list('content_object_id', 'tag_id'))
+        candidate_ids = {post_id for post_id, _ in pairs} | set(post_ids)
+        published = dict(Post.published.filter(id__in=candidate_ids).values_list('id', 'publish'))
+        targets = [post_id for post_id in post_ids if post_id in published]
+
+    posts_by_tag = defaultdict(list)
+    tags_by_post = defaultdict(list)
+    for post_id, tag_id in pairs:
+        if post_id in published:
+            posts_by_tag[tag_id].append(post_id)
+            tags_by_post[post_id].append(tag_id)
+
+    def overlaps():
+        for post_id in targets:
+            shared = Counter()
+            for tag_id in tags_by_post[post_id]:
+                shared.update(posts_by_tag[tag_id])
+            del shared[post_id]
+            yield post_id, shared
+    return published, overlaps()
+
+
+def compute_similar_posts(post_ids=None):
+    """
+    Returns {post id: [similar post ids, most similar first]} for the given published posts, or for all published
+    posts if post_ids is None. Posts are ranked by the number of shared tags, then by publish date.
+    """
+    published, overlaps = _overlaps(post_ids)
+    similar = {}
+    for post_id, shared in overlaps:
+        ranked = heapq.nsmallest(SIMILAR_POSTS, shared,
+                                 key=lambda other: (-shared[other], published[other], other))
+        similar[post_id] = [(other, shared[other]) for other in ranked]
+    return similar
+
+
+def _rows(similar):
+    for post_id, ranked in similar.items():
+        for rank, (other, shared_tags) in enumerate(ranked):
+            yield SimilarPost(post_id=post_id, similar_id=other, shared_tags=shared_tags, rank=rank)
+
+
+def _store(post_ids, similar):
+    """
+    Replaces the similar posts of the given posts with those of similar, the posts missing in it get none.
+    """
+    rows = list(_rows(similar))
+    with transaction.atomic():
+        SimilarPost.objects.filter(post_id__in=post_ids).delete()
+        SimilarPost.objects.bulk_create(rows)
+    # the detail pages show the similar posts
+    pagecache.invalidate(*[f'post:{post_id}' for post_id in post_ids])
+
+
+def update_similar_posts(post_ids):
+    post_ids = list(post_ids)
+    _store(post_ids, compute_similar_posts(post_ids))
+
+
+def rebuild_similar_posts(batch_size=1000):
+    similar = compute_similar_posts()
+    with transaction.atomic():
+        SimilarPost.objects.all().delete()
+        SimilarPost.objects.bulk_create(_rows(similar), batch_size=batch_size)
+    return len(similar)
+
+
+def refill(post_ids):
+    """
+    Recomputes the lists a post dropped out of, up to REFILL_LIMIT of them.
+    """
+    if post_ids:
+        update_similar_posts(sorted(post_ids)[:REFILL_LIMIT])
+
+
+def add_similar_posts(post_ids):
+    """
+    Updates the similar posts after the given posts were created with their tags, e.g. by import_posts. Their lists
+    are computed and they enter the lists of the other posts they rank in; a new post doesn't push out anything
+    that would have to be recomputed. Loads the (post, tag) pairs of the tags of the given posts only.
+    """
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    published, overlaps = _overlaps(post_ids)
+    changed = {}
+    entering = defaultdict(list)
+    for post_id, shared in overlaps:
+        ranked = heapq.nsmallest(SIMILAR_POSTS, shared,
+                                 key=lambda other: (-shared[other], published[other], other))
+        changed[post_id] = [(-shared[other], published[other], other) for other in ranked]
+        for other, count in shared.items():
+            entering[other].append((-count, published[post_id], post_id))
+
+    stored = defaultdict(list)
+    tag_ids = TaggedPost.objects.filter(content_object_id__in=post_ids).values('tag_id')
+    sharing = TaggedPost.objects.filter(tag_id__in=tag_ids).values('content_object_id')
+    for post_id, other, shared, publish in SimilarPost.objects.filter(post_id__in=sharing) \
+            .order_by('post_id', 'rank').values_list('post_id', 'similar_id', 'shared_tags', 'similar__publish'):
+        stored[post_id].append((-shared, publish, other))
+    for post_id, entries in entering.items():
+        if post_id not in changed:
+            ranked = sorted(stored[post_id] + entries)[:SIMILAR_POSTS]
+            if ranked != stored[post_id]:
+                changed[post_id] = ranked
+
+    _store(list(changed), {post_id: [(other, -shared) for shared, _, other in ranked]
+                           for post_id, ranked in changed.items()})
+
+
+def full_lists_with(post_id):
+    """
+    Returns the ids of the posts that have the given post among their SIMILAR_POSTS similar posts.
+    """
+    lists = SimilarPost.objects.filter(similar_id=post_id).values('post_id')
+    return set(SimilarPost.objects.filter(post_id__in=lists, rank=SIMILAR_POSTS - 1)
+               .values_list('post_id', flat=True))
+
+
+def update_for_post(post):
+    """
+    Updates the similar posts after the tags, the status or the publish date of the given post changed, see the
+    module docstring. Entries are compared as (-shared tags, publish, id), the order of compute_similar_posts().
+    """
+    tag_ids = TaggedPost.objects.filter(content_object_id=post.pk).values('tag_id')
+    sharing = TaggedPost.objects.filter(tag_id__in=tag_ids).values('content_object_id')
+    overlaps = TaggedPost.objects.filter(tag_id__in=tag_ids, content_object__status='published') \
+        .exclude(content_object_id=post.pk).order_by() \
+        .values_list('content_object_id', 'content_object__publish').annotate(shared=Count('id'))
+    candidates = {other: (-shared, publish, other) for other, publish, shared in overlaps}
+
+    stored = defaultdict(list)
+    containing = SimilarPost.objects.filter(similar_id=post.pk).values('post_id')
+    for post_id, other, shared, publish in SimilarPost.objects \
+            .filter(Q(post_id__in=sharing) | Q(post_id__in=containing)).exclude(post_id=post.pk) \
+            .order_by('post_id', 'rank').values_list('post_id', 'similar_id', 'shared_tags', 'similar__publish'):
+        stored[post_id].append((-shared, publish, other))
+
+    published = post.status == 'published'
+    changed = {post.pk: heapq.nsmallest(SIMILAR_POSTS, candidates.values()) if published else []}
+    dropped = []
+    for post_id in candidates.keys() | stored.keys():
+        # in the stored order, which changes for a moved publish date
+        entries = stored[post_id]
+        kept = [entry for entry in entries if entry[2] != post.pk]
+        entry = (candidates[post_id][0], post.publish, post.pk) if published and post_id in candidates else None
+        if len(kept) < len(entries) == SIMILAR_POSTS and (entry is None or not kept or entry > kept[-1]):
+            # the post moving up in place of this one isn't stored
+            dropped.append(post_id)
+        ranked = sorted(kept + [entry] if entry else kept)[:SIMILAR_POSTS]
+        if ranked != entries:
+            changed[post_id] = ranked
+
+    _store(list(changed), {post_id: [(other, -shared) for shared, _, other in ranked]
+                           for post_id, ranked in changed.items()})
+    refill(dropped)
@@ -1,20 +1,126 @@
-from django.contrib.sitemaps import Sitemap
+"""
+Sitemap of the published posts.
+
+django.contrib.sitemaps loads every post including its body, renders one big template and pages with OFFSET. Here the
+sitemap.xml is an index of sections, each covering a fixed range of post ids. A section only selects the columns it
+needs and streams the XML, so memory and time per request don't grow with the number of posts. Both views answer
+conditional requests from MAX(updated), so unchanged sitemaps cost one aggregate query and return 304.
+"""
+from xml.sax.saxutils import escape
+
+from django.contrib.sites.shortcuts import get_current_site
+from django.db.models import Count, Max, Q
+from django.http import Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import condition
 
 from .models import Post
 
 
-class PostSitemap(Sitemap):
+class PostSitemap:
     changefreq = 'weekly'
     priority = 0.9  # relevance of post app within our website
+    limit = 5000  # post ids per section
 
-    def items(self):
+    def sections(self):
         """
-        By default, Django calls the get_absolute_url() method on each object to retrieve its URL.
+        Returns the number of sections and the last modification of all published posts.
         """
-        return Post.published.all()
+        stats = Post.published.aggregate(max_id=Max('id'), updated=Max('updated'))
+        sections = -(-(stats['max_id'] or 0) // self.limit)
+        return sections, stats['updated']
 
-    def lastmod(self, obj):
+    def section_items(self, section):
+        start = (section - 1) * self.limit
+        return Post.published.filter(id__gt=start, id__lte=start + self.limit)
+
+    def section_stats(self, section):
         """
-        The lastmod method receives each object returned by items() and returns the last time the object was modified
+        Returns the number of posts and the last modification of a section, and as `last` the highest id of all
+        published posts from the section on, which is None for a section past the last one of the index.
         """
-        return obj.updated
+        start = (section - 1) * self.limit
+        in_section = Q(id__lte=start + self.limit)
+        return Post.published.filter(id__gt=start).aggregate(
+            count=Count('id', filter=in_section), updated=Max('updated', filter=in_section), last=Max('id'))
+
+    def items(self, section):
+        """
+        The posts of a section, as (publish, slug, updated) tuples instead of full rows including the body.
+        """
+        return self.section_items(section).order_by('id').values_list('publish', 'slug', 'updated') \
+            .iterator(chunk_size=1000)
+
+    def location(self, publish, slug):
+        # same as Post.get_absolute_url()
+        return reverse('blog:post_detail', args=[publish.year, publish.month, publish.day, slug])
+
+
+post_sitemap = PostSitemap()
+
+
+def _xml(root, children):
+    """
+    Yields the XML document chunk by chunk, one chunk per child element.
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield f'<{root} xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for name, elements in children:
+        values = ''.join(f'<{element}>{escape(value)}</{element}>' for element, value in elements)
+        yield f'<{name}>{values}</{name}>\n'
+    yield f'</{root}>\n'
+
+
+def _timestamp(updated):
+    return updated.timestamp() if updated else 0
+
+
+def _index_stats(request):
+    # computed once per request for the ETag, the Last-Modified header and the response
+    if not hasattr(request, '_sitemap_index'):
+        request._sitemap_index = post_sitemap.sections()
+    return request._sitemap_index
+
+
+def _section_stats(request, section):
+    if not hasattr(request, '_sitemap_section'):
+        # like django.contrib.sitemaps for a page past the last one, raised before the conditional response
+        if section < 1:
+            raise Http404('No such sitemap section.')
+        stats = post_sitemap.section_stats(section)
+        if stats['last'] is None:
+            raise Http404('No such sitemap section.')
+        request._sitemap_section = stats
+    return request._sitemap_section
+
+
+def _index_etag(request):
+    sections, updated = _index_stats(request)
+    return f'{sections}-{_timestamp(updated)}'
+
+
+def _section_etag(request, section):
+    stats = _section_stats(request, section)
+    # the count changes when a post of the section is deleted or unpublished, MAX(updated) might not
+    return f'{section}-{stats["count"]}-{_timestamp(stats["updated"])}'
+
+
+@condition(etag_func=_index_etag, last_modified_func=lambda request: _index_stats(request)[1])
+def sitemap_index(request):
+    sections, _ = _index_stats(request)
+    base = f'{request.scheme}://{get_current_site(request).domain}'
+    children = (('sitemap', [('loc', base + reverse('post_sitemap', args=[section]))])
+                for section in range(1, sections + 1))
+    return StreamingHttpResponse(_xml('sitemapindex', children), content_type='application/xml')
+
+
+@condition(etag_func=_section_etag,
+           last_modified_func=lambda request, section: _section_stats(request, section)['updated'])
+def sitemap_section(request, section):
+    base = f'{request.scheme}://{get_current_site(request).domain}'
+    children = (('url', [('loc', base + post_sitemap.location(publish, slug)),
+                         ('lastmod', updated.date().isoformat()),
+                         ('changefreq', post_sitemap.changefreq),
+                         ('priority', str(post_sitemap.priority))])
+                for publish, slug, updated in post_sitemap.items(section))
+    return StreamingHttpResponse(_xml('urlset', children), content_type='application/xml')
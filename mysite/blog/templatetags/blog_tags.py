@@ -1,30 +1,79 @@
-import markdown
 from django import template
-from django.db.models import Count
+from django.conf import settings
 from django.utils.safestring import mark_safe
 
-from ..models import Post
+from .. import fragments
+from ..models import Post, TagCount
+from ..rendering import render_body, render_excerpt
+from ..search import highlight
 # register var needs to be defined to be a valid tag library
 # it is used to register this template tag.
 register = template.Library()
 
 
+# The sidebar tags below are rendered on every blog page, so their results are cached until a post or comment
+# changes (see fragments.py). The sidebar only links to posts, which needs the title, slug and publish date.
+SIDEBAR_FIELDS = ('title', 'slug', 'publish')
+
+
 @register.simple_tag
 def total_posts():
-    return Post.published.count()
+    return fragments.get_or_compute('total_posts', (), Post.published.count)
 
 
 @register.inclusion_tag("blog/post/latest_posts.html")
 def show_latest_posts(count=5):
-    latest_posts = Post.published.order_by("-publish")[:count]
+    latest_posts = fragments.get_or_compute(
+        'latest_posts', (count,),
+        lambda: list(Post.published.only(*SIDEBAR_FIELDS).order_by("-publish")[:count]))
     return {'latest_posts': latest_posts}
 
 
 @register.simple_tag
 def get_most_commented_posts(count=5):
-    return Post.published.annotate(total_comments=Count('comments')).order_by('-total_comments')[:count]
+    return fragments.get_or_compute(
+        'most_commented_posts', (count,),
+        # comment_count is maintained on the post, so this reads the (status, -comment_count) index
+        lambda: list(Post.published.only(*SIDEBAR_FIELDS).order_by('-comment_count')[:count]))
+
+
+@register.inclusion_tag("blog/post/tag_cloud.html")
+def show_tag_cloud(count=20):
+    tags = fragments.get_or_compute(
+        'tag_cloud', (count,),
+        # the counters are maintained per tag, so this reads the -published_posts index instead of the taggings
+        lambda: list(TagCount.objects.filter(published_posts__gt=0).select_related('tag')
+                     .order_by('-published_posts')[:count]))
+    return {'tag_counts': tags}
+
+
+@register.filter(name="headline")
+def headline_format(headline):
+    return highlight(headline)
 
 
 @register.filter(name="markdown")
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text))
+    return mark_safe(render_body(text))
+
+
+def _render_fallback():
+    """
+    Posts that were saved before body_html existed are only rendered on the fly if BLOG_MARKDOWN_FALLBACK is set.
+    Run `manage.py render_posts` to fill them in.
+    """
+    return getattr(settings, 'BLOG_MARKDOWN_FALLBACK', False)
+
+
+@register.filter
+def post_body(post):
+    if not post.body_html and _render_fallback():
+        return markdown_format(post.body)
+    return mark_safe(post.body_html)
+
+
+@register.filter
+def post_excerpt(post):
+    if not post.excerpt_html and _render_fallback():
+        return mark_safe(render_excerpt(render_body(post.body)))
+    return mark_safe(post.excerpt_html)
@@ -1,3 +1,1155 @@
-from django.test import TestCase
+import ast
+import importlib
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count
+from django.template import Context, Template
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from blog import fragments, outbox, pagecache, search, similarity
+from blog.models import Comment, OutgoingEmail, Post, SimilarPost, TagCount, TaggedPost
+from common.pagination import CursorPaginator, EstimatedCountPaginator, SQLiteRowCounter, estimate_count
+from taggit.models import Tag, TaggedItem
+
+
+class PostRenderingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def create_post(self, body, **kwargs):
+        return Post.objects.create(title='A post', slug='a-post', author=self.author, body=body,
+                                   status='published', **kwargs)
+
+    def test_save_renders_body_and_excerpt(self):
+        post = self.create_post('Some *markdown* ' + 'word ' * 50)
+        self.assertIn('<em>markdown</em>', post.body_html)
+        self.assertTrue(post.excerpt_html.endswith('…</p>'))
+        self.assertLess(len(post.excerpt_html), len(post.body_html))
+
+    def test_save_with_update_fields_rerenders_body(self):
+        post = self.create_post('old')
+        post.body = '**new**'
+        post.save(update_fields=['body'])
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p><strong>new</strong></p>')
+
+    def test_render_posts_command_backfills_missing_html(self):
+        post = self.create_post('*backfill*')
+        Post.objects.filter(pk=post.pk).update(body_html='', excerpt_html='')
+        out = StringIO()
+        call_command('render_posts', stdout=out)
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p><em>backfill</em></p>')
+        self.assertIn('Rendered 1 post(s).', out.getvalue())
+
+    def test_migration_renders_existing_posts(self):
+        post = self.create_post('Some *markdown* ' + 'word ' * 50)
+        rendered = (post.body_html, post.excerpt_html)
+        Post.objects.update(body_html='', excerpt_html='')
+        importlib.import_module('blog.migrations.0004_post_body_html').render_posts(apps, None)
+        post.refresh_from_db()
+        self.assertEqual((post.body_html, post.excerpt_html), rendered)
+
+    def test_post_body_filter_fallback_is_opt_in(self):
+        post = self.create_post('*late*')
+        Post.objects.filter(pk=post.pk).update(body_html='', excerpt_html='')
+        post.refresh_from_db()
+        template = Template('{% load blog_tags %}{{ post|post_body }}')
+        with override_settings(BLOG_MARKDOWN_FALLBACK=False):
+            self.assertEqual(template.render(Context({'post': post})), '')
+        with override_settings(BLOG_MARKDOWN_FALLBACK=True):
+            self.assertEqual(template.render(Context({'post': post})), '<p><em>late</em></p>')
+
+
+# the page cache would serve the repeated requests without rendering
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class PostQueryCountTests(TestCase):
+    """
+    The number of queries a page needs must not depend on the number of posts, tags or comments it shows.
+    If one of these tests fails after a template change, the template most likely accesses a relation per object.
+    """
+    # counted with an empty cache, i.e. including the queries of the sidebar tags
+    SIDEBAR_QUERIES = 4  # total, latest, most commented, tag cloud
+    LIST_QUERIES = 3 + SIDEBAR_QUERIES  # validators, posts + authors, tags
+    DETAIL_QUERIES = 4 + SIDEBAR_QUERIES  # validators, post + author, comments, similar posts
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_posts(self, count, tags_per_post, comments_per_post):
+        posts = []
+        for i in range(count):
+            post = Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=self.author, body='body',
+                                       status='published')
+            post.tags.add(*[f'tag-{t}' for t in range(tags_per_post)])
+            Comment.objects.bulk_create(
+                Comment(post=post, name='reader', email='reader@example.com', body='comment')
+                for _ in range(comments_per_post))
+            posts.append(post)
+        return posts
+
+    def test_post_list_query_count_is_constant(self):
+        for count, tags in ((1, 1), (10, 5)):
+            Post.objects.all().delete()
+            self.create_posts(count, tags_per_post=tags, comments_per_post=tags)
+            with self.assertNumQueries(self.LIST_QUERIES):
+                self.client.get(reverse('blog:post_list'))
+            # the sidebar is cached now
+            with self.assertNumQueries(self.LIST_QUERIES - self.SIDEBAR_QUERIES):
+                self.client.get(reverse('blog:post_list'))
+
+    def test_post_list_by_tag_query_count_is_constant(self):
+        for count, tags in ((1, 1), (10, 5)):
+            Post.objects.all().delete()
+            self.create_posts(count, tags_per_post=tags, comments_per_post=0)
+            with self.assertNumQueries(self.LIST_QUERIES + 1):  # the tag itself
+                self.client.get(reverse('blog:post_list_by_tag', args=['tag-0']))
+
+    def test_post_detail_query_count_is_constant(self):
+        for count, comments in ((2, 1), (10, 20)):
+            Post.objects.all().delete()
+            post = self.create_posts(count, tags_per_post=3, comments_per_post=comments)[0]
+            with self.assertNumQueries(self.DETAIL_QUERIES):
+                response = self.client.get(post.get_absolute_url())
+            self.assertContains(response, f'{comments} comment')
+
+
+class PostDetailLookupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        for slug, publish in (('first', timezone.datetime(2020, 1, 1, 0, 0)),
+                              ('last', timezone.datetime(2020, 1, 1, 23, 59, 59, 999999)),
+                              ('first', timezone.datetime(2020, 1, 2, 0, 0))):
+            Post.objects.create(title=slug, slug=slug, author=author, body='body', status='published',
+                                publish=timezone.make_aware(publish))
+
+    def test_published_on_is_the_whole_day(self):
+        self.assertEqual(sorted(Post.published.published_on(2020, 1, 1).values_list('slug', flat=True)),
+                         ['first', 'last'])
+
+    def test_published_on_is_a_range_on_publish(self):
+        sql = str(Post.published.published_on(2020, 1, 1).query).lower()
+        self.assertNotIn('extract', sql)
+        self.assertIn('"blog_post"."publish" >=', sql)
+
+    def test_detail_finds_the_post_of_the_day(self):
+        response = self.client.get(reverse('blog:post_detail', args=[2020, 1, 2, 'first']))
+        self.assertEqual(response.context['post'].publish.day, 2)
+
+    def test_invalid_dates_are_not_found(self):
+        self.assertEqual(self.client.get(reverse('blog:post_detail', args=[2020, 2, 30, 'first'])).status_code, 404)
+
+
+class CursorPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        publish = timezone.now()
+        # pairs of posts with the same publish date, so that the id has to break ties
+        for i in range(7):
+            Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, body='body',
+                                status='published', publish=publish - timedelta(days=i // 2))
+        cls.expected = list(Post.published.order_by('-publish', '-id'))
+
+    def paginator(self):
+        return CursorPaginator(Post.published.all(), 3, ordering=('-publish', '-id'))
+
+    def test_next_pages_cover_all_posts_once(self):
+        paginator = self.paginator()
+        page = paginator.page()
+        self.assertFalse(page.has_previous())
+        seen = list(page)
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            seen.extend(page)
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_cursor_returns_previous_page(self):
+        paginator = self.paginator()
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(list(paginator.page(third.previous_cursor)), list(second))
+        back_to_first = paginator.page(second.previous_cursor)
+        self.assertEqual(list(back_to_first), list(first))
+        self.assertFalse(back_to_first.has_previous())
+        self.assertTrue(back_to_first.has_next())
+
+    def test_page_does_not_count(self):
+        paginator = self.paginator()
+        cursor = paginator.page().next_cursor
+        with self.assertNumQueries(1):
+            paginator.page(cursor)
+
+    def test_post_list_ignores_broken_cursor(self):
+        response = self.client.get(reverse('blog:post_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(list(response.context['posts']), self.expected[:3])
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        Post.objects.bulk_create(Post(title=f'Post {i}', slug=f'post-{i}', author=cls.author, body='body',
+                                      status='draft' if i % 2 else 'published') for i in range(10))
+
+    def paginator(self, queryset, threshold):
+        paginator = EstimatedCountPaginator(queryset, 2)
+        paginator.threshold = threshold
+        return paginator
+
+    def test_exact_count_below_threshold(self):
+        self.assertEqual(self.paginator(Post.objects.all(), 100).count, 10)
+        self.assertEqual(self.paginator(Post.published.all(), 100).count, 5)
+
+    @mock.patch('common.pagination.estimate_count', return_value=1000)
+    def test_estimate_above_threshold(self, estimate_count):
+        paginator = self.paginator(Post.objects.all(), 5)
+        self.assertEqual(paginator.count, 1000)
+        self.assertEqual(paginator.num_pages, 500)
+
+    @mock.patch('common.pagination.estimate_count', return_value=2)
+    def test_estimate_is_at_least_the_capped_count(self, estimate_count):
+        self.assertEqual(self.paginator(Post.objects.all(), 5).count, 6)
+
+    @mock.patch('common.pagination.estimate_count', return_value=None)
+    def test_exact_count_without_estimate(self, estimate_count):
+        self.assertEqual(self.paginator(Post.objects.all(), 5).count, 10)
+
+    def test_count_is_bounded(self):
+        paginator = self.paginator(Post.objects.all(), 5)
+        with CaptureQueriesContext(connection) as queries:
+            paginator.count
+        self.assertIn('LIMIT 6', queries[0]['sql'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'row counters are SQLite only')
+    def test_sqlite_row_counter_follows_inserts_and_deletes(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(SQLiteRowCounter.rows(cursor, 'blog_post'), 10)
+            Post.objects.filter(status='draft').delete()
+            self.assertEqual(SQLiteRowCounter.rows(cursor, 'blog_post'), 5)
+        # the counter is the estimate of the unfiltered table, filtered querysets are counted
+        self.assertEqual(self.paginator(Post.objects.all(), 2).count, 5)
+        with mock.patch('common.pagination.SQLiteRowCounter.rows', return_value=None):
+            self.assertEqual(self.paginator(Post.objects.all(), 2).count, 5)
+
+    @skipUnless(connection.vendor == 'sqlite', 'row counters are SQLite only')
+    def test_sqlite_row_counter_is_repaired(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER blog_post_count_insert')
+            self.assertTrue(SQLiteRowCounter.repair(cursor, 'blog_post'))
+            self.assertFalse(SQLiteRowCounter.repair(cursor, 'blog_post'))
+            Post.objects.create(title='Post', slug='post', author=self.author, body='body')
+            self.assertEqual(SQLiteRowCounter.rows(cursor, 'blog_post'), 11)
+
+    @skipUnless(connection.vendor == 'postgresql', 'estimates of the PostgreSQL planner')
+    def test_postgresql_estimates(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE blog_post')
+        self.assertEqual(estimate_count(Post.objects.all()), 10)
+        self.assertIsInstance(estimate_count(Post.published.filter(title__startswith='Post')), int)
+
+    def test_admin_changelist_filters_by_author(self):
+        other = User.objects.create_user('other')
+        Post.objects.create(title='Other', slug='other', author=other, body='body')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:blog_post_changelist')
+        response = self.client.get(url)
+        self.assertEqual(response.context['cl'].result_count, 11)
+        self.assertContains(response, 'name="author__id__exact"')
+        self.assertContains(response, 'admin/js/autocomplete.js')
+
+        response = self.client.get(url, {'author__id__exact': other.pk})
+        self.assertEqual([post.title for post in response.context['cl'].result_list], ['Other'])
+        # the selected author is the only option of the select, the others are searched by the autocomplete
+        self.assertContains(response, f'<option value="{other.pk}" selected>other</option>', html=True)
+        self.assertNotContains(response, f'<option value="{self.author.pk}"')
+
+    def test_admin_changelist_redirects_for_an_invalid_author(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:blog_post_changelist')
+        response = self.client.get(url, {'author__id__exact': 'abc'})
+        self.assertRedirects(response, f'{url}?e=1')
+
+
+class SidebarFragmentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='Post', slug='post', author=author, body='body', status='published')
+
+    def setUp(self):
+        cache.clear()
+
+    def render_sidebar(self):
+        return Template('{% load blog_tags %}{% total_posts %} {% get_most_commented_posts as posts %}'
+                        '{% for post in posts %}{{ post.title }} {% endfor %}').render(Context())
+
+    def test_fragments_are_cached_per_argument(self):
+        self.render_sidebar()
+        with self.assertNumQueries(0):
+            self.render_sidebar()
+        with self.assertNumQueries(1):
+            Template('{% load blog_tags %}{% get_most_commented_posts 2 as posts %}').render(Context())
+
+    def test_comment_save_and_delete_invalidate_fragments(self):
+        self.render_sidebar()
+        comment = Comment.objects.create(post=self.post, name='reader', email='reader@example.com', body='comment')
+        with self.assertNumQueries(2):
+            self.render_sidebar()
+        comment.delete()
+        with self.assertNumQueries(2):
+            self.render_sidebar()
+
+    def test_post_save_invalidates_fragments(self):
+        self.assertEqual(self.render_sidebar(), '1 Post ')
+        self.post.title = 'Renamed'
+        self.post.save()
+        self.assertEqual(self.render_sidebar(), '1 Renamed ')
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            # keep the lock until all other threads are waiting for the value
+            threading.Event().wait(0.2)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fragments.get_or_compute('answer', (), compute)))
+                   for _ in range(20)]
+        with mock.patch.object(fragments, 'WAIT_INTERVAL', 0.01):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [42] * 20)
+
+
+class CommentCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='Post', slug='post', author=author, body='body', status='published')
+
+    def create_comment(self, **kwargs):
+        return Comment.objects.create(post=self.post, name='reader', email='reader@example.com', body='comment',
+                                      **kwargs)
+
+    def assertCommentCount(self, expected):
+        self.post.refresh_from_db(fields=['comment_count'])
+        self.assertEqual(self.post.comment_count, expected)
+
+    def test_create_toggle_and_delete_update_count(self):
+        comment = self.create_comment()
+        self.create_comment(active=False)
+        self.assertCommentCount(1)
+        comment.active = False
+        comment.save()
+        self.assertCommentCount(0)
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.active = True
+        comment.save()
+        self.assertCommentCount(1)
+        comment.delete()
+        self.assertCommentCount(0)
+
+    def test_set_active_updates_count_of_changed_comments(self):
+        for active in (True, False, False):
+            self.create_comment(active=active)
+        self.assertEqual(Comment.objects.all().set_active(True), 2)
+        self.assertCommentCount(3)
+        Comment.objects.filter(pk__in=Comment.objects.all()[:2]).set_active(False)
+        self.assertCommentCount(1)
+
+    def test_queryset_delete_updates_count(self):
+        for _ in range(3):
+            self.create_comment()
+        Comment.objects.filter(pk__in=Comment.objects.all()[:2]).delete()
+        self.assertCommentCount(1)
+
+    def test_post_save_does_not_overwrite_count(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        self.create_comment()
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertCommentCount(1)
+
+    def test_reconcile_command_repairs_drift(self):
+        self.create_comment()
+        self.create_comment()
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+        out = StringIO()
+        call_command('reconcile_comment_counts', batch_size=1, stdout=out)
+        self.assertCommentCount(2)
+        self.assertIn('Repaired the comment count of 1 post(s).', out.getvalue())
+
+
+class SimilarPostTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def create_post(self, slug, tags, days_ago=0, status='published'):
+        post = Post.objects.create(title=slug, slug=slug, author=self.author, body='body', status=status,
+                                   publish=timezone.now() - timedelta(days=days_ago))
+        post.tags.add(*tags)
+        return post
+
+    def similar(self, post):
+        return [similar.similar.slug for similar in post.similar_posts.select_related('similar')]
+
+    def test_ranked_by_shared_tags_then_publish(self):
+        post = self.create_post('post', ['a', 'b', 'c'])
+        self.create_post('one-tag-old', ['a'], days_ago=3)
+        self.create_post('one-tag-new', ['b'], days_ago=1)
+        self.create_post('two-tags', ['a', 'b'], days_ago=2)
+        self.create_post('unrelated', ['z'])
+        self.create_post('draft', ['a', 'b', 'c'], status='draft')
+        self.assertEqual(self.similar(post), ['two-tags', 'one-tag-old', 'one-tag-new'])
+
+    def test_keeps_top_four(self):
+        post = self.create_post('post', ['a'])
+        for i in range(6):
+            self.create_post(f'other-{i}', ['a'], days_ago=i)
+        self.assertEqual(self.similar(post), ['other-5', 'other-4', 'other-3', 'other-2'])
+
+    def test_updates_when_tags_or_status_change(self):
+        post = self.create_post('post', ['a'])
+        other = self.create_post('other', ['b'])
+        self.assertEqual(self.similar(post), [])
+        other.tags.add('a')
+        self.assertEqual(self.similar(post), ['other'])
+        other.status = 'draft'
+        other.save()
+        self.assertEqual(self.similar(post), [])
+        other.status = 'published'
+        other.save()
+        other.tags.remove('a')
+        self.assertEqual(self.similar(post), [])
+        other.tags.add('a')
+        other.delete()
+        self.assertEqual(self.similar(post), [])
+
+    def test_rebuild_matches_incremental_updates(self):
+        posts = [self.create_post(f'post-{i}', [f't{i % 3}', f't{i % 4}'], days_ago=i) for i in range(12)]
+        posts[0].tags.add('t1', 't2')
+        posts[5].tags.remove('t1')
+        posts[7].tags.clear()
+        posts[3].status = 'draft'
+        posts[3].save()
+        posts[9].publish = timezone.now() - timedelta(days=30)
+        posts[9].save()
+        posts.pop(2).delete()
+        incremental = {post.pk: self.similar(post) for post in posts}
+        call_command('rebuild_similar_posts', stdout=StringIO())
+        self.assertEqual({post.pk: self.similar(post) for post in posts}, incremental)
+
+    def test_migration_fills_the_table(self):
+        posts = [self.create_post(f'post-{i}', [f't{i % 3}', f't{i % 4}'], days_ago=i) for i in range(8)]
+        expected = {post.pk: self.similar(post) for post in posts}
+        # the posts are tagged with generic taggings at that point of the history
+        content_type = ContentType.objects.get_for_model(Post)
+        TaggedItem.objects.bulk_create(TaggedItem(content_type=content_type, object_id=tagging.content_object_id,
+                                                  tag_id=tagging.tag_id) for tagging in TaggedPost.objects.all())
+        SimilarPost.objects.all().delete()
+        importlib.import_module('blog.migrations.0006_similarpost').build_similar_posts(apps, None)
+        self.assertEqual({post.pk: self.similar(post) for post in posts}, expected)
+
+    def create_tagged_posts(self, tag, count):
+        Post.objects.bulk_create(
+            Post(title=f'{tag}-{i}', slug=f'{tag}-{i}', author=self.author, body='body', status='published',
+                 publish=timezone.now() - timedelta(days=100 + i))
+            for i in range(count))
+        posts = Post.objects.filter(slug__startswith=f'{tag}-').order_by('-publish')
+        tag = Tag.objects.create(name=tag, slug=tag)
+        TaggedPost.objects.bulk_create(TaggedPost(tag=tag, content_object=post) for post in posts)
+        return list(posts)
+
+    def test_tag_changes_dont_recompute_the_posts_of_the_tag(self):
+        self.create_tagged_posts('small', 6)
+        self.create_tagged_posts('large', 300)
+        call_command('rebuild_similar_posts', stdout=StringIO())
+        post = self.create_post('post', [])
+        queries = {}
+        for tag in ('small', 'large'):
+            with CaptureQueriesContext(connection) as context, \
+                    mock.patch('blog.similarity._store', wraps=similarity._store) as store:
+                post.tags.add(tag)
+                post.tags.remove(tag)
+            queries[tag] = len(context)
+            # the newest post doesn't enter the full lists of the others, only its own list is written
+            self.assertEqual([args[0] for args, _ in store.call_args_list], [[post.pk], [post.pk]])
+        self.assertEqual(queries['large'], queries['small'])
+        self.assertEqual(self.similar(post), [])
+
+    @mock.patch('blog.similarity.REFILL_LIMIT', 2)
+    def test_lists_a_post_drops_out_of_are_refilled_up_to_the_limit(self):
+        posts = self.create_tagged_posts('large', 10)
+        call_command('rebuild_similar_posts', stdout=StringIO())
+        # the oldest post is similar to all the others, two of their lists are refilled, the others are one short
+        oldest = posts[-1]
+        oldest.tags.clear()
+        self.assertFalse(SimilarPost.objects.filter(similar=oldest).exists())
+        self.assertEqual(sorted(SimilarPost.objects.order_by().values('post_id').annotate(count=Count('id'))
+                                .values_list('count', flat=True)), [3] * 7 + [4] * 2)
+        call_command('rebuild_similar_posts', stdout=StringIO())
+        self.assertEqual(SimilarPost.objects.count(), 9 * 4)
+
+    def test_post_detail_lists_similar_posts(self):
+        post = self.create_post('post', ['a'])
+        self.create_post('other', ['a'])
+        response = self.client.get(post.get_absolute_url())
+        self.assertEqual([similar.slug for similar in response.context['similar_posts']], ['other'])
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'Only PostgreSQL and SQLite have a ranking search backend.')
+class PostSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.in_body = Post.objects.create(title='A post', slug='in-body', author=author, status='published',
+                                          body='This post mentions guitars in the body.')
+        cls.in_title = Post.objects.create(title='Guitars', slug='in-title', author=author, status='published',
+                                           body='Strings and frets.')
+        Post.objects.create(title='Guitars', slug='draft', author=author, body='draft', status='draft')
+
+    def search(self, query, **params):
+        return self.client.get(reverse('blog:post_search'), {'query': query, **params})
+
+    def test_title_matches_rank_first(self):
+        response = self.search('guitar')
+        self.assertEqual(list(response.context['results']), [self.in_title, self.in_body])
+        self.assertContains(response, '<mark>guitars</mark>')
+
+    def test_index_follows_body(self):
+        self.in_body.body = 'Only drums now.'
+        self.in_body.save()
+        self.assertEqual(list(self.search('guitar').context['results']), [self.in_title])
+        self.assertEqual(list(self.search('drums').context['results']), [self.in_body])
+
+    def test_deleted_posts_are_not_found(self):
+        self.in_title.delete()
+        self.assertEqual(list(self.search('guitar').context['results']), [self.in_body])
+
+    def test_results_are_paginated(self):
+        response = self.search('guitar', page=2)
+        self.assertEqual(response.context['results'].number, 1)  # out of range delivers the last page
+        self.assertEqual(response.context['results'].paginator.count, 2)
+
+    def test_html_in_the_body_is_escaped(self):
+        Post.objects.create(title='Markup', slug='markup', author=self.in_body.author, status='published',
+                            body='<img src=x onerror=alert(1)> Tuning <a href="#">guitars</a> by ear.')
+        response = self.search('tuning')
+        self.assertContains(response, '&lt;img src=x onerror=alert(1)&gt; <mark>Tuning</mark>')
+        self.assertNotContains(response, '<img src=x')
+
+    @override_settings(BLOG_SEARCH_BACKEND='blog.search.LikeSearchBackend')
+    def test_html_in_the_body_is_escaped_without_ranking(self):
+        Post.objects.create(title='Markup', slug='markup', author=self.in_body.author, status='published',
+                            body='<script>alert(1)</script> tuning')
+        response = self.search('tuning')
+        self.assertContains(response, '&lt;script&gt;alert(1)&lt;/script&gt; tuning')
+        self.assertNotContains(response, '<script>alert')
+
+    def test_highlight(self):
+        marked = f'{search.MARK_START}a{search.MARK_STOP} <b> {search.MARK_STOP}{search.MARK_START}c'
+        self.assertEqual(search.highlight(marked), '<mark>a</mark> &lt;b&gt; <mark>c</mark>')
+
+    def test_query_syntax_is_not_interpreted(self):
+        response = self.search('"guitar AND (frets')
+        self.assertEqual(response.status_code, 200)
+
+    def test_rebuild_search_index_command(self):
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 post(s)', out.getvalue())
+        self.assertEqual(len(self.search('frets').context['results']), 1)
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_stored_search_vector_is_filled(self):
+        Post.objects.update(search_vector=None)
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertFalse(Post.objects.filter(search_vector=None).exists())
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_fts_triggers_are_repaired_after_migrations(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER blog_post_fts_update')
+            Post.objects.filter(pk=self.in_title.pk).update(title='Drums')
+            self.assertTrue(search.SQLiteSearchBackend.repair(cursor))
+            self.assertFalse(search.SQLiteSearchBackend.repair(cursor))
+        self.assertEqual(list(self.search('drums').context['results']), [self.in_title])
+
+
+class SitemapTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.posts = [Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, body='body',
+                                         status='published' if i != 1 else 'draft') for i in range(5)]
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_index_lists_sections(self):
+        # ids don't start at 1 on every database
+        sections = -(-self.posts[-1].id // 2)
+        with mock.patch('blog.sitemaps.PostSitemap.limit', 2):
+            response = self.client.get(reverse('sitemap'))
+        content = self.content(response)
+        self.assertEqual(content.count('<sitemap>'), sections)
+        self.assertIn(f'<loc>http://example.com/sitemap-posts-{sections}.xml</loc>', content)
+
+    def test_section_lists_published_posts_of_its_range(self):
+        with mock.patch('blog.sitemaps.PostSitemap.limit', 1):
+            content = self.content(self.client.get(reverse('post_sitemap', args=[self.posts[0].id])))
+            draft = self.content(self.client.get(reverse('post_sitemap', args=[self.posts[1].id])))
+        self.assertEqual(content.count('<url>'), 1)
+        self.assertIn(f'<loc>http://example.com{self.posts[0].get_absolute_url()}</loc>', content)
+        self.assertEqual(draft.count('<url>'), 0)
+
+    def test_sections_past_the_index_are_not_found(self):
+        with mock.patch('blog.sitemaps.PostSitemap.limit', 1):
+            last = self.posts[-1].id
+            self.assertEqual(self.client.get(reverse('post_sitemap', args=[last])).status_code, 200)
+            self.assertEqual(self.client.get(reverse('post_sitemap', args=[last + 1])).status_code, 404)
+            self.assertEqual(self.client.get(reverse('post_sitemap', args=[0])).status_code, 404)
+
+    def test_section_query_count_does_not_depend_on_posts(self):
+        self.client.get(reverse('post_sitemap', args=[1]))  # caches the current site
+        with self.assertNumQueries(2):  # validators, posts
+            self.content(self.client.get(reverse('post_sitemap', args=[1])))
+
+    def test_unchanged_sitemaps_return_304(self):
+        for url in (reverse('sitemap'), reverse('post_sitemap', args=[1])):
+            response = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(
+                self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_deleting_a_post_changes_the_section_etag(self):
+        url = reverse('post_sitemap', args=[1])
+        etag = self.client.get(url)['ETag']
+        self.posts[2].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='Post', slug='post', author=author, body='body', status='published')
+        cls.comment = Comment.objects.create(post=cls.post, name='reader', email='reader@example.com',
+                                             body='comment', active=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertUnchanged(self, url, response):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_unchanged_pages_return_304_with_one_query(self):
+        self.post.tags.add('music')
+        for url in (reverse('blog:post_list'), reverse('blog:post_list_by_tag', args=['music']),
+                    self.post.get_absolute_url()):
+            self.assertUnchanged(url, self.client.get(url))
+
+    def test_approving_a_comment_changes_the_detail_validators(self):
+        url = self.post.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        Comment.objects.filter(pk=self.comment.pk).set_active(True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, '1 comment')
+
+    def test_approving_a_comment_by_saving_changes_the_detail_validators(self):
+        url = self.post.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        self.comment.active = True
+        self.comment.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_tag_changes_change_the_validators(self):
+        urls = (reverse('blog:post_list'), self.post.get_absolute_url())
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.post.tags.add('music')
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unknown_post_is_not_found(self):
+        url = reverse('blog:post_detail', args=[2000, 1, 1, 'missing'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionRefusedError('SMTP server is down')
+
+
+class OutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='Post', slug='post', author=author, body='body', status='published')
+
+    def queue(self, count):
+        for i in range(count):
+            outbox.enqueue(f'Mail {i}', 'body', 'admin@myblog.com', [f'reader{i}@example.com'])
+
+    def test_share_only_queues_the_email(self):
+        response = self.client.post(reverse('blog:post_share', args=[self.post.id]),
+                                    {'name': 'Reader', 'email': 'reader@example.com', 'to': 'friend@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mail.outbox, [])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.recipients, ['friend@example.com'])
+        self.assertIn(self.post.title, email.subject)
+
+    def test_drain_sends_batches_over_one_connection_each(self):
+        self.queue(5)
+        with mock.patch('blog.outbox.get_connection', wraps=outbox.get_connection) as get_connection:
+            self.assertEqual(outbox.drain(batch_size=2), (5, 0))
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f'reader{i}@example.com' for i in range(5)])
+        self.assertFalse(OutgoingEmail.objects.exclude(status='sent').exists())
+        # nothing is sent twice
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='blog.tests.FailingEmailBackend')
+    def test_failed_emails_are_retried_with_backoff(self):
+        self.queue(1)
+        self.assertEqual(outbox.drain(), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ('queued', 1))
+        self.assertIn('SMTP server is down', email.last_error)
+        delay = email.next_attempt - timezone.now()
+        self.assertGreater(delay, outbox.RETRY_DELAY - timedelta(seconds=5))
+        # not due before the delay is over
+        self.assertEqual(outbox.drain(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt=timezone.now())
+        outbox.drain()
+        email.refresh_from_db()
+        self.assertGreater(email.next_attempt - timezone.now(), 2 * outbox.RETRY_DELAY - timedelta(seconds=5))
+
+        OutgoingEmail.objects.update(next_attempt=timezone.now(), attempts=outbox.MAX_ATTEMPTS - 1)
+        outbox.drain()
+        self.assertEqual(OutgoingEmail.objects.get().status, 'failed')
+
+    def test_claimed_emails_are_skipped_until_the_lease_is_over(self):
+        self.queue(3)
+        claimed = outbox.claim_batch(batch_size=2)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual([email.subject for email in outbox.claim_batch()], ['Mail 2'])
+        self.assertEqual(outbox.claim_batch(), [])
+        OutgoingEmail.objects.filter(pk=claimed[0].pk).update(next_attempt=timezone.now())
+        self.assertEqual(outbox.claim_batch(), [claimed[0]])
+
+
+# the in-memory test database of SQLite locks tables between threads instead of waiting for each other
+@skipUnless(connection.vendor == 'postgresql', 'needs a database that allows concurrent connections')
+class OutboxWorkerTests(TransactionTestCase):
+
+    def test_concurrent_workers_send_every_email_once(self):
+        for i in range(40):
+            outbox.enqueue(f'Mail {i}', 'body', 'admin@myblog.com', [f'reader{i}@example.com'])
+        out = StringIO()
+        call_command('send_outbox', workers=4, batch_size=3, stdout=out)
+        self.assertIn('Sent 40 e-mail(s)', out.getvalue())
+        self.assertEqual(sorted(message.subject for message in mail.outbox), sorted(f'Mail {i}' for i in range(40)))
+
+
+class PageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='Post', slug='post', author=cls.author, body='body', status='published')
+        cls.other = Post.objects.create(title='Other', slug='other', author=cls.author, body='body',
+                                        status='published')
+        cls.post.tags.add('music')
+        cls.other.tags.add('travel')
+
+    def setUp(self):
+        cache.clear()
+        self.urls = {
+            'list': reverse('blog:post_list'),
+            'music': reverse('blog:post_list_by_tag', args=['music']),
+            'travel': reverse('blog:post_list_by_tag', args=['travel']),
+            'post': self.post.get_absolute_url(),
+            'other': self.other.get_absolute_url(),
+        }
+        for url in self.urls.values():
+            self.client.get(url)
+
+    def cached(self):
+        """
+        The names of the pages served from the cache, i.e. with nothing but the validators query.
+        """
+        cached = set()
+        for name, url in self.urls.items():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            if len(queries) == 1:
+                cached.add(name)
+        return cached
+
+    def test_pages_are_served_from_the_cache(self):
+        self.assertEqual(self.cached(), set(self.urls))
+
+    def test_query_string_is_part_of_the_key(self):
+        with self.assertNumQueries(1):
+            self.client.get(self.urls['list'])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.urls['list'], {'cursor': 'broken'})
+        self.assertGreater(len(queries), 1)
+
+    def test_post_save_invalidates_its_pages(self):
+        self.post.title = 'Renamed'
+        self.post.save()
+        self.assertEqual(self.cached(), {'travel', 'other'})
+        self.assertContains(self.client.get(self.urls['post']), 'Renamed')
+
+    def test_tag_change_invalidates_the_pages_of_the_post_and_its_tags(self):
+        self.urls['jazz'] = reverse('blog:post_list_by_tag', args=['jazz'])
+        self.post.tags.set(['jazz'])
+        self.assertEqual(self.cached(), {'travel', 'other'})
+
+    def test_similar_posts_changes_invalidate_the_detail_page(self):
+        # both posts become similar to each other
+        self.post.tags.add('travel')
+        self.assertEqual(self.cached(), set())
+
+    def test_save_while_the_detail_page_renders_is_not_cached(self):
+        saved = []
+
+        def save_after_reading_the_post(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not saved and '"blog_post"."body_html"' in sql:
+                saved.append(sql)
+                self.post.title = 'Renamed'
+                self.post.save()
+            return result
+
+        cache.delete(pagecache._page_key(RequestFactory().get(self.urls['post'])))
+        with connection.execute_wrapper(save_after_reading_the_post):
+            # renders the post as it was read
+            self.assertEqual(self.client.get(self.urls['post']).context['post'].title, 'Post')
+        self.assertTrue(saved)
+        self.assertContains(self.client.get(self.urls['post']), '<h1>Renamed</h1>')
+
+    def test_saving_a_similar_post_invalidates_the_detail_page(self):
+        self.other.tags.add('music')
+        self.client.get(self.urls['post'])
+        self.other.title = 'Renamed'
+        self.other.save()
+        link = f'<a href="{self.other.get_absolute_url()}">Renamed</a>'
+        self.assertContains(self.client.get(self.urls['post']), link)
+
+    def test_comment_save_invalidates_the_detail_page(self):
+        Comment.objects.create(post=self.post, name='reader', email='reader@example.com', body='comment')
+        self.assertEqual(self.cached(), set(self.urls) - {'post'})
+
+    def test_approving_comments_invalidates_the_detail_page(self):
+        Comment.objects.create(post=self.other, name='reader', email='reader@example.com', body='comment',
+                               active=False)
+        self.client.get(self.urls['other'])
+        Comment.objects.filter(post=self.other).set_active(True)
+        self.assertEqual(self.cached(), set(self.urls) - {'other'})
+
+    def test_logged_in_users_are_not_served_from_the_cache(self):
+        self.client.force_login(self.author)
+        self.assertEqual(self.cached(), set())
+
+    def test_cached_pages_carry_the_visitors_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(self.urls['post'])
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        self.assertIn('csrftoken', response.cookies)
+        response = client.post(self.urls['post'], {'csrfmiddlewaretoken': token, 'name': 'reader',
+                                                   'email': 'reader@example.com', 'body': 'comment'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.post.comments.count(), 1)
+
+
+class TagCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def create_post(self, slug, tags, status='published'):
+        post = Post.objects.create(title=slug, slug=slug, author=self.author, body='body', status=status)
+        post.tags.add(*tags)
+        return post
+
+    def counts(self):
+        return dict(TagCount.objects.filter(published_posts__gt=0).values_list('tag__name', 'published_posts'))
+
+    def test_counts_published_posts_per_tag(self):
+        self.create_post('one', ['music', 'travel'])
+        self.create_post('two', ['music'])
+        self.create_post('draft', ['music', 'jazz'], status='draft')
+        self.assertEqual(self.counts(), {'music': 2, 'travel': 1})
+
+    def test_counts_follow_taggings_status_and_deletes(self):
+        post = self.create_post('one', ['music', 'travel'])
+        post.tags.remove('travel')
+        self.assertEqual(self.counts(), {'music': 1})
+        post.tags.set(['jazz'])
+        self.assertEqual(self.counts(), {'jazz': 1})
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(self.counts(), {})
+        post.status = 'published'
+        post.save()
+        self.assertEqual(self.counts(), {'jazz': 1})
+        post.delete()
+        self.assertEqual(self.counts(), {})
+
+    def test_tag_page_lists_the_posts_of_the_tag(self):
+        self.create_post('one', ['music'])
+        self.create_post('two', ['travel'])
+        response = self.client.get(reverse('blog:post_list_by_tag', args=['music']))
+        self.assertEqual([post.slug for post in response.context['posts']], ['one'])
+
+    def test_tag_cloud(self):
+        cache.clear()
+        self.create_post('one', ['music', 'travel'])
+        self.create_post('two', ['music'])
+        html = Template('{% load blog_tags %}{% show_tag_cloud %}').render(Context())
+        self.assertInHTML(f'<a href="{reverse("blog:post_list_by_tag", args=["music"])}">music</a>', html)
+        self.assertLess(html.index('music'), html.index('travel'))
+
+    def test_migration_copies_generic_taggings(self):
+        post = self.create_post('one', [])
+        music = Tag.objects.create(name='music', slug='music')
+        TaggedItem.objects.create(content_type=ContentType.objects.get_for_model(Post), object_id=post.pk, tag=music)
+        migration = importlib.import_module('blog.migrations.0011_taggedpost')
+        TagCount.objects.all().delete()
+        migration.copy_taggings(apps, None)
+        self.assertEqual(list(post.tags.names()), ['music'])
+        # the original stays until the copy is in place
+        self.assertTrue(TaggedItem.objects.exists())
+        self.assertEqual(TagCount.objects.get(tag=music).published_posts, 1)
+        self.assertEqual(TaggedPost.objects.count(), 1)
+
+        # a tagging that wasn't copied isn't deleted
+        travel = Tag.objects.create(name='travel', slug='travel')
+        TaggedItem.objects.create(content_type=ContentType.objects.get_for_model(Post), object_id=post.pk, tag=travel)
+        importlib.import_module('blog.migrations.0014_delete_generic_post_taggings') \
+            .delete_generic_taggings(apps, None)
+        self.assertEqual(list(TaggedItem.objects.values_list('tag__name', flat=True)), ['travel'])
+
+
+class ImportExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def record(self, slug, publish='2020-01-01T10:00:00+00:00', **kwargs):
+        return {'title': slug.title(), 'slug': slug, 'author': 'author', 'body': f'*{slug}*', 'publish': publish,
+                'status': 'published', 'tags': ['music'], **kwargs}
+
+    def import_records(self, records, **options):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('import_posts', file.name, stdout=out, **options)
+        return out.getvalue()
+
+    def export(self, **options):
+        out = StringIO()
+        call_command('export_posts', stdout=out, stderr=StringIO(), **options)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_import_creates_rendered_and_tagged_posts(self):
+        output = self.import_records([self.record('one'), self.record('two', tags=['music', 'jazz'])],
+                                     batch_size=1)
+        self.assertIn('Imported 2 post(s)', output)
+        post = Post.objects.get(slug='two')
+        self.assertEqual(post.body_html, '<p><em>two</em></p>')
+        self.assertEqual(sorted(post.tags.names()), ['jazz', 'music'])
+        self.assertEqual(TagCount.objects.get(tag__name='music').published_posts, 2)
+        self.assertEqual(SimilarPost.objects.get(post=post).similar.slug, 'one')
+        self.assertEqual(list(search.search_posts('two')), [post])
+
+    def test_import_skips_slugs_taken_on_the_same_date(self):
+        Post.objects.create(title='One', slug='one', author=self.author, body='body',
+                            publish=timezone.make_aware(timezone.datetime(2020, 1, 1, 8)))
+        output = self.import_records([
+            self.record('one'),
+            self.record('two'),
+            self.record('two', publish='2020-01-01T20:00:00+00:00'),
+            self.record('two', publish='2020-01-02T10:00:00+00:00'),
+        ])
+        self.assertIn('Imported 2 post(s), skipped 2', output)
+        self.assertEqual(Post.objects.filter(slug='two').count(), 2)
+        # importing again changes nothing
+        self.assertIn('Imported 0 post(s)', self.import_records([self.record('two')]))
+
+    def test_unknown_authors(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown author(s): stranger'):
+            self.import_records([self.record('one', author='stranger')])
+        self.import_records([self.record('one', author='stranger')], create_authors=True)
+        self.assertEqual(Post.objects.get().author.username, 'stranger')
+
+    def test_invalid_lines_are_reported_with_their_number(self):
+        with self.assertRaisesMessage(CommandError, 'Line 2'):
+            self.import_records([self.record('one'), {'title': 'no slug'}])
+
+    def test_invalid_status_and_tags_are_reported(self):
+        with self.assertRaisesMessage(CommandError, "Line 1: invalid status 'archived'"):
+            self.import_records([self.record('one', status='archived')])
+        with self.assertRaisesMessage(CommandError, "Line 1: tags must be a list of names, not 'django'"):
+            self.import_records([self.record('one', tags='django')])
+        self.assertFalse(Post.objects.exists())
+
+    def test_import_updates_the_similar_posts_of_existing_posts(self):
+        old = Post.objects.create(title='Old', slug='old', author=self.author, body='body', status='published',
+                                  publish=timezone.now())
+        old.tags.add('music')
+        self.import_records([self.record(f'post-{i}', publish=f'2020-01-0{i + 1}T10:00:00+00:00',
+                                         tags=['music', f'tag-{i % 2}']) for i in range(6)], batch_size=2)
+        incremental = list(SimilarPost.objects.values_list('post_id', 'similar_id', 'shared_tags', 'rank'))
+        self.assertEqual(len(SimilarPost.objects.filter(post=old)), 4)
+        call_command('rebuild_similar_posts', stdout=StringIO())
+        self.assertEqual(list(SimilarPost.objects.values_list('post_id', 'similar_id', 'shared_tags', 'rank')),
+                         incremental)
+
+    def test_batches_take_a_constant_number_of_queries(self):
+        def queries(count):
+            Post.objects.all().delete()
+            records = [self.record(f'post-{i}', tags=[f'tag-{i}', 'music']) for i in range(count)]
+            with CaptureQueriesContext(connection) as context:
+                self.import_records(records, batch_size=count)
+            return len(context)
+        self.assertEqual(queries(2), queries(20))
+
+    def test_export_round_trip(self):
+        self.import_records([self.record('one'), self.record('two', tags=['music', 'jazz'], status='draft')])
+        exported = self.export()
+        self.assertEqual(exported, [self.record('one'), self.record('two', tags=['jazz', 'music'], status='draft')])
+        self.assertEqual(self.export(status='draft', chunk_size=1), exported[1:])
+
+        Post.objects.all().delete()
+        self.import_records(exported)
+        self.assertEqual(self.export(), exported)
+
+
+class EndpointBenchmarkTests(TestCase):
+
+    def benchmark(self, *args):
+        out = StringIO()
+        call_command('benchmark_endpoints', '--posts=12', '--comments=1', '--tags=4', '--questions=2',
+                     '--requests=3', '--warmup=1', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_reports_every_endpoint_and_rolls_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            out = self.benchmark('--json', path)
+            with open(path) as file:
+                results = json.load(file)['endpoints']
+
+            self.assertEqual(list(results), ['post_list', 'post_detail', 'post_search', 'sitemap.xml',
+                                             'poll_vote', 'poll_results'])
+            for name, result in results.items():
+                self.assertIn(name, out)
+                self.assertEqual(result['requests'], 3)
+                self.assertLessEqual(result['p50'], result['p95'])
+                self.assertLessEqual(result['p95'], result['p99'])
+                self.assertGreater(result['throughput'], 0)
+                self.assertGreater(result['queries'], 0)
+            self.assertFalse(Post.objects.exists())
+            self.assertFalse(User.objects.exists())
+
+            self.assertIn('No regressions', self.benchmark('--endpoint=sitemap.xml', '--baseline', path,
+                                                           '--tolerance=100000'))
+            # a baseline with fewer queries
+            results['sitemap.xml']['queries'] = 0
+            with open(path, 'w') as file:
+                json.dump({'endpoints': results}, file)
+            with self.assertRaisesMessage(CommandError, '1 regression(s)'):
+                self.benchmark('--endpoint=sitemap.xml', '--baseline', path, '--tolerance=100000')
+
+    def test_unknown_endpoint(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown endpoint(s): nope'):
+            self.benchmark('--endpoint=nope')
+
+
+BOOKMARKS_COMMON = os.path.join(os.path.dirname(settings.BASE_DIR), 'bookmarks', 'common')
+
+
+@skipUnless(os.path.isdir(BOOKMARKS_COMMON), 'needs the bookmarks project next to mysite')
+class SharedCodeTests(SimpleTestCase):
+    """
+    mysite and bookmarks have no shared package, the modules of common/ that both use are copies. These tests fail
+    when a change went into one copy only.
+    """
+
+    @staticmethod
+    def definitions(path, names=None):
+        with open(path, encoding='utf-8') as file:
+            tree = ast.parse(file.read())
+        return {node.name: ast.dump(node) for node in tree.body
+                if isinstance(node, (ast.ClassDef, ast.FunctionDef)) and (names is None or node.name in names)}
+
+    def assertSameDefinitions(self, module, names=None):
+        mysite = self.definitions(os.path.join(settings.BASE_DIR, 'common', module), names)
+        bookmarks = self.definitions(os.path.join(BOOKMARKS_COMMON, module), names)
+        self.assertTrue(mysite)
+        for name in mysite.keys() | bookmarks.keys():
+            self.assertEqual(mysite.get(name), bookmarks.get(name), f'{module}: {name} differs between the copies')
+
+    def test_cursor_pagination_is_the_same(self):
+        self.assertSameDefinitions('pagination.py', {'InvalidCursor', 'CursorPage', 'CursorPaginator'})
+
+    def test_benchmark_helpers_are_the_same(self):
+        self.assertSameDefinitions('benchmark.py')
@@ -1,13 +1,14 @@
-from django.contrib.postgres.search import SearchVector
-from django.core.mail import send_mail
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.db.models import Count
+from django.db.models import Max, Q
 from django.shortcuts import render, get_object_or_404
+from django.views.decorators.http import condition
 from django.views.generic import ListView
 from taggit.models import Tag
 
+from common.pagination import CursorPaginator, EstimatedCountPaginator, InvalidCursor
+from . import fragments, outbox, pagecache
 from .forms import EmailPostForm, CommentForm, SearchForm
 from .models import Post
+from .search import search_posts
 
 
 #class PostListView(ListView):
@@ -20,35 +21,93 @@ from .models import Post
 #    template_name = 'blog/post/list.html'
 
 
+# Conditional GET: the validators of the list and detail pages are computed with one small query before the view runs,
+# so a client that has the current page gets a 304 without any rendering. Tag changes touch Post.updated (see
+# signals.py) and the sidebar shown on every page is covered by the version of its fragments (see fragments.py).
+
+def _timestamp(updated):
+    return updated.timestamp() if updated else 0
+
+
+def _list_state(request):
+    # computed once per request for the ETag and the Last-Modified header
+    if not hasattr(request, '_post_list_state'):
+        # MAX(updated) of the published posts, read from the (status, updated) index
+        updated = Post.published.aggregate(updated=Max('updated'))['updated']
+        request._post_list_state = updated, fragments.current_version()
+    return request._post_list_state
+
+
+def _list_etag(request, tag_slug=None):
+    updated, version = _list_state(request)
+    return f'{_timestamp(updated)}-{version}'
+
+
+def _list_last_modified(request, tag_slug=None):
+    updated, version = _list_state(request)
+    return max(filter(None, [updated, fragments.last_changed(version)]))
+
+
+def _detail_state(request, year, month, day, post):
+    if not hasattr(request, '_post_detail_state'):
+        state = Post.published.published_on(year, month, day).filter(slug=post) \
+            .aggregate(id=Max('id'), updated=Max('updated'), comment_count=Max('comment_count'),
+                       last_comment=Max('comments__updated', filter=Q(comments__active=True)))
+        request._post_detail_state = state, fragments.current_version()
+    return request._post_detail_state
+
+
+def _detail_etag(request, *args, **kwargs):
+    state, version = _detail_state(request, *args, **kwargs)
+    if state['updated'] is None:
+        return None  # no such post, the view answers with 404
+    # the count changes when an active comment is deleted, the latest comment might not
+    return f'{_timestamp(state["updated"])}-{_timestamp(state["last_comment"])}-{state["comment_count"]}-{version}'
+
+
+def _detail_last_modified(request, *args, **kwargs):
+    state, version = _detail_state(request, *args, **kwargs)
+    if state['updated'] is None:
+        return None
+    return max(filter(None, [state['updated'], state['last_comment'], fragments.last_changed(version)]))
+
+
+@condition(etag_func=_list_etag, last_modified_func=_list_last_modified)
+@pagecache.cache_page
 def post_list(request, tag_slug=None):
-    object_list = Post.published.all()
+    object_list = Post.published.for_list()
     tag = None
     if tag_slug:
         tag = get_object_or_404(Tag, slug=tag_slug)
-        object_list = object_list.filter(tags__in=[tag])
+        # joins blog_taggedpost through its (tag, post) index
+        object_list = object_list.filter(tags=tag)
+        pagecache.depends_on(request, f'tag:{tag.id}')
+    else:
+        pagecache.depends_on(request, 'posts')
 
-    paginator = Paginator(object_list, 3)  # 3 posts in each page
-    page = request.GET.get('page')
+    # keyset pagination: no COUNT(*) and no OFFSET, page N is as cheap as page 1
+    paginator = CursorPaginator(object_list, 3, ordering=('-publish', '-id'))  # 3 posts in each page
+    page = request.GET.get('cursor')
     try:
         posts = paginator.page(page)
-    except PageNotAnInteger:
-        # If page is not an integer deliver the first page
-        posts = paginator.page(1)
-    except EmptyPage:
-        # If page is out of range deliver last page of results
-        posts = paginator.page(paginator.num_pages)
+    except InvalidCursor:
+        # If the cursor is broken deliver the first page
+        posts = paginator.page()
     return render(request, 'blog/post/list.html', {'page': page, 'posts': posts, 'tag': tag})
 
 
+@condition(etag_func=_detail_etag, last_modified_func=_detail_last_modified)
+@pagecache.cache_page
 def post_detail(request, year, month, day, post):
     """
     Note that when you created the Post model, you added the unique_for_date parameter to the slug field
     """
-    post = get_object_or_404(Post, slug=post, status='published', publish__year=year, publish__month=month,
-                             publish__day=day)
+    # the page depends on the post before it is read, the validators already looked up its id
+    post_id = _detail_state(request, year, month, day, post)[0]['id']
+    if post_id is not None:
+        pagecache.depends_on(request, f'post:{post_id}')
+    post = get_object_or_404(Post.published.for_detail().published_on(year, month, day), slug=post)
 
-    # List of active comments for this post
-    comments = post.comments.filter(active=True)
     new_comment = None
     if request.method == 'POST':
         # a comment was posted
@@ -66,12 +125,14 @@ def post_detail(request, year, month, day, post):
         # in case of GET -> only view the comment form
         comment_form = CommentForm()
 
-    # Create list of similar posts
-    # flat=True creates a response of [1,2,..] instead of [(1,), (2,),...]
-    post_tags_ids = post.tags.values_list("id", flat=True)
-    similar_posts = Post.published.filter(tags__in=post_tags_ids).exclude(id=post.id)
-    # first order by same_tags count. then order by published date
-    similar_posts = similar_posts.annotate(same_tags=Count("tags")).order_by("-same_tags", "publish")[:4]
+    # List of active comments for this post. Fetched after a new comment was saved, so that it is included.
+    # The template only works on the evaluated list: comments.count would cost another query.
+    comments = list(post.comments.filter(active=True))
+
+    # List of similar posts: posts with the most shared tags first, then by published date.
+    # They are precomputed whenever tags or posts change (see similarity.py), saving a similar post invalidates
+    # this page too (see signals.py)
+    similar_posts = [similar.similar for similar in post.similar_posts.select_related('similar')]
 
     return render(request, 'blog/post/detail.html', {'post': post,
                                                      'comments': comments,  # to display all comments
@@ -95,7 +156,8 @@ def post_share(request, post_id):
             subject = f"{cd['name']} recommends you read {post.title}"
             message = f"Read {post.title} at {post_url}\n\n" \
                       f"{cd['name']}\'s comments: {cd['comments']}"
-            send_mail(subject, message, 'admin@myblog.com', [cd['to']])
+            # only queued, `python manage.py send_outbox` sends it (see outbox.py)
+            outbox.enqueue(subject, message, 'admin@myblog.com', [cd['to']])
             sent = True
 
     else:
@@ -115,8 +177,10 @@ def post_search(request):
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
-            results = Post.published.annotate(
-                search=SearchVector('title', 'body')).filter(search=query)
+            # ranked by relevance, so the keyset paginator of post_list doesn't fit here. Common words match most
+            # posts, the count is estimated above EstimatedCountPaginator.threshold
+            paginator = EstimatedCountPaginator(search_posts(query), 10)
+            results = paginator.get_page(request.GET.get('page'))
     return render(request, 'blog/post/search.html', {'form': form,
                                                      'query': query,
                                                      'results': results})
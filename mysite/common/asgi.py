@@ -0,0 +1,100 @@
+"""
+ASGI handler for responses that wait for events.
+
+Django 3.2 iterates streaming responses synchronously, even under ASGI, so a response waiting for the next event
+would block the event loop of the server and with it every other connection. EventStreamResponse instead streams a
+Server-Sent Events stream from an async iterator, which ASGIHandler consumes on the event loop; the iterator is
+cancelled when the client disconnects. mysite/asgi.py serves the project with this handler.
+
+Under WSGI a response can't wait without blocking a worker thread: there an EventStreamResponse only sends the
+events of its snapshot, and the browser's EventSource reconnects after `retry` milliseconds, i.e. it polls.
+"""
+import asyncio
+import contextvars
+
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+from django.http import StreamingHttpResponse
+
+# the receive channel of the current request, to notice the client disconnecting while streaming
+_receive = contextvars.ContextVar('receive')
+
+
+def event(data, event_type=None):
+    """
+    Formats one Server-Sent Event. `data` may span several lines.
+    """
+    lines = [f'event: {event_type}'] if event_type else []
+    lines.extend(f'data: {line}' for line in data.splitlines() or [''])
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """
+    A text/event-stream response. `events` is an async iterator of encoded events (see event()), streamed by
+    ASGIHandler; `snapshot` is a callable returning the encoded events that are sent instead under WSGI.
+    """
+    is_async = True
+
+    def __init__(self, events, snapshot, retry=3000, **kwargs):
+        super().__init__((), content_type='text/event-stream', **kwargs)
+        self.events = events
+        self.snapshot = snapshot
+        self.retry = retry
+        self['Cache-Control'] = 'no-cache'
+        # don't let nginx buffer the events
+        self['X-Accel-Buffering'] = 'no'
+        self._iterator = self._fallback()
+
+    def _fallback(self):
+        yield f'retry: {self.retry}\n\n'.encode()
+        yield from self.snapshot()
+
+    async def stream(self):
+        yield f'retry: {self.retry}\n\n'.encode()
+        async for chunk in self.events:
+            yield chunk
+
+
+class ASGIHandler(asgi.ASGIHandler):
+
+    async def __call__(self, scope, receive, send):
+        _receive.set(receive)
+        await super().__call__(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not getattr(response, 'is_async', False):
+            return await super().send_response(response, send)
+
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers.extend((b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                       for cookie in response.cookies.values())
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        async def stream():
+            async for chunk in response.stream():
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+
+        async def disconnect():
+            # the request body has been read already, the next message is the disconnect
+            receive = _receive.get()
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(disconnect())]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                task.result()
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
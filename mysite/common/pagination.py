@@ -0,0 +1,244 @@
+"""
+Paginators for large tables.
+
+django.core.paginator.Paginator needs a COUNT(*) for every page and fetches page N with OFFSET, which means the
+database has to walk over all rows before the page. CursorPaginator instead remembers the ordering values of the
+last row of a page and continues with `WHERE (publish, id) < (last_publish, last_id)`, which is an index seek no
+matter how deep the reader is. The price: there is no "page X of Y", only previous and next.
+
+Where page numbers are needed (the admin), EstimatedCountPaginator keeps the COUNT(*) bounded: it counts exactly up
+to a threshold and uses the row estimate of the database above it.
+
+mysite and bookmarks are separate projects without a shared package, so both have a copy of this module. The
+keyset pagination part (InvalidCursor, CursorPage, CursorPaginator) has to be the same in both; mysite's
+blog.tests.SharedCodeTests fails if it isn't, so a fix goes into both copies. The rest is mysite's own.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginates a queryset by the given ordering, e.g. ('-publish', '-id'). The last field has to be unique, so that
+    every row has a distinct position.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+    def page(self, cursor=None):
+        """
+        Returns the page after (or, for a cursor from previous_cursor, before) the given cursor.
+        Without a cursor the first page is returned. Raises InvalidCursor if the cursor can't be decoded.
+        """
+        if not cursor:
+            return self._page(self.queryset.order_by(*self.ordering), reverse=False, first=True)
+
+        values, reverse = self.decode_cursor(cursor)
+        ordering = [self._flip(name) for name in self.ordering] if reverse else self.ordering
+        queryset = self.queryset.filter(self._after(values, ordering)).order_by(*ordering)
+        return self._page(queryset, reverse=reverse, first=False)
+
+    def _page(self, queryset, reverse, first):
+        # fetch one object more than needed to find out if there is another page, instead of counting
+        objects = list(queryset[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if reverse:
+            objects.reverse()
+
+        next_cursor = previous_cursor = None
+        if objects:
+            if has_more or reverse:
+                next_cursor = self.encode_cursor(objects[-1], reverse=False)
+            if (has_more and reverse) or (not reverse and not first):
+                previous_cursor = self.encode_cursor(objects[0], reverse=True)
+        return CursorPage(objects, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    def _after(self, values, ordering):
+        """
+        Builds the keyset condition (a < x) OR (a = x AND b < y) OR ... for the given ordering.
+        """
+        condition = Q()
+        for i, name in enumerate(ordering):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            filters = {field.name: value for field, value in zip(self.fields[:i], values[:i])}
+            filters[f'{self.fields[i].name}__{lookup}'] = values[i]
+            condition |= Q(**filters)
+        return condition
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    def encode_cursor(self, obj, reverse):
+        values = [field.value_to_string(obj) for field in self.fields]
+        data = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(data)
+            if len(data['v']) != len(self.fields):
+                raise ValueError('Cursor does not match the ordering.')
+            values = [field.to_python(value) for field, value in zip(self.fields, data['v'])]
+            return values, bool(data['r'])
+        except (ValueError, TypeError, KeyError, ValidationError) as e:
+            raise InvalidCursor(str(e)) from e
+
+
+class SQLiteRowCounter:
+    """
+    SQLite has no row estimates, so the number of rows of a table is maintained by triggers in the row_counts table.
+    Like all triggers of a table, they are dropped when a migration has to remake the table, call repair() after
+    migrating.
+    """
+    table = 'row_counts'
+
+    @classmethod
+    def _triggers(cls, table):
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table} BEGIN "
+            f"UPDATE {cls.table} SET row_count = row_count + 1 WHERE name = '{table}'; END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table} BEGIN "
+            f"UPDATE {cls.table} SET row_count = row_count - 1 WHERE name = '{table}'; END",
+        ]
+
+    @classmethod
+    def _installed(cls, cursor, table):
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s)",
+                       [f'{table}_count_insert', f'{table}_count_delete'])
+        return cursor.fetchone()[0] == 2
+
+    @classmethod
+    def install(cls, cursor, table):
+        """
+        Creates the triggers of the table and counts its rows.
+        """
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {cls.table} (name TEXT PRIMARY KEY, row_count INTEGER NOT NULL)')
+        for sql in cls._triggers(table):
+            cursor.execute(sql)
+        cursor.execute(f'INSERT OR REPLACE INTO {cls.table} (name, row_count) SELECT %s, count(*) FROM {table}',
+                       [table])
+
+    @classmethod
+    def repair(cls, cursor, table):
+        """
+        Reinstalls the triggers of a counted table if they are missing. Returns True if they were.
+        """
+        if cls.rows(cursor, table) is None or cls._installed(cursor, table):
+            return False
+        cls.install(cursor, table)
+        return True
+
+    @classmethod
+    def uninstall(cls, cursor, table):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {table}_count_insert')
+        cursor.execute(f'DROP TRIGGER IF EXISTS {table}_count_delete')
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", [cls.table])
+        if cursor.fetchone():
+            cursor.execute(f'DELETE FROM {cls.table} WHERE name = %s', [table])
+
+    @classmethod
+    def rows(cls, cursor, table):
+        """
+        The number of rows of the table, None if it isn't counted.
+        """
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", [cls.table])
+        if not cursor.fetchone():
+            return None
+        cursor.execute(f'SELECT row_count FROM {cls.table} WHERE name = %s', [table])
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def estimate_count(queryset):
+    """
+    Returns the number of rows of the queryset as estimated by the database, or None if there is no estimate.
+
+    PostgreSQL: reltuples of the table for an unfiltered queryset, the row estimate of the plan otherwise.
+    SQLite: the row counter of the table (see SQLiteRowCounter), for unfiltered querysets only.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    filtered = bool(queryset.query.where)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            if not filtered:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+                row = cursor.fetchone()
+                # -1 (or 0 before PostgreSQL 14) if the table was never analyzed
+                if row and row[0] > 0:
+                    return int(row[0])
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        if connection.vendor == 'sqlite' and not filtered:
+            return SQLiteRowCounter.rows(cursor, table)
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts at most `threshold` + 1 rows. Above the threshold, count is the estimate of the database, so the number
+    of pages is approximate and the last pages might be empty. Falls back to the exact count if there is no estimate.
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        capped = self.object_list.order_by()[:self.threshold + 1].count()
+        if capped <= self.threshold:
+            return capped
+        estimate = estimate_count(self.object_list)
+        if estimate is None:
+            return super().count
+        return max(estimate, capped)
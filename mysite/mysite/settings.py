@@ -139,3 +139,32 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Blog
+# Render the markdown of posts that have no stored body_html yet on every request. Off by default, run
+# `python manage.py render_posts` instead; only switch it on for the time until that has been run.
+BLOG_MARKDOWN_FALLBACK = False
+# Seconds the sidebar fragments stay cached. They are invalidated whenever a post or comment is saved or deleted.
+# With more than one server process, CACHES has to point to a shared cache (e.g. memcached) for the invalidation
+# to reach all of them.
+BLOG_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# Seconds anonymous visitors are served the cached list and detail pages, 0 turns the page cache off. Pages are
+# invalidated when their posts, tags or comments change; the sidebar on cached pages is at most this old.
+BLOG_PAGE_CACHE_TIMEOUT = 10 * 60
+
+# Pages
+# The pages app serves its pages rendered and compressed once (gzip, and brotli if installed), with strong ETags and
+# browser caching for PAGES_MAX_AGE seconds. `python manage.py prerender_pages` renders them into
+# PAGES_PRERENDER_DIR on deploy; without it, every process renders them on their first request.
+PAGES_PRERENDER = True
+PAGES_PRERENDER_DIR = None
+PAGES_MAX_AGE = 24 * 60 * 60
+
+# Polls
+# Rows the votes of a choice are spread over, so that concurrent votes don't queue for one row lock. Results sum
+# the shards, `python manage.py compact_votes` moves them into Choice.votes from time to time.
+POLLS_VOTE_SHARDS = 16
+# Milliseconds between two updates of the live results. The votes of a question are aggregated once per update,
+# no matter how many people watch it. Live results need the ASGI server (mysite/asgi.py); under WSGI the results
+# page polls instead.
+POLLS_LIVE_TICK = 500
@@ -14,19 +14,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
 from django.urls import include, path
 
-from blog.sitemaps import PostSitemap
-
-sitemaps = {
-    'posts': PostSitemap,
-}
+from blog.sitemaps import sitemap_index, sitemap_section
 
 urlpatterns = [
     path('polls/', include('polls.urls')),
     path('', include('pages.urls')),
     path('admin/', admin.site.urls),
     path('blog/', include('blog.urls', namespace='blog')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    # the sitemap is an index of sections, each listing a fixed range of posts
+    path('sitemap.xml', sitemap_index, name='sitemap'),
+    path('sitemap-posts-<int:section>.xml', sitemap_section, name='post_sitemap'),
 ]
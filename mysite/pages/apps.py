@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PagesConfig(AppConfig):
     name = 'pages'
+
+    def ready(self):
+        if settings.DEBUG:
+            from django.utils.autoreload import file_changed
+            from .prerender import template_changed
+            file_changed.connect(template_changed)
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# importing the views registers the templates of the pre-rendered pages
+from pages import prerender, views  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = 'Renders and compresses the pre-rendered pages into PAGES_PRERENDER_DIR (or the given directory), ' \
+           'to be run on deploy. Server processes load them from there instead of rendering them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?')
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or getattr(settings, 'PAGES_PRERENDER_DIR', None)
+        if not directory:
+            raise CommandError('Pass a directory or set PAGES_PRERENDER_DIR.')
+        for template_name in prerender.prerender(directory):
+            self.stdout.write(f'Rendered {template_name}')
+        self.stdout.write(self.style.SUCCESS(f'Pre-rendered the pages into {directory}.'))
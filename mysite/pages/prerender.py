@@ -0,0 +1,168 @@
+"""
+Pre-rendered, pre-compressed pages.
+
+The pages of this app don't depend on the request, so their templates are rendered once per process (or on deploy
+with `python manage.py prerender_pages`) and compressed once with gzip and, if the brotli package is installed,
+brotli. A request is answered with the smallest variant its Accept-Encoding allows, a strong ETag per variant and a
+long Cache-Control lifetime; a conditional request with a current ETag gets a 304.
+
+Settings:
+- PAGES_PRERENDER: serve the pages pre-rendered (default True). Otherwise every request renders the template.
+- PAGES_PRERENDER_DIR: directory prerender_pages writes the rendered variants to. Processes load the pages from
+  there instead of rendering them, except in DEBUG.
+- PAGES_MAX_AGE: seconds browsers and proxies may use a page without asking again (default one day).
+
+In DEBUG the pages are always rendered from the templates, and again when a file in the template directories
+changed: every request compares their modification times, so this works with any server, also without runserver's
+autoreloader (which additionally clears the pages when it sees a template change).
+"""
+import gzip
+import hashlib
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.template.autoreload import get_template_directories
+from django.template.loader import render_to_string
+from django.utils.http import parse_etags
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the templates of the decorated views
+TEMPLATES = []
+
+# the encodings of the variants, preferred first
+ENCODINGS = ('br', 'gzip', 'identity')
+SUFFIXES = {'br': '.br', 'gzip': '.gz', 'identity': ''}
+
+_pages = {}
+
+
+class Page:
+    def __init__(self, variants):
+        self.variants = variants
+        # the templates_mtime() the page was rendered at, in DEBUG
+        self.mtime = None
+        # the ETag of a variant has to differ from the others, they are different bytes
+        digest = hashlib.sha256(variants['identity']).hexdigest()[:32]
+        self.etags = {encoding: f'"{digest}-{encoding}"' for encoding in variants}
+
+    @classmethod
+    def render(cls, template_name):
+        content = render_to_string(template_name).encode()
+        # mtime=0 makes the gzip variant, and with it the ETag, the same in every process
+        variants = {'identity': content, 'gzip': gzip.compress(content, 9, mtime=0)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(content)
+        return cls(variants)
+
+    @classmethod
+    def load(cls, directory, template_name):
+        variants = {}
+        for encoding, suffix in SUFFIXES.items():
+            path = Path(directory, template_name + suffix)
+            if path.exists():
+                variants[encoding] = path.read_bytes()
+        return cls(variants) if 'identity' in variants else None
+
+    def save(self, directory, template_name):
+        for encoding, content in self.variants.items():
+            path = Path(directory, template_name + SUFFIXES[encoding])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+
+    def encoding(self, accept_encoding):
+        """
+        The encoding of the variant to send for the Accept-Encoding header.
+        """
+        accepted = {}
+        for coding in accept_encoding.split(','):
+            name, _, params = coding.strip().partition(';')
+            try:
+                quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1
+            except ValueError:
+                quality = 0
+            accepted[name.strip().lower()] = quality
+        for encoding in ENCODINGS:
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+
+def templates_mtime():
+    """
+    The latest modification time of the files in the template directories of the project's apps and TEMPLATES DIRS,
+    which include the templates a page extends or includes.
+    """
+    return max((path.stat().st_mtime_ns for directory in get_template_directories()
+                for path in Path(directory).rglob('*') if path.is_file()), default=0)
+
+
+def get_page(template_name):
+    page = _pages.get(template_name)
+    # read before rendering, so that a change while rendering renders again
+    mtime = templates_mtime() if settings.DEBUG else None
+    if page is not None and page.mtime != mtime:
+        page = None
+    if page is None:
+        directory = getattr(settings, 'PAGES_PRERENDER_DIR', None)
+        if directory and not settings.DEBUG:
+            page = Page.load(directory, template_name)
+        if page is None:
+            page = Page.render(template_name)
+        page.mtime = mtime
+        _pages[template_name] = page
+    return page
+
+
+def clear():
+    _pages.clear()
+
+
+def prerender(directory):
+    """
+    Renders the pages into the directory, returns their template names.
+    """
+    for template_name in TEMPLATES:
+        Page.render(template_name).save(directory, template_name)
+    return list(TEMPLATES)
+
+
+def template_changed(sender, file_path, **kwargs):
+    # connected to autoreload.file_changed in DEBUG, see PagesConfig.ready()
+    if any(directory in Path(file_path).parents for directory in get_template_directories()):
+        clear()
+
+
+def prerendered(template_name):
+    """
+    Serves the view's page pre-rendered from template_name, which mustn't use the request or the context of the
+    view.
+    """
+    TEMPLATES.append(template_name)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'PAGES_PRERENDER', True) or request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            page = get_page(template_name)
+            encoding = page.encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            if set(parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))) & {'*', *page.etags.values()}:
+                response = HttpResponseNotModified()
+            else:
+                response = HttpResponse(page.variants[encoding], content_type='text/html; charset=utf-8')
+                response['Content-Length'] = len(page.variants[encoding])
+                if encoding != 'identity':
+                    response['Content-Encoding'] = encoding
+            response['ETag'] = page.etags[encoding]
+            response['Cache-Control'] = f'public, max-age={getattr(settings, "PAGES_MAX_AGE", 24 * 60 * 60)}'
+            response['Vary'] = 'Accept-Encoding'
+            return response
+        return wrapper
+    return decorator
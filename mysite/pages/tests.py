@@ -1,3 +1,113 @@
-from django.test import TestCase
+import gzip
+import os
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.template import loader
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from pages import prerender
+
+
+class PrerenderedPageTests(TestCase):
+
+    def setUp(self):
+        prerender.clear()
+        self.addCleanup(prerender.clear)
+
+    def test_gzip_variant(self):
+        response = self.client.get(reverse('pages:index'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content).decode(), loader.render_to_string('pages/index.html'))
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]{32}-gzip"$')
+
+    def test_identity_variant(self):
+        for accept_encoding in ('', 'gzip;q=0', 'compress'):
+            response = self.client.get(reverse('pages:about'), HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(response.content.decode(), loader.render_to_string('pages/about.html'))
+            self.assertRegex(response['ETag'], r'-identity"$')
+
+    @skipUnless(prerender.brotli, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self.client.get(reverse('pages:index'), HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(prerender.brotli.decompress(response.content).decode(),
+                         loader.render_to_string('pages/index.html'))
+
+    @skipIf(prerender.brotli, 'brotli is installed')
+    def test_no_brotli_variant_without_brotli(self):
+        response = self.client.get(reverse('pages:index'), HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_not_modified(self):
+        etag = self.client.get(reverse('pages:index'), HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        # any variant's ETag is current, the response carries the one of the negotiated variant
+        response = self.client.get(reverse('pages:index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertRegex(response['ETag'], r'-identity"$')
+        self.assertEqual(self.client.get(reverse('pages:index'), HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_rendered_once(self):
+        with mock.patch('pages.prerender.render_to_string', wraps=loader.render_to_string) as render:
+            for _ in range(3):
+                self.client.get(reverse('pages:index'), HTTP_ACCEPT_ENCODING='gzip')
+                self.client.get(reverse('pages:index'))
+        self.assertEqual(render.call_count, 1)
+
+    @override_settings(PAGES_PRERENDER=False)
+    def test_rendered_per_request_when_off(self):
+        response = self.client.get(reverse('pages:index'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('ETag'))
+        self.assertTemplateUsed(response, 'pages/index.html')
+
+    def test_template_change_renders_again(self):
+        self.client.get(reverse('pages:index'))
+        template = Path(loader.get_template('pages/index.html').origin.name)
+        with mock.patch('pages.prerender.render_to_string', return_value='changed'):
+            # ignored outside the template directories
+            prerender.template_changed(None, file_path=Path(__file__))
+            self.assertNotEqual(self.client.get(reverse('pages:index')).content, b'changed')
+            prerender.template_changed(None, file_path=template)
+            self.assertEqual(self.client.get(reverse('pages:index')).content, b'changed')
+
+    def test_template_change_renders_again_in_debug(self):
+        # without the autoreloader, e.g. runserver --noreload
+        with tempfile.TemporaryDirectory() as directory:
+            template = Path(directory, 'pages', 'index.html')
+            template.parent.mkdir()
+            template.write_text('first')
+            templates = [{**settings.TEMPLATES[0], 'DIRS': [directory]}]
+            with override_settings(DEBUG=True, TEMPLATES=templates):
+                self.assertEqual(self.client.get(reverse('pages:index')).content, b'first')
+                self.assertEqual(self.client.get(reverse('pages:index')).content, b'first')
+                template.write_text('second')
+                # a later modification time than the first version, however coarse the file system's clock is
+                os.utime(template, ns=(template.stat().st_atime_ns, template.stat().st_mtime_ns + 10 ** 9))
+                self.assertEqual(self.client.get(reverse('pages:index')).content, b'second')
+
+    def test_prerender_command(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(PAGES_PRERENDER_DIR=directory):
+            out = StringIO()
+            call_command('prerender_pages', stdout=out)
+            self.assertIn('Rendered pages/index.html', out.getvalue())
+            index = Path(directory, 'pages', 'index.html')
+            self.assertEqual(gzip.decompress(Path(directory, 'pages', 'index.html.gz').read_bytes()),
+                             index.read_bytes())
+
+            # processes serve the pages of the directory
+            index.write_bytes(b'deployed')
+            self.assertEqual(self.client.get(reverse('pages:index')).content, b'deployed')
+            # except in DEBUG
+            prerender.clear()
+            with override_settings(DEBUG=True):
+                self.assertNotEqual(self.client.get(reverse('pages:index')).content, b'deployed')
@@ -1,9 +1,13 @@
 from django.shortcuts import render
 
+from .prerender import prerendered
 
+
+@prerendered('pages/index.html')
 def index(request):
     return render(request, 'pages/index.html')
 
 
+@prerendered('pages/about.html')
 def about(request):
     return render(request, 'pages/about.html')
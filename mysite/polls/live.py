@@ -0,0 +1,100 @@
+"""
+Live poll results.
+
+Every watcher of a poll's results holds an open event stream (see common/asgi.py). The watchers of a question share
+one Tally per event loop: while it has watchers, it aggregates the votes of the question once per tick
+(POLLS_LIVE_TICK milliseconds) and wakes the watchers when the votes changed. All votes of a tick are one update,
+and a tick costs one query however many people watch.
+"""
+import asyncio
+import json
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from common.asgi import event
+from .models import Choice
+
+# seconds without a change after which a comment is sent, so that proxies keep the connection open
+HEARTBEAT = 15
+
+# the tallies of the watched questions, per event loop
+_tallies = weakref.WeakKeyDictionary()
+
+
+def _tick():
+    return getattr(settings, 'POLLS_LIVE_TICK', 500) / 1000
+
+
+def tally(question_id):
+    """
+    The total votes of every choice of the question, by choice id.
+    """
+    return dict(Choice.objects.filter(question=question_id).with_total_votes().values_list('id', 'total_votes'))
+
+
+def tally_event(votes):
+    return event(json.dumps({'votes': votes}))
+
+
+class Tally:
+    def __init__(self, tallies, question_id):
+        self.tallies = tallies
+        self.question_id = question_id
+        self.watchers = 0
+        self.votes = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def watch(self):
+        self.watchers += 1
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def unwatch(self):
+        self.watchers -= 1
+        if not self.watchers:
+            self._task.cancel()
+            del self.tallies[self.question_id]
+
+    async def _run(self):
+        while True:
+            votes = await sync_to_async(tally)(self.question_id)
+            if votes != self.votes:
+                self.votes = votes
+                # wakes the current watchers, later ones wait for the new event
+                changed, self._changed = self._changed, asyncio.Event()
+                changed.set()
+            await asyncio.sleep(_tick())
+
+    async def changes(self):
+        """
+        Yields the votes as soon as they are known and then after every change.
+        """
+        seen = None
+        while True:
+            if self.votes is not None and self.votes is not seen:
+                seen = self.votes
+                yield seen
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield None
+
+
+async def updates(question_id):
+    """
+    The event stream of a question's results: a tally event whenever the votes change, a comment as heartbeat.
+    """
+    tallies = _tallies.setdefault(asyncio.get_running_loop(), {})
+    watched = tallies.get(question_id)
+    if watched is None:
+        watched = tallies[question_id] = Tally(tallies, question_id)
+    watched.watch()
+    try:
+        async for votes in watched.changes():
+            yield b': heartbeat\n\n' if votes is None else tally_event(votes)
+    finally:
+        watched.unwatch()
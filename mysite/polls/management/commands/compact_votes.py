@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.models import Choice
+
+
+class Command(BaseCommand):
+    help = 'Moves the votes counted in the vote shards into Choice.votes. Safe to run while people vote, ' \
+           'e.g. periodically with --loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question', type=int, help='Only compact the choices of this question.')
+        parser.add_argument('--loop', action='store_true', help='Keep compacting until interrupted.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between two runs with --loop.')
+
+    def handle(self, *args, **options):
+        choices = Choice.objects.all()
+        if options['question']:
+            choices = choices.filter(question=options['question'])
+        while True:
+            moved = choices.compact_votes()
+            if moved or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Compacted {moved} vote(s).'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
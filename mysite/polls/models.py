@@ -1,6 +1,10 @@
 import datetime
+import random
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 
@@ -15,10 +19,69 @@ class Question(models.Model):
         return timezone.now() >= self.pub_date >= timezone.now() - datetime.timedelta(days=1)
 
 
+class ChoiceQuerySet(models.QuerySet):
+    def with_total_votes(self):
+        """
+        Annotates total_votes: the compacted votes of the choice plus the votes still in its shards.
+        """
+        shards = VoteShard.objects.filter(choice=OuterRef('pk')).order_by().values('choice') \
+            .annotate(votes=Sum('votes')).values('votes')
+        return self.annotate(total_votes=F('votes') + Coalesce(Subquery(shards), 0))
+
+    def compact_votes(self):
+        """
+        Moves the votes of the shards into Choice.votes, one transaction per choice. Returns the number of moved
+        votes. Votes cast meanwhile stay in the shards: each shard is decremented by what was read from it.
+        """
+        moved = 0
+        choices = VoteShard.objects.filter(choice__in=self, votes__gt=0).order_by('choice') \
+            .values_list('choice', flat=True).distinct()
+        for choice_id in list(choices):
+            with transaction.atomic():
+                shards = list(VoteShard.objects.filter(choice=choice_id, votes__gt=0).values_list('pk', 'votes'))
+                for pk, votes in shards:
+                    VoteShard.objects.filter(pk=pk).update(votes=F('votes') - votes)
+                total = sum(votes for _, votes in shards)
+                Choice.objects.filter(pk=choice_id).update(votes=F('votes') + total)
+            moved += total
+        return moved
+
+
 class Choice(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    # the compacted votes, the total is with_total_votes()
     votes = models.IntegerField(default=0)
 
+    objects = ChoiceQuerySet.as_manager()
+
+    def __str__(self):
+        return self.choice_text
+
+    def add_vote(self):
+        """
+        Counts a vote in one of the POLLS_VOTE_SHARDS shards of the choice, picked at random, so concurrent votes
+        for a popular choice don't all wait for the lock of the same row. The increment happens in the database.
+        """
+        shard = random.randrange(getattr(settings, 'POLLS_VOTE_SHARDS', 16))
+        shards = VoteShard.objects.filter(choice=self, shard=shard)
+        if not shards.update(votes=F('votes') + 1):
+            # the first vote of the shard: create it, unless a concurrent vote just did, and count again
+            VoteShard.objects.bulk_create([VoteShard(choice=self, shard=shard)], ignore_conflicts=True)
+            shards.update(votes=F('votes') + 1)
+
+
+class VoteShard(models.Model):
+    """
+    Uncompacted votes of a choice, spread over several rows (see Choice.add_vote()). The compact_votes command
+    moves them into Choice.votes.
+    """
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='vote_shards')
+    shard = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('choice', 'shard')
+
     def __str__(self):
-        return self.choice_text
\ No newline at end of file
+        return f'{self.choice} #{self.shard}'
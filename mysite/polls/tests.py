@@ -1,9 +1,21 @@
+import asyncio
 import datetime
+import json
+import threading
+from contextlib import contextmanager
+from io import StringIO
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
 from django.utils import timezone
 
-from polls.models import Question
+from common.asgi import ASGIHandler
+from polls import live
+from polls.models import Choice, Question, VoteShard
 
 
 class PollsTests(TestCase):
@@ -28,4 +40,268 @@ class PollsTests(TestCase):
         """
         time = timezone.now() - datetime.timedelta(hours=23, minutes=59, seconds=59)
         recent_question = Question(pub_date=time)
-        self.assertIs(recent_question.was_published_recently(), True)
\ No newline at end of file
+        self.assertIs(recent_question.was_published_recently(), True)
+
+
+class VoteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = Question.objects.create(question_text='Best colour?', pub_date=timezone.now())
+        cls.red = cls.question.choice_set.create(choice_text='red')
+        cls.blue = cls.question.choice_set.create(choice_text='blue')
+
+    def totals(self):
+        return dict(self.question.choice_set.with_total_votes().values_list('choice_text', 'total_votes'))
+
+    def test_vote_counts_in_shards(self):
+        for _ in range(20):
+            response = self.client.post(reverse('polls:vote', args=[self.question.pk]), {'choice': self.red.pk})
+            self.assertRedirects(response, reverse('polls:results', args=[self.question.pk]))
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 0)
+        self.assertLessEqual(self.red.vote_shards.count(), 16)
+        self.assertEqual(self.totals(), {'red': 20, 'blue': 0})
+
+    @override_settings(POLLS_VOTE_SHARDS=1)
+    def test_vote_is_a_single_update(self):
+        self.red.add_vote()
+        with self.assertNumQueries(1):
+            self.red.add_vote()
+
+    def test_compact_votes_keeps_the_totals(self):
+        for _ in range(30):
+            self.red.add_vote()
+        self.blue.add_vote()
+        out = StringIO()
+        call_command('compact_votes', stdout=out)
+        self.assertIn('Compacted 31 vote(s)', out.getvalue())
+        self.assertEqual(self.totals(), {'red': 30, 'blue': 1})
+        self.assertEqual(dict(Choice.objects.values_list('choice_text', 'votes')), {'red': 30, 'blue': 1})
+        self.assertFalse(VoteShard.objects.filter(votes__gt=0).exists())
+
+        self.blue.add_vote()
+        self.assertEqual(self.totals(), {'red': 30, 'blue': 2})
+
+    def test_results_show_total_votes(self):
+        self.red.add_vote()
+        Choice.objects.compact_votes()
+        self.red.add_vote()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('polls:results', args=[self.question.pk]))
+        self.assertContains(response, f'red -- <span data-choice="{self.red.pk}">2 votes</span>', html=True)
+        self.assertContains(response, f'blue -- <span data-choice="{self.blue.pk}">0 votes</span>', html=True)
+
+
+def votes_of(chunk):
+    """
+    The votes of an encoded tally event, by choice id.
+    """
+    data = chunk.decode().split('data: ', 1)[1]
+    return {int(choice): votes for choice, votes in json.loads(data)['votes'].items()}
+
+
+@override_settings(POLLS_LIVE_TICK=20)
+class LiveResultsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = Question.objects.create(question_text='Best colour?', pub_date=timezone.now())
+        cls.red = cls.question.choice_set.create(choice_text='red')
+        cls.blue = cls.question.choice_set.create(choice_text='blue')
+
+    def url(self):
+        return reverse('polls:results_events', args=[self.question.pk])
+
+    def vote(self, choice, count):
+        for _ in range(count):
+            choice.add_vote()
+
+    async def test_stream_pushes_coalesced_votes(self):
+        response = await self.async_client.get(self.url())
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.stream()
+        try:
+            self.assertEqual(await events.__anext__(), b'retry: 3000\n\n')
+            first = await asyncio.wait_for(events.__anext__(), 5)
+            self.assertEqual(votes_of(first), {self.red.pk: 0, self.blue.pk: 0})
+            # votes cast within a tick are one update
+            await sync_to_async(self.vote)(self.red, 5)
+            second = await asyncio.wait_for(events.__anext__(), 5)
+            self.assertEqual(votes_of(second), {self.red.pk: 5, self.blue.pk: 0})
+        finally:
+            await events.aclose()
+
+    async def test_watchers_share_one_query_per_tick(self):
+        with mock.patch('polls.live.tally', wraps=live.tally) as tally:
+            watchers = [live.updates(self.question.pk) for _ in range(200)]
+            try:
+                first = await asyncio.wait_for(asyncio.gather(*[watcher.__anext__() for watcher in watchers]), 5)
+                self.assertEqual({votes_of(chunk)[self.red.pk] for chunk in first}, {0})
+                await sync_to_async(self.vote)(self.red, 3)
+                second = await asyncio.wait_for(asyncio.gather(*[watcher.__anext__() for watcher in watchers]), 5)
+                self.assertEqual({votes_of(chunk)[self.red.pk] for chunk in second}, {3})
+                # one aggregation per tick, not per watcher
+                self.assertLess(tally.call_count, 20)
+            finally:
+                for watcher in watchers:
+                    await watcher.aclose()
+        # the last watcher leaving stops the ticks
+        self.assertEqual(live._tallies[asyncio.get_running_loop()], {})
+
+    def test_unknown_question(self):
+        response = self.client.get(reverse('polls:results_events', args=[self.question.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_wsgi_sends_a_snapshot(self):
+        self.vote(self.blue, 2)
+        response = self.client.get(self.url())
+        retry, snapshot = list(response.streaming_content)
+        self.assertEqual(retry, b'retry: 3000\n\n')
+        self.assertEqual(votes_of(snapshot), {self.red.pk: 0, self.blue.pk: 2})
+
+
+@override_settings(POLLS_LIVE_TICK=20)
+class LiveResultsASGITests(TransactionTestCase):
+
+    async def test_streams_until_the_client_disconnects(self):
+        question = await sync_to_async(Question.objects.create)(question_text='Best colour?', pub_date=timezone.now())
+        red = await sync_to_async(question.choice_set.create)(choice_text='red')
+        disconnected = asyncio.Event()
+        requested = False
+        messages = []
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if len(messages) == 3:
+                # the start, the retry and the first tally
+                disconnected.set()
+
+        scope = {'type': 'http', 'method': 'GET', 'path': f'/polls/{question.pk}/results/events/',
+                 'query_string': b'', 'headers': [], 'server': ('testserver', 80)}
+        await asyncio.wait_for(ASGIHandler()(scope, receive, send), 5)
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream'), messages[0]['headers'])
+        self.assertEqual(votes_of(messages[2]['body']), {red.pk: 0})
+        self.assertEqual(live._tallies[asyncio.get_running_loop()], {})
+
+
+@override_settings(POLLS_VOTE_SHARDS=1)
+class InterleavedVoteTests(TestCase):
+    """
+    Runs the statements of a concurrent vote between the statements of add_vote() and compact_votes(), in the order
+    they can interleave with several connections, on any database. ConcurrentVoteTests does it with real threads.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = Question.objects.create(question_text='Best colour?', pub_date=timezone.now())
+        cls.red = cls.question.choice_set.create(choice_text='red')
+
+    @contextmanager
+    def before(self, statement, action):
+        """
+        Calls action right before the first statement that contains statement, once.
+        """
+        pending = [action]
+
+        def wrapper(execute, sql, params, many, context):
+            if pending and statement in sql:
+                pending.pop()()
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(wrapper):
+            yield
+        self.assertEqual(pending, [], f'no statement contains {statement}')
+
+    def total(self):
+        return self.question.choice_set.with_total_votes().get().total_votes
+
+    def test_vote_while_the_shard_is_created(self):
+        with self.before('INTO "polls_voteshard"', self.red.add_vote):
+            self.red.add_vote()
+        self.assertEqual(VoteShard.objects.get().votes, 2)
+
+    def test_vote_while_compacting(self):
+        for _ in range(3):
+            self.red.add_vote()
+
+        def votes():
+            # after the shard was read, before it is decremented
+            for _ in range(2):
+                self.red.add_vote()
+
+        with self.before('UPDATE "polls_voteshard" SET "votes" = ("polls_voteshard"."votes" - ', votes):
+            self.assertEqual(Choice.objects.compact_votes(), 3)
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 3)
+        self.assertEqual(VoteShard.objects.get().votes, 2)
+        self.assertEqual(self.total(), 5)
+
+    def test_vote_between_shard_and_choice_update(self):
+        self.red.add_vote()
+        with self.before('UPDATE "polls_choice"', self.red.add_vote):
+            Choice.objects.compact_votes()
+        self.assertEqual(self.total(), 2)
+        self.assertEqual(Choice.objects.compact_votes(), 1)
+        self.assertEqual(self.total(), 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs a database that allows concurrent connections')
+class ConcurrentVoteTests(TransactionTestCase):
+
+    def test_concurrent_votes_are_all_counted(self):
+        question = Question.objects.create(question_text='Best colour?', pub_date=timezone.now())
+        choices = [question.choice_set.create(choice_text=text) for text in ('red', 'blue')]
+        threads, votes_per_thread = 20, 150
+        errors = []
+        voting = threading.Event()
+
+        def vote(index):
+            try:
+                for i in range(votes_per_thread):
+                    # two thirds of the votes for red
+                    choices[(index + i) % 3 == 0].add_vote()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        def compact():
+            # compacts while the votes come in
+            try:
+                while voting.is_set():
+                    Choice.objects.compact_votes()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        voting.set()
+        compactor = threading.Thread(target=compact)
+        compactor.start()
+        voters = [threading.Thread(target=vote, args=[index]) for index in range(threads)]
+        for thread in voters:
+            thread.start()
+        for thread in voters:
+            thread.join()
+        voting.clear()
+        compactor.join()
+        self.assertEqual(errors, [])
+
+        expected = {'red': 0, 'blue': 0}
+        for index in range(threads):
+            for i in range(votes_per_thread):
+                expected['blue' if (index + i) % 3 == 0 else 'red'] += 1
+        totals = dict(question.choice_set.with_total_votes().values_list('choice_text', 'total_votes'))
+        self.assertEqual(totals, expected)
+        self.assertEqual(sum(totals.values()), threads * votes_per_thread)
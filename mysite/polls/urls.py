@@ -17,5 +17,6 @@ urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results/events/', views.results_events, name='results_events'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
 ]
\ No newline at end of file
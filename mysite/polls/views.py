@@ -1,11 +1,14 @@
 import json
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponse, Http404, HttpResponseRedirect
 from django.template import loader
 from django.urls import reverse
 from django.views import generic
 
+from common.asgi import EventStreamResponse
+from . import live
 from .models import Question, Choice
 
 
@@ -32,6 +35,19 @@ class ResultsView(generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
+    def get_context_data(self, **kwargs):
+        # the votes are summed over the vote shards of every choice, in the same query
+        kwargs['choices'] = self.object.choice_set.with_total_votes()
+        return super().get_context_data(**kwargs)
+
+
+async def results_events(request, pk):
+    """
+    Pushes the votes of the question to the results page whenever they change (see live.py).
+    """
+    question = await sync_to_async(get_object_or_404)(Question, pk=pk)
+    return EventStreamResponse(live.updates(question.pk), snapshot=lambda: [live.tally_event(live.tally(question.pk))])
+
 
 #def index(request):
 #    latest_question_list = Question.objects.order_by('-pub_date')[:5]
@@ -65,8 +81,8 @@ def vote(request, question_id):
             'error_message': "You didn't select a choice.",
         })
     else:
-        selected_choice.votes += 1
-        selected_choice.save()
+        # incremented in the database, a read-modify-write of choice.votes would lose concurrent votes
+        selected_choice.add_vote()
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.